@@ -0,0 +1,156 @@
+import os
+import shutil
+import logging
+import tempfile
+from Captions import write_ass
+from FfmpegTools import probe, run_ffmpeg, concat_files
+from SplitVideo import sort_by_order, validate_segments
+from TranscriptCache import get_words, remap_words
+from EncodeProfiles import get_profile, ffmpeg_args
+from getClips import short_filtergraph
+from metrics import JobTrace
+from makeVid import caption_font_size
+
+logger = logging.getLogger('BatchRender')
+
+# Segments closer than this are decoded as one range rather than seeking twice
+BATCH_MERGE_GAP = float(os.getenv('BATCH_MERGE_GAP', 1))  # seconds
+
+
+def merge_ranges(segments, gap=BATCH_MERGE_GAP):
+    """Union of (start, end) source ranges, joining ranges that overlap or are within `gap`"""
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def plan_batch(shorts):
+    """Assign every (short, segment) piece to the merged source range that contains it.
+
+    Returns [(range, [piece, ...])] in source order; each piece has the short's index and its
+    place in the short.
+    """
+    pieces = []
+    for index, short in enumerate(shorts):
+        for order, point in enumerate(sorted(short['segments'], key=sort_by_order)):
+            pieces.append({'short': index, 'order': order, 'start': float(point['start']),
+                           'end': float(point['end'])})
+    ranges = merge_ranges([(p['start'], p['end']) for p in pieces])
+    plan = [(r, []) for r in ranges]
+    for piece in pieces:
+        for r, members in plan:
+            if r[0] <= piece['start'] and piece['end'] <= r[1]:
+                members.append(piece)
+                break
+    return plan
+
+
+def _range_command(vid, source_range, pieces, outputs, infos, crop, captions, profiles, work_dir):
+    """ffmpeg arguments decoding one source range once and encoding every piece inside it.
+
+    The decoded frames are split to one branch per piece; each branch trims its window, gets
+    the short's layout and the piece's captions and goes to its own output file, so frames
+    outside a piece's window are dropped rather than buffered.
+    """
+    start, end = source_range
+    fps = infos['video_fps']
+    audio = bool(infos.get('audio_found'))
+    count = len(pieces)
+    graph = [f"[0:v]split={count}" + ''.join(f"[src{i}]" for i in range(count))]
+    if audio:
+        graph.append(f"[0:a]asplit={count}" + ''.join(f"[asrc{i}]" for i in range(count)))
+    args = ['-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', vid]
+    output_args = []
+    for i, (piece, output) in enumerate(zip(pieces, outputs)):
+        profile = profiles[piece['short']]
+        a, b = piece['start'] - start, piece['end'] - start
+        graph.append(f"[src{i}]trim=start={a:.3f}:end={b:.3f},setpts=PTS-STARTPTS[in{i}]")
+        graph.append(short_filtergraph(infos['video_size'], fps, profile['size'],
+                                       captions[piece['short'], piece['order']], crop=crop, source=f"[in{i}]",
+                                       label=f"p{i}"))
+        if profile['fps']:
+            # Resample in the graph; -r on the output pads the last frame out to extra frames
+            graph.append(f"[p{i}v]fps={profile['fps']}[v{i}]")
+        else:
+            graph.append(f"[p{i}v]null[v{i}]")
+        maps = ['-map', f"[v{i}]"]
+        if audio:
+            graph.append(f"[asrc{i}]atrim=start={a:.3f}:end={b:.3f},asetpts=PTS-STARTPTS[a{i}]")
+            maps += ['-map', f"[a{i}]"]
+        output_args += [*maps, *ffmpeg_args(profile, profile['fps'] or fps), output]
+    graph_path = os.path.join(work_dir, f"range_{start:.3f}.graph")
+    with open(graph_path, 'w') as f:
+        f.write(';'.join(graph))
+    return [*args, '-filter_complex_script', graph_path, *output_args]
+
+
+def render_batch(shorts, vid, progress=None, model_size=None, crop=None, trace=None):
+    """Render several shorts of one source, decoding each source second once.
+
+    `shorts` is a list of {'segments', 'output_path', 'profile'}. The transcript is read once
+    for the whole source. Segments of all shorts are merged into source ranges; each range is
+    decoded by one ffmpeg process that encodes every piece falling inside it, and each short
+    is then joined from its pieces with stream copy. Decoding and transcription scale with the
+    unique source seconds; only encoding scales with the number of shorts.
+    """
+    def report(stage, fraction):
+        if progress is not None:
+            progress(stage, fraction)
+
+    trace = trace or JobTrace()
+    with trace.stage('probe'):
+        infos = probe(vid)
+        for short in shorts:
+            validate_segments(short['segments'], infos.get('duration'))
+    profiles = [get_profile(short.get('profile')) for short in shorts]
+
+    report('transcribe', 0.0)
+    with trace.stage('transcribe'):
+        words = get_words(vid, model_size)
+
+    plan = plan_batch(shorts)
+    unique_seconds = sum(end - start for (start, end), _ in plan)
+    frames = sum(int((p['end'] - p['start']) * (profiles[p['short']]['fps'] or infos['video_fps']))
+                 for _, pieces in plan for p in pieces)
+    logger.info(f"Batch of {len(shorts)} shorts: {unique_seconds:.1f}s of unique source in {len(plan)} range(s)")
+
+    work_dir = tempfile.mkdtemp(prefix='batch_', dir=os.path.dirname(shorts[0]['output_path']) or None)
+    try:
+        # One track per piece, timed from the piece's first frame like the pieces themselves
+        captions = {}
+        for _, pieces in plan:
+            for p in pieces:
+                size = profiles[p['short']]['size']
+                segment = [{'start': p['start'], 'end': p['end'], 'order': 0}]
+                captions[p['short'], p['order']] = write_ass(
+                    remap_words(words, segment), os.path.join(work_dir, f"captions{p['short']}_{p['order']}.ass"),
+                    size, font_size=caption_font_size(size))
+
+        report('encode', 0.2)
+        piece_paths = [dict() for _ in shorts]
+        done = 0.0
+        with trace.stage('encode', frames) as stage:
+            stage['unique_seconds'] = round(unique_seconds, 3)
+            stage['shorts'] = len(shorts)
+            for source_range, pieces in plan:
+                outputs = [os.path.join(work_dir, f"short{p['short']}_piece{p['order']}.mp4") for p in pieces]
+                run_ffmpeg(_range_command(vid, source_range, pieces, outputs, infos, crop, captions, profiles,
+                                          work_dir))
+                for piece, output in zip(pieces, outputs):
+                    piece_paths[piece['short']][piece['order']] = output
+                done += source_range[1] - source_range[0]
+                report('encode', 0.2 + 0.75 * done / unique_seconds)
+
+        with trace.stage('concat'):
+            for index, short in enumerate(shorts):
+                paths = [piece_paths[index][order] for order in sorted(piece_paths[index])]
+                concat_files(paths, short['output_path'], os.path.join(work_dir, f"short{index}.txt"),
+                             extra_args=['-movflags', '+faststart'])
+        report('encode', 1.0)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return [short['output_path'] for short in shorts]
@@ -0,0 +1,120 @@
+from bisect import bisect_right
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+
+FONT_DIR = 'Fonts'
+
+
+@lru_cache(maxsize=16)
+def load_font(font, font_size):
+    return ImageFont.truetype(f'{FONT_DIR}/{font}', font_size)
+
+
+@lru_cache(maxsize=4096)
+def rasterize_word(text, font, font_size, color, stroke_color, stroke_width):
+    """Render a word once and keep it as (rgb, alpha) arrays ready for blitting"""
+    pil_font = load_font(font, font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox(
+        (0, 0), text, font=pil_font, stroke_width=stroke_width)
+    image = Image.new('RGBA', (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(image).text(
+        (-left, -top), text, font=pil_font, fill=color,
+        stroke_width=stroke_width, stroke_fill=stroke_color)
+    pixels = np.asarray(image, dtype=np.float32)
+    alpha = pixels[:, :, 3:] / 255.0
+    return pixels[:, :, :3] * alpha, 1.0 - alpha
+
+
+def build_index(words):
+    """Sort words by start time so the active word can be found with bisect"""
+    ordered = sorted(words, key=lambda w: w['start'])
+    return [w['start'] for w in ordered], [w['end'] for w in ordered], [w['word'] for w in ordered]
+
+
+def active_word(index, t):
+    starts, ends, texts = index
+    i = bisect_right(starts, t) - 1
+    if i >= 0 and t < ends[i]:
+        return texts[i]
+    return None
+
+
+def blit(frame, glyph):
+    """Alpha-blend a pre-rendered glyph onto the centre of the frame"""
+    premultiplied, inverse_alpha = glyph
+    height, width = frame.shape[:2]
+    glyph_h, glyph_w = inverse_alpha.shape[:2]
+    x = (width - glyph_w) // 2
+    y = (height - glyph_h) // 2
+    # Clip the glyph to the frame when it is wider or taller than the video
+    gx, gy = max(0, -x), max(0, -y)
+    x, y = max(0, x), max(0, y)
+    w = min(glyph_w - gx, width - x)
+    h = min(glyph_h - gy, height - y)
+    region = frame[y:y + h, x:x + w]
+    region[:] = (premultiplied[gy:gy + h, gx:gx + w]
+                 + region * inverse_alpha[gy:gy + h, gx:gx + w]).astype(np.uint8)
+    return frame
+
+
+def add_captions(clip, words, font="ComicRelief.ttf", font_size=28, color='yellow',
+                 stroke_color='black', stroke_width=1):
+    """Overlay the currently spoken word on each frame as a single caption layer"""
+    index = build_index(words)
+
+    def caption(get_frame, t):
+        frame = get_frame(t)
+        text = active_word(index, t)
+        if text is None:
+            return frame
+        glyph = rasterize_word(text.strip(), font, font_size, color, stroke_color, stroke_width)
+        return blit(frame.copy(), glyph)
+
+    return clip.transform(caption, apply_to=[])
+
+
+def _srt_time(seconds):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02},{millis:03}"
+
+
+def _ass_time(seconds):
+    centis = int(round(seconds * 100))
+    hours, centis = divmod(centis, 360000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f"{hours}:{minutes:02}:{secs:02}.{centis:02}"
+
+
+def _ass_color(color):
+    red, green, blue = ImageColor.getrgb(color)[:3]
+    return f"&H00{blue:02X}{green:02X}{red:02X}"
+
+
+def write_srt(words, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, word in enumerate(sorted(words, key=lambda w: w['start']), start=1):
+            f.write(f"{i}\n{_srt_time(word['start'])} --> {_srt_time(word['end'])}\n{word['word'].strip()}\n\n")
+    return path
+
+
+def write_ass(words, path, size, font="ComicRelief.ttf", font_size=28, color='yellow',
+              stroke_color='black', stroke_width=1):
+    """Write an ASS track matching add_captions, for burning in with ffmpeg's subtitles filter
+    (e.g. -vf subtitles=track.ass:fontsdir=Fonts)"""
+    font_name = load_font(font, font_size).getname()[0]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[Script Info]\nScriptType: v4.00+\n")
+        f.write(f"PlayResX: {size[0]}\nPlayResY: {size[1]}\nScaledBorderAndShadow: yes\n\n")
+        f.write("[V4+ Styles]\n")
+        f.write("Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, BorderStyle, Outline, Shadow, Alignment\n")
+        f.write(f"Style: Caption,{font_name},{font_size},{_ass_color(color)},{_ass_color(stroke_color)},"
+                f"1,{stroke_width},0,5\n\n")
+        f.write("[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+        for word in sorted(words, key=lambda w: w['start']):
+            f.write(f"Dialogue: 0,{_ass_time(word['start'])},{_ass_time(word['end'])},Caption,,0,0,0,,{word['word'].strip()}\n")
+    return path
@@ -2,24 +2,25 @@
 # import os
 #
 
-from moviepy import VideoFileClip
+import subprocess
 import numpy as np
+from moviepy.config import FFMPEG_BINARY
+from FfmpegTools import probe
 
+CROP_SCALE = 4  # analysis runs on 1/CROP_SCALE size luma frames
+CROP_THRESHOLD = 24  # luma at or below this counts as black
+CROP_MIN_SAVING = 0.03  # ignore bars thinner than this fraction of the frame
 
-def detect_black_bars(frame: np.ndarray, threshold: int = 15) -> tuple:
-    """Detect black bars using numpy vectorization for better performance."""
-    # Convert to grayscale if color image
-    if frame.ndim == 3:
-        gray = np.mean(frame, axis=2).astype(np.uint8)
-    else:
-        gray = frame
 
-    # Create mask of non-black pixels using vectorized operations
-    non_black_mask = gray > threshold
+def detect_black_bars(frame: np.ndarray, threshold: int = CROP_THRESHOLD) -> tuple:
+    """Bounds (top, bottom, left, right) of the non-black area of a uint8 frame, or None if all black."""
+    # Any channel above threshold is content; stays uint8, no float copy of the frame
+    non_black_mask = (frame.max(axis=2) if frame.ndim == 3 else frame) > threshold
 
-    # Find boundaries using argmax for vectorized computation
     rows = np.any(non_black_mask, axis=1)
     cols = np.any(non_black_mask, axis=0)
+    if not rows.any():
+        return None
 
     top = np.argmax(rows)
     bottom = len(rows) - np.argmax(rows[::-1])
@@ -29,46 +30,70 @@ def detect_black_bars(frame: np.ndarray, threshold: int = 15) -> tuple:
     return top, bottom, left, right
 
 
-def remove_black_bars(
-        clip,
-        sample_time: float = 2.0,
-        margin: int = 1,
-        analysis_frames: int = 3):
-    """Remove black bars using modern MoviePy v2.0+ features."""
-    # Analyze multiple frames for better accuracy
-    sample_times = np.linspace(sample_time, clip.duration * 0.5, analysis_frames)
-    boundaries = []
-    for t in sample_times:
-        frame = clip.get_frame(t)
-        boundaries.append(detect_black_bars(frame))
-
-        # Use median values to handle varying black bars
+def _luma_keyframes(path, width, height):
+    """Yield downscaled grayscale keyframes, decoded by ffmpeg without touching the other frames"""
+    cmd = [FFMPEG_BINARY, '-nostdin', '-loglevel', 'error', '-skip_frame', 'nokey', '-i', path,
+           '-map', '0:v:0', '-vf', f"scale={width}:{height}:flags=area,format=gray",
+           '-fps_mode', 'passthrough', '-f', 'rawvideo', '-']
+    frame_size = width * height
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=frame_size * 4)
+    try:
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield np.frombuffer(data, np.uint8).reshape(height, width)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def detect_crop(path, threshold=CROP_THRESHOLD):
+    """Letterbox/pillarbox crop (x, y, w, h) in source pixels from every keyframe, or None without bars"""
+    width, height = probe(path)['video_size']
+    small_w, small_h = max(2, width // CROP_SCALE // 2 * 2), max(2, height // CROP_SCALE // 2 * 2)
+    boundaries = [bounds for frame in _luma_keyframes(path, small_w, small_h)
+                  if (bounds := detect_black_bars(frame, threshold)) is not None]
+    if not boundaries:
+        return None
+
+    # Median over the whole video so fades and dark scenes don't shrink the picture
     top, bottom, left, right = np.median(boundaries, axis=0).astype(int)
-
-    # Apply safety margin
-    top = max(0, top - margin)
-    bottom = min(clip.size[1], bottom + margin)
-    left = max(0, left - margin)
-    right = min(clip.size[0], right + margin)
-
-    # Calculate crop parameters
-
-    width = right - left
-    height = bottom - top
-    x_center = (left + right) / 2
-    y_center = (top + bottom) / 2
-
-    # Apply crop with modern MoviePy syntax
-    cropped_clip = clip.cropped(
-        x_center=x_center,
-        y_center=y_center,
-        width=width,
-        height=height
-    )
-    # Write output using modern codec options
-    return cropped_clip
-
-
-
-
-# remove_black_bars(vid)
\ No newline at end of file
+    scale_x, scale_y = width / small_w, height / small_h
+    # Step one analysis pixel inwards at each bar: its area average mixes bar and picture
+    x = int((left + 1) * scale_x) if left > 0 else 0
+    y = int((top + 1) * scale_y) if top > 0 else 0
+    x2 = int((right - 1) * scale_x) if right < small_w else width
+    y2 = int((bottom - 1) * scale_y) if bottom < small_h else height
+    x, y = x + x % 2, y + y % 2
+    w, h = (x2 - x) // 2 * 2, (y2 - y) // 2 * 2
+    if w <= 0 or h <= 0 or w * h >= width * height * (1 - CROP_MIN_SAVING):
+        return None
+    return x, y, w, h
+
+
+def format_crop(crop):
+    """Stored form of a crop: 'x:y:w:h', or '' when the video has no bars"""
+    return ':'.join(str(v) for v in crop) if crop else ''
+
+
+def parse_crop(value):
+    return tuple(int(v) for v in value.split(':')) if value else None
+
+
+def scale_crop(crop, from_size, to_size):
+    """Map a crop measured on one rendition (e.g. the original) onto another (e.g. its proxy)"""
+    if crop is None or tuple(from_size) == tuple(to_size):
+        return crop
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    x, y, w, h = crop
+    return (int(x * sx) // 2 * 2, int(y * sy) // 2 * 2, int(w * sx) // 2 * 2, int(h * sy) // 2 * 2)
+
+
+def remove_black_bars(clip, crop):
+    """Apply a crop rectangle from detect_crop to a MoviePy clip."""
+    if crop is None:
+        return clip
+    x, y, w, h = crop
+    return clip.cropped(x1=x, y1=y, width=w, height=h)
@@ -0,0 +1,102 @@
+import os
+
+ENCODE_PROFILE = os.getenv('ENCODE_PROFILE', 'social-1080x1920')  # used when a request names none
+ENCODE_THREADS = int(os.getenv('ENCODE_THREADS', 0))  # x264 threads, 0 lets x264 decide
+PREVIEW_FPS = int(os.getenv('PREVIEW_FPS', 15))
+PREVIEW_PROFILE = 'fast-preview'  # previews render with this unless a request names another
+
+# Named libx264 settings. fps=None keeps the source rate; gop_seconds sets the keyframe interval.
+PROFILES = {
+    'fast-preview': {
+        'size': (360, 640), 'fps': PREVIEW_FPS,
+        'preset': 'ultrafast', 'tune': 'fastdecode', 'crf': 30, 'gop_seconds': 1,
+        'profile': 'baseline', 'audio_bitrate': '64k',
+    },
+    'social-1080x1920': {
+        'size': (1080, 1920), 'fps': None,
+        'preset': 'medium', 'tune': None, 'crf': 21, 'gop_seconds': 2,
+        # Capped VBV keeps peaks within what the platforms re-encode without complaint; level is a
+        # floor, raised to what the output size and frame rate need
+        'profile': 'high', 'level': '4.1', 'maxrate': '8M', 'bufsize': '16M', 'audio_bitrate': '128k',
+    },
+    'archive': {
+        'size': (1080, 1920), 'fps': None,
+        'preset': 'slow', 'tune': 'film', 'crf': 16, 'gop_seconds': 5,
+        'profile': 'high', 'audio_bitrate': '192k',
+    },
+}
+
+
+# H.264 levels as (level, max macroblocks per second, max macroblocks per frame), Table A-1
+H264_LEVELS = [
+    ('3.0', 40500, 1620), ('3.1', 108000, 3600), ('3.2', 216000, 5120),
+    ('4.0', 245760, 8192), ('4.1', 245760, 8192), ('4.2', 522240, 8704),
+    ('5.0', 589824, 22080), ('5.1', 983040, 36864), ('5.2', 2073600, 36864),
+    ('6.0', 4177920, 139264), ('6.1', 8355840, 139264), ('6.2', 16711680, 139264),
+]
+
+
+def h264_level(size, fps, floor=None):
+    """Lowest H.264 level that fits the frame size and rate, and not below floor; None past 6.2"""
+    frame_mbs = -(-size[0] // 16) * -(-size[1] // 16)
+    for level, max_mbps, max_fs in H264_LEVELS:
+        if floor is not None and float(level) < float(floor):
+            continue
+        if frame_mbs <= max_fs and frame_mbs * fps <= max_mbps:
+            return level
+    return None
+
+
+def get_profile(name=None):
+    """Profile settings by name; raises ValueError for unknown names"""
+    name = name or ENCODE_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encode profile '{name}', expected one of {', '.join(PROFILES)}")
+    return dict(PROFILES[name], name=name)
+
+
+def x264_params(profile, fps, gop=True):
+    """ffmpeg output options for the profile's video settings, excluding the codec itself.
+
+    gop=False leaves the keyframe interval to the caller (chunked renders align it themselves).
+    """
+    params = ['-crf', str(profile['crf']), '-pix_fmt', 'yuv420p']
+    if profile.get('tune'):
+        params += ['-tune', profile['tune']]
+    if profile.get('profile'):
+        params += ['-profile:v', profile['profile']]
+    level = profile.get('level') and h264_level(profile['size'], fps, profile['level'])
+    if level:
+        params += ['-level', level]
+    if profile.get('maxrate'):
+        params += ['-maxrate', profile['maxrate'], '-bufsize', profile['bufsize']]
+    if gop:
+        keyint = max(1, int(round(fps * profile['gop_seconds'])))
+        params += ['-g', str(keyint), '-keyint_min', str(min(keyint, max(1, int(fps))))]
+    if ENCODE_THREADS:
+        params += ['-threads', str(ENCODE_THREADS)]
+    return params
+
+
+def audio_args(profile, passthrough=False):
+    """Copy audio that is already AAC and cut to the short; otherwise encode it at the profile bitrate"""
+    if passthrough:
+        return ['-c:a', 'copy']
+    return ['-c:a', 'aac', '-b:a', profile['audio_bitrate']]
+
+
+def ffmpeg_args(profile, fps, passthrough=False):
+    """Complete codec options for an ffmpeg command encoding the short"""
+    return ['-c:v', 'libx264', '-preset', profile['preset'], *x264_params(profile, fps),
+            *audio_args(profile, passthrough)]
+
+
+def moviepy_args(profile, fps, gop=True):
+    """Keyword arguments for MoviePy's write_videofile"""
+    return {
+        'codec': 'libx264',
+        'preset': profile['preset'],
+        'audio_codec': 'aac',
+        'audio_bitrate': profile['audio_bitrate'],
+        'ffmpeg_params': [*x264_params(profile, fps, gop), '-movflags', '+faststart'],
+    }
@@ -0,0 +1,59 @@
+import re
+import subprocess
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+
+def run_ffmpeg(args):
+    """Run ffmpeg with the given arguments, raising RuntimeError with its stderr on failure"""
+    cmd = [FFMPEG_BINARY, '-y', '-nostdin', '-hide_banner', '-loglevel', 'error', *args]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return result
+
+
+def probe(path):
+    """Return MoviePy's parsed ffmpeg info for a file, plus the audio codec name"""
+    infos = ffmpeg_parse_infos(path)
+    infos['audio_codec_name'] = None
+    for source in infos.get('inputs', []):
+        for stream in source.get('streams', []):
+            if stream.get('stream_type') == 'audio':
+                infos['audio_codec_name'] = stream.get('codec_name')
+                break
+    return infos
+
+
+def keyframe_times(path):
+    """Timestamps of the video keyframes, read without decoding the other frames"""
+    cmd = [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-skip_frame', 'nokey', '-i', path,
+           '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    times = re.findall(r'pts_time:\s*(-?[\d.]+)', result.stderr.decode(errors='replace'))
+    return sorted(float(t) for t in times)
+
+
+def frame_times(path):
+    """Presentation times of the video frames, read from the packets without decoding them"""
+    cmd = [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-i', path, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-']
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    output = result.stdout.decode(errors='replace')
+    num, den = re.search(r'^#tb 0: (\d+)/(\d+)', output, re.M).groups()
+    # Lines are: stream, dts, pts, duration, size, hash
+    pts = [int(line.split(',')[2]) for line in output.splitlines() if line and not line.startswith('#')]
+    return sorted(t * int(num) / int(den) for t in pts)
+
+
+def concat_files(paths, output_path, list_path, extra_args=()):
+    """Join files with identical stream layouts using the concat demuxer and stream copy"""
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', *extra_args, output_path])
+    return output_path
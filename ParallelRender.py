@@ -0,0 +1,87 @@
+import os
+import math
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from FfmpegTools import run_ffmpeg, concat_files
+
+logger = logging.getLogger('ParallelRender')
+
+RENDER_CHUNKS = int(os.getenv('RENDER_CHUNKS', 1))  # 1 = single encode, 0 = one per CPU
+RENDER_CHUNK_SECONDS = float(os.getenv('RENDER_CHUNK_SECONDS', 10))  # shortest chunk worth a process
+RENDER_GOP = int(os.getenv('RENDER_GOP', 60))  # frames between keyframes; chunks start on a GOP
+
+
+def chunk_count(duration, chunks=None):
+    """Number of chunks to render, honouring RENDER_CHUNKS and RENDER_CHUNK_SECONDS"""
+    chunks = RENDER_CHUNKS if chunks is None else chunks
+    if chunks == 0:
+        chunks = os.cpu_count() or 1
+    if RENDER_CHUNK_SECONDS > 0:
+        chunks = min(chunks, int(duration // RENDER_CHUNK_SECONDS))
+    return max(1, chunks)
+
+
+def plan_chunks(duration, fps, chunks, gop=RENDER_GOP):
+    """Split the timeline into (first_frame, end_frame) ranges whose lengths are whole GOPs"""
+    total_frames = int(duration * fps)
+    step = max(gop, math.ceil(total_frames / chunks / gop) * gop)
+    return [(start, min(start + step, total_frames)) for start in range(0, total_frames, step)]
+
+
+def _render_chunk(compose, description, first_frame, end_frame, fps, path, gop, write_args):
+    """Rebuild the composition in this process and encode one frame range without audio"""
+    clip = compose(**description)
+    t_start = first_frame / fps
+    # Half a frame of slack so float rounding never drops the last frame of the range
+    t_end = min((end_frame + 0.5) / fps, clip.duration)
+    clip.subclipped(t_start, t_end).write_videofile(
+        path, fps=fps, audio=False, logger=None,
+        ffmpeg_params=['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+                       *write_args.pop('ffmpeg_params', [])],
+        **write_args)
+    clip.close()
+    return path
+
+
+def render_parallel(compose, description, clip, output_path, work_dir, chunks, progress=None,
+                    write_args=None, audio_source=None, fps=None):
+    """Encode `clip` as GOP-aligned chunks in separate processes and join them losslessly.
+
+    Every process rebuilds the clip from compose(**description), so the description must be
+    picklable. Audio is encoded once over the whole timeline and muxed in at the end, or copied
+    from audio_source when that file already holds the short's soundtrack. fps defaults to the
+    clip's own; pass the encode profile's so chunks match the single-encode paths.
+    """
+    write_args = dict(write_args or {})
+    fps = fps or clip.fps
+    ranges = plan_chunks(clip.duration, fps, chunks)
+    logger.info(f"Rendering {len(ranges)} chunks of {clip.duration:.1f}s at {fps} fps")
+
+    audio_path = audio_source
+    if audio_path is None and clip.audio is not None:
+        audio_path = os.path.join(work_dir, 'audio.m4a')
+        clip.audio.write_audiofile(audio_path, codec='aac', bitrate=write_args.get('audio_bitrate'),
+                                   logger=None)
+
+    paths = [os.path.join(work_dir, f"chunk{i:04}.mp4") for i in range(len(ranges))]
+    chunk_args = {k: v for k, v in write_args.items() if not k.startswith('audio')}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context) as executor:
+        futures = [
+            executor.submit(_render_chunk, compose, description, first, end, fps, path, RENDER_GOP,
+                            dict(chunk_args))
+            for (first, end), path in zip(ranges, paths)
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            if progress is not None:
+                progress(done / len(futures))
+
+    video_path = concat_files(paths, os.path.join(work_dir, 'video.mp4'), os.path.join(work_dir, 'chunks.txt'))
+    if audio_path is None:
+        os.replace(video_path, output_path)
+        return output_path
+    run_ffmpeg(['-i', video_path, '-i', audio_path, '-map', '0:v:0', '-map', '1:a:0',
+                '-c', 'copy', '-movflags', '+faststart', output_path])
+    return output_path
@@ -0,0 +1,111 @@
+import os
+import json
+import math
+import shutil
+import logging
+import subprocess
+
+logger = logging.getLogger('Proxy')
+
+PROXY_PATH = os.getenv('PROXY_PATH', '/mounts/store/proxies')
+PROXY_SCALE = int(os.getenv('PROXY_SCALE', 3))  # proxy is 1/PROXY_SCALE of the source size
+PROXY_KEYFRAME_SECONDS = float(os.getenv('PROXY_KEYFRAME_SECONDS', 0.5))  # seek granularity
+PROXY_SPRITE_INTERVAL = float(os.getenv('PROXY_SPRITE_INTERVAL', 2))  # seconds between thumbnails
+PROXY_SPRITE_MAX = int(os.getenv('PROXY_SPRITE_MAX', 200))  # thumbnails per sheet
+PROXY_WAVEFORM_RATE = int(os.getenv('PROXY_WAVEFORM_RATE', 20))  # peaks per second
+SPRITE_COLUMNS = 10
+SPRITE_WIDTH = 160
+WAVEFORM_SAMPLE_RATE = 8000
+
+
+def asset_dir(path):
+    """Directory holding the proxy, sprite sheet and waveform of an original file"""
+    return os.path.join(PROXY_PATH, os.path.basename(path))
+
+
+def proxy_path(path):
+    return os.path.join(asset_dir(path), 'proxy.mp4')
+
+
+def has_proxy(path):
+    return os.path.exists(proxy_path(path))
+
+
+def make_proxy(path, output_path):
+    """Small low-bitrate copy with a keyframe every PROXY_KEYFRAME_SECONDS for cheap seeking and cuts"""
+    from FfmpegTools import run_ffmpeg, probe
+
+    infos = probe(path)
+    gop = max(1, int(round((infos.get('video_fps') or 30) * PROXY_KEYFRAME_SECONDS)))
+    run_ffmpeg(['-i', path, '-map', '0:v:0', '-map', '0:a:0?',
+                '-vf', f"scale=trunc(iw/{PROXY_SCALE}/2)*2:trunc(ih/{PROXY_SCALE}/2)*2",
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28', '-pix_fmt', 'yuv420p',
+                '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+                '-c:a', 'aac', '-b:a', '64k', '-movflags', '+faststart', output_path])
+    return output_path
+
+
+def make_sprite(path, output_path):
+    """Tile evenly spaced thumbnails into one JPEG; returns the layout the player needs to index it"""
+    from FfmpegTools import run_ffmpeg, probe
+
+    infos = probe(path)
+    duration = infos.get('duration') or 0
+    width, height = infos['video_size']
+    interval = max(PROXY_SPRITE_INTERVAL, duration / PROXY_SPRITE_MAX)
+    count = max(1, math.ceil(duration / interval))
+    rows = math.ceil(count / SPRITE_COLUMNS)
+    thumb_height = int(round(SPRITE_WIDTH * height / width / 2)) * 2
+    run_ffmpeg(['-i', path, '-an', '-vf',
+                f"fps=1/{interval},scale={SPRITE_WIDTH}:{thumb_height},tile={SPRITE_COLUMNS}x{rows}",
+                '-frames:v', '1', '-q:v', '5', output_path])
+    return {'interval': interval, 'count': count, 'columns': SPRITE_COLUMNS, 'rows': rows,
+            'width': SPRITE_WIDTH, 'height': thumb_height}
+
+
+def make_waveform(path):
+    """Peak amplitude (0-255) per 1/PROXY_WAVEFORM_RATE seconds of the mono mixdown"""
+    import numpy as np
+    from FfmpegTools import probe
+    from moviepy.config import FFMPEG_BINARY
+
+    if not probe(path).get('audio_found'):
+        return {'rate': PROXY_WAVEFORM_RATE, 'peaks': []}
+    cmd = [FFMPEG_BINARY, '-nostdin', '-loglevel', 'error', '-i', path, '-map', '0:a:0',
+           '-ac', '1', '-ar', str(WAVEFORM_SAMPLE_RATE), '-f', 's16le', '-']
+    pcm = subprocess.run(cmd, capture_output=True, check=True).stdout
+    samples = np.abs(np.frombuffer(pcm, np.int16).astype(np.int32))
+    bucket = WAVEFORM_SAMPLE_RATE // PROXY_WAVEFORM_RATE
+    samples = np.pad(samples, (0, -len(samples) % bucket))
+    peaks = samples.reshape(-1, bucket).max(axis=1) * 255 // 32768
+    return {'rate': PROXY_WAVEFORM_RATE, 'peaks': peaks.astype(np.uint8).tolist()}
+
+
+def generate_assets(path, progress=None):
+    """Build the proxy, then the sprite sheet and waveform from it; returns the asset manifest"""
+    directory = asset_dir(path)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_path):
+        # Deduplicated uploads share a file, and with it the assets
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    os.makedirs(directory, exist_ok=True)
+    proxy = make_proxy(path, os.path.join(directory, 'proxy.tmp.mp4'))
+    if progress is not None:
+        progress(0.7)
+    sprite = make_sprite(proxy, os.path.join(directory, 'sprite.jpg'))
+    if progress is not None:
+        progress(0.9)
+    with open(os.path.join(directory, 'waveform.json'), 'w') as f:
+        json.dump(make_waveform(proxy), f)
+    os.replace(proxy, proxy_path(path))
+
+    manifest = {'sprite': sprite}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def remove_assets(path):
+    shutil.rmtree(asset_dir(path), ignore_errors=True)
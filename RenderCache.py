@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timedelta, UTC
+from EncodeProfiles import get_profile, PREVIEW_PROFILE
+from jobs import QUEUED, RUNNING
+from db import get_applock
+
+logger = logging.getLogger('RenderCache')
+
+# Part of every key; bump when layout or caption rendering changes so old outputs stop matching
+RENDER_VERSION = 1
+DEFAULT_MODEL = os.getenv('WHISPER_MODEL', 'base')
+
+
+def render_key(content_hash, segments, model=None, profile=None, preview=False):
+    """Canonical SHA-256 of everything that determines the rendered bytes.
+
+    Segments are taken in play order with times rounded to the millisecond, so requests that
+    differ only in key order, number formatting or list order hash the same.
+    """
+    profile = get_profile(profile or (PREVIEW_PROFILE if preview else None))
+    canonical = {
+        'version': RENDER_VERSION,
+        'source': content_hash,
+        'segments': [[round(float(s['start']), 3), round(float(s['end']), 3)]
+                     for s in sorted(segments, key=lambda s: s['order'])],
+        'model': model or DEFAULT_MODEL,
+        'profile': profile,
+        'preview': bool(preview),
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def cache_filename(key, preview=False):
+    """Content-addressed output name; identical renders share one file"""
+    return f"{'Preview' if preview else 'Short'}-{key}.mp4"
+
+
+def lock_key(cursor, key, timeout_ms=10000):
+    """Serialize lookups and enqueues for one key until the transaction ends; False if it timed out"""
+    return get_applock(cursor, f"render:{key}", timeout_ms)
+
+
+def find_render(conn, key, lifetime):
+    """Return (id, filename, expires_at) of a finished render still on disk, pushing its expiry out.
+
+    Rows past expires_at that cleanup has not removed yet are revived rather than re-rendered.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT TOP (1) id, filename, path FROM processed_files
+        WHERE cache_key = ?
+        ORDER BY expires_at DESC
+    """, key)
+    row = cursor.fetchone()
+    if row is None or not os.path.exists(row[2]):
+        return None
+    expires_at = datetime.now(UTC) + timedelta(minutes=lifetime)
+    cursor.execute("""
+        UPDATE processed_files SET expires_at = ?
+        WHERE id = ? AND (expires_at IS NULL OR expires_at < ?)
+    """, (expires_at, row[0], expires_at))
+    logger.info(f"Render cache hit for {key[:12]} ({row[1]})")
+    return row[0], row[1], expires_at
+
+
+def find_job(conn, key):
+    """Id of a queued or running render for the key, so duplicates wait on the same job"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT TOP (1) id FROM jobs
+        WHERE cache_key = ? AND status IN (?, ?)
+        ORDER BY created_at
+    """, (key, QUEUED, RUNNING))
+    row = cursor.fetchone()
+    return row[0] if row else None
@@ -1,7 +1,17 @@
+import os
+import logging
+from bisect import bisect_left, bisect_right
 from moviepy import VideoFileClip, CompositeVideoClip, vfx, afx,concatenate_videoclips
+from FfmpegTools import run_ffmpeg, probe, keyframe_times, frame_times, concat_files
+
+logger = logging.getLogger('SplitVideo')
 
 # split_vid = VideoFileClip("http://localhost:3000/videos/testing.mp4")
 
+# Codecs whose stream-copied GOPs can be joined with our re-encoded partial GOPs
+STREAM_CUT_CODECS = ('h264',)
+STREAM_CUT_AUDIO_CODECS = (None, 'aac')
+
 
 def sort_by_order(e):
     return e['order']
@@ -15,3 +25,128 @@ def split_clip(clip,points_to_split):
 
     return concatenate_videoclips(clips_to_combine)
 
+
+def validate_segments(points_to_split, duration=None):
+    """Raise ValueError for malformed, out-of-range or overlapping segments"""
+    if not points_to_split:
+        raise ValueError("At least one segment is required")
+    spans = []
+    for point in points_to_split:
+        try:
+            start, end = float(point['start']), float(point['end'])
+            float(point['order'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Segment needs numeric start, end and order: {point}")
+        if start < 0 or end <= start:
+            raise ValueError(f"Segment end must be after a non-negative start: {point}")
+        if duration is not None and end > duration + 0.05:
+            raise ValueError(f"Segment ends after the video ({duration:.2f}s): {point}")
+        spans.append((start, end))
+
+    spans.sort()
+    for (_, previous_end), (start, end) in zip(spans, spans[1:]):
+        if start < previous_end:
+            raise ValueError(f"Segments overlap at {start:.2f}s")
+
+
+def can_stream_cut(infos):
+    return (infos.get('video_codec_name') in STREAM_CUT_CODECS
+            and infos.get('audio_codec_name') in STREAM_CUT_AUDIO_CODECS)
+
+
+def _encode_video(vid, start, end, path):
+    run_ffmpeg(['-ss', f"{start:.3f}", '-i', vid, '-t', f"{end - start:.3f}", '-map', '0:v:0', '-an',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16', path])
+    return path
+
+
+def _copy_video(vid, start, frames, path):
+    # Copy stops after a count of packets: -t cuts in decode order, which lets B-frame streams
+    # carry the next GOP's first frames along. Closed GOPs decode their own frames first.
+    run_ffmpeg(['-ss', f"{start:.3f}", '-i', vid, '-frames:v', str(frames), '-map', '0:v:0', '-an',
+                '-c', 'copy', '-avoid_negative_ts', 'make_zero', path])
+    return path
+
+
+def _frames_in(times, spans):
+    return sum(bisect_left(times, end - 0.001) - bisect_left(times, start - 0.001) for start, end in spans)
+
+
+def _aac_args(infos, bitrate=None):
+    """AAC at the source sample rate, and at the given bitrate when the short's profile sets one"""
+    return ['-c:a', 'aac', '-ar', str(infos['audio_fps']), *(['-b:a', bitrate] if bitrate else [])]
+
+
+def _reencode_segments(vid, spans, output_path, infos, audio_bitrate=None):
+    """Frame-accurate trim and concat of the spans, re-encoding everything"""
+    audio = bool(infos.get('audio_found'))
+    graph = []
+    for i, (start, end) in enumerate(spans):
+        graph.append(f"[0:v]trim=start={start:.3f}:end={end:.3f},setpts=PTS-STARTPTS[v{i}]")
+        if audio:
+            graph.append(f"[0:a]atrim=start={start:.3f}:end={end:.3f},asetpts=PTS-STARTPTS[a{i}]")
+    inputs = ''.join(f"[v{i}]" + (f"[a{i}]" if audio else '') for i in range(len(spans)))
+    graph.append(f"{inputs}concat=n={len(spans)}:v=1:a={int(audio)}[v]" + ('[a]' if audio else ''))
+    audio_args = ['-map', '[a]', *_aac_args(infos, audio_bitrate)] if audio else []
+    run_ffmpeg(['-i', vid, '-filter_complex', ';'.join(graph), '-map', '[v]', '-fps_mode', 'passthrough',
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '16', '-pix_fmt', 'yuv420p', *audio_args,
+                output_path])
+    return output_path
+
+
+def cut_segments(vid, points_to_split, output_path, work_dir, smart=True, infos=None, audio_bitrate=None):
+    """Cut and join segments in `order`, stream-copying whole GOPs.
+
+    Only runs from one keyframe to the next are copied. With smart=True the partial GOPs at
+    either end of a segment are re-encoded, so cuts are frame-accurate; otherwise segments widen
+    to the surrounding keyframes and nothing is re-encoded. Audio is cut separately from the same
+    spans and re-encoded, since AAC frames don't line up with video keyframes; audio_bitrate sets
+    its bitrate, so a short can copy the cut's audio as its profile asks. If the result
+    doesn't have the frames the spans hold in the source, the segments are re-encoded instead.
+    """
+    infos = infos or probe(vid)
+    validate_segments(points_to_split, infos.get('duration'))
+    keyframes = keyframe_times(vid)
+    times = frame_times(vid)
+
+    spans = []
+    pieces = []
+    for i, point in enumerate(sorted(points_to_split, key=sort_by_order)):
+        start, end = float(point['start']), float(point['end'])
+        if not smart:
+            k = bisect_right(keyframes, start + 0.001) - 1
+            start = keyframes[k] if k >= 0 else start
+            k = bisect_left(keyframes, end - 0.001)
+            end = min(keyframes[k], infos['duration']) if k < len(keyframes) else infos['duration']
+        spans.append((start, end))
+
+        # Keyframes bounding the GOPs that lie wholly inside the segment, within a millisecond
+        first = bisect_left(keyframes, start - 0.001)
+        last = bisect_right(keyframes, end + 0.001) - 1
+        if first >= len(keyframes) or last < 0 or keyframes[first] >= keyframes[last]:
+            pieces.append(_encode_video(vid, start, end, os.path.join(work_dir, f"piece{i}.mp4")))
+            continue
+        head, tail = keyframes[first], keyframes[last]
+        if head > start + 0.001:
+            pieces.append(_encode_video(vid, start, head, os.path.join(work_dir, f"piece{i}_head.mp4")))
+        pieces.append(_copy_video(vid, head, _frames_in(times, [(head, tail)]),
+                                  os.path.join(work_dir, f"piece{i}_body.mp4")))
+        if end > tail + 0.001:
+            pieces.append(_encode_video(vid, tail, end, os.path.join(work_dir, f"piece{i}_tail.mp4")))
+
+    video_path = concat_files(pieces, os.path.join(work_dir, 'video.mp4'), os.path.join(work_dir, 'pieces.txt'))
+    expected, actual = _frames_in(times, spans), len(frame_times(video_path))
+    if actual != expected:
+        logger.warning(f"Stream cut of {vid} has {actual} frames instead of {expected}; re-encoding")
+        return _reencode_segments(vid, spans, output_path, infos, audio_bitrate)
+
+    if not infos.get('audio_found'):
+        os.replace(video_path, output_path)
+        return output_path
+    inputs = []
+    for start, end in spans:
+        inputs += ['-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', vid]
+    graph = ''.join(f"[{i + 1}:a]" for i in range(len(spans))) + f"concat=n={len(spans)}:v=0:a=1[a]"
+    run_ffmpeg(['-i', video_path, *inputs, '-filter_complex', graph, '-map', '0:v', '-map', '[a]',
+                '-c:v', 'copy', *_aac_args(infos, audio_bitrate), output_path])
+    return output_path
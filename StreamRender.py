@@ -0,0 +1,192 @@
+import os
+import queue
+import logging
+import threading
+import subprocess
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+from Captions import build_index, active_word, rasterize_word, blit
+from FfmpegTools import probe
+from SplitVideo import sort_by_order
+from getClips import make_band_renderer, short_layout
+
+logger = logging.getLogger('StreamRender')
+
+STREAM_RING_FRAMES = int(os.getenv('STREAM_RING_FRAMES', 4))  # decoded frames buffered ahead of layout
+DEFAULT_ENCODE = ['-c:v', 'libx264', '-preset', 'medium', '-c:a', 'aac']
+
+
+class FrameRing:
+    """Fixed set of preallocated frame buffers cycled between the decoder thread and the compositor"""
+
+    def __init__(self, shape, count):
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(count)]
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        self.stopped = threading.Event()
+        for i in range(count):
+            self.free.put(i)
+
+
+def _read_exact(stream, view):
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            return filled
+        filled += n
+    return filled
+
+
+def _decode_segments(source, segments, crop, fps, ring, errors):
+    """Decode each segment in order with one ffmpeg reader at a time, filling ring buffers"""
+    try:
+        filters = []
+        if crop is not None:
+            filters.append(f"crop={crop[2]}:{crop[3]}:{crop[0]}:{crop[1]}")
+        if fps is not None:
+            filters.append(f"fps={fps}")
+        for segment, (start, end) in enumerate(segments):
+            if ring.stopped.is_set():
+                break
+            cmd = [FFMPEG_BINARY, '-nostdin', '-loglevel', 'error', '-ss', f"{start:.6f}", '-i', source,
+                   '-t', f"{end - start:.6f}", '-map', '0:v:0', '-an',
+                   *(['-vf', ','.join(filters)] if filters else []),
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                while not ring.stopped.is_set():
+                    index = ring.free.get()
+                    view = memoryview(ring.buffers[index]).cast('B')
+                    if _read_exact(process.stdout, view) < len(view):
+                        ring.free.put(index)
+                        break
+                    ring.ready.put((segment, index))
+            finally:
+                if ring.stopped.is_set():
+                    process.kill()
+                process.stdout.close()
+                stderr = process.stderr.read()
+                if process.wait() != 0 and not ring.stopped.is_set():
+                    raise RuntimeError(f"ffmpeg decode failed: {stderr.decode(errors='replace').strip()}")
+    except Exception as e:
+        errors.append(e)
+    finally:
+        ring.ready.put(None)
+
+
+def _paste(canvas, image, x, y):
+    """Copy image onto canvas at (x, y), clipping whatever falls outside"""
+    height, width = canvas.shape[:2]
+    ih, iw = image.shape[:2]
+    sx, sy = max(0, -x), max(0, -y)
+    dx, dy = max(0, x), max(0, y)
+    w, h = min(iw - sx, width - dx), min(ih - sy, height - dy)
+    if w > 0 and h > 0:
+        canvas[dy:dy + h, dx:dx + w] = image[sy:sy + h, sx:sx + w]
+
+
+def _audio_args(source, segments, infos):
+    """Extra inputs and a filtergraph trimming and joining the segments' audio"""
+    if not infos.get('audio_found'):
+        return [], [], []
+    inputs, graph = [], []
+    for i, (start, end) in enumerate(segments, start=1):
+        inputs += ['-vn', '-ss', f"{start:.6f}", '-t', f"{end - start:.6f}", '-i', source]
+        graph.append(f"[{i}:a:0]asetpts=PTS-STARTPTS[a{i}]")
+    labels = ''.join(f"[a{i}]" for i in range(1, len(segments) + 1))
+    graph.append(f"{labels}concat=n={len(segments)}:v=0:a=1[aout]")
+    return inputs, ['-filter_complex', ';'.join(graph)], ['-map', '[aout]']
+
+
+def render_stream(source, points_to_split, output_path, words=(), final_size=(1080, 1920), crop=None,
+                  fps=None, encode_args=None, font="ComicRelief.ttf", font_size=28, progress=None):
+    """Render the captioned short in one streaming pass with bounded memory.
+
+    Segments are decoded one after another into a small ring of preallocated frames; each
+    frame is laid out and captioned in place on a single reused canvas and written as raw
+    RGB to one encoder, which also trims and joins the audio. Memory depends on the frame
+    size only, not on the source length or the number of segments.
+    """
+    infos = probe(source)
+    width, height = crop[2:] if crop is not None else infos['video_size']
+    fps = fps or infos['video_fps']
+    segments = [(float(p['start']), float(p['end'])) for p in sorted(points_to_split, key=sort_by_order)]
+    total_frames = max(1, int(sum(end - start for start, end in segments) * fps))
+
+    layout = short_layout((width, height), final_size)
+    band_h = layout['band_h']
+    top_band = bottom_band = None
+    if band_h > 0:
+        top_band = make_band_renderer(0, layout['crop_h'], (width, band_h))
+        bottom_band = make_band_renderer(int(height * 0.75), height, (width, band_h))
+    canvas = np.zeros((final_size[1], final_size[0], 3), dtype=np.uint8)
+    index = build_index(words)
+
+    ring = FrameRing((height, width, 3), STREAM_RING_FRAMES)
+    errors = []
+    decoder = threading.Thread(target=_decode_segments, args=(source, segments, crop,
+                                                              fps if fps != infos['video_fps'] else None,
+                                                              ring, errors), daemon=True)
+
+    audio_inputs, audio_graph, audio_map = _audio_args(source, segments, infos)
+    cmd = [FFMPEG_BINARY, '-y', '-nostdin', '-loglevel', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{final_size[0]}x{final_size[1]}", '-r', str(fps),
+           '-i', '-', *audio_inputs, *audio_graph, '-map', '0:v:0', *audio_map,
+           *(encode_args or DEFAULT_ENCODE), '-pix_fmt', 'yuv420p', '-movflags', '+faststart', output_path]
+    encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = []
+    drain = threading.Thread(target=lambda: stderr.append(encoder.stderr.read()), daemon=True)
+    drain.start()
+    decoder.start()
+
+    written = 0
+    offsets = np.concatenate([[0.0], np.cumsum([end - start for start, end in segments])])
+    segment_frames = [0] * len(segments)
+    try:
+        while True:
+            item = ring.ready.get()
+            if item is None:
+                break
+            segment, slot = item
+            frame = ring.buffers[slot]
+            # Same stacking order as create_short's composite: picture, then top and bottom bands
+            canvas[:] = 0
+            _paste(canvas, frame, layout['x'], layout['center_y'])
+            if top_band is not None:
+                _paste(canvas, top_band(frame), layout['x'], 0)
+                _paste(canvas, bottom_band(frame), layout['x'], layout['bottom_y'])
+            ring.free.put(slot)
+
+            t = offsets[segment] + segment_frames[segment] / fps
+            segment_frames[segment] += 1
+            text = active_word(index, t)
+            if text is not None:
+                blit(canvas, rasterize_word(text.strip(), font, font_size, 'yellow', 'black', 1))
+
+            encoder.stdin.write(memoryview(canvas).cast('B'))
+            written += 1
+            if progress is not None and written % 10 == 0:
+                progress(min(1.0, written / total_frames))
+    except BrokenPipeError:
+        pass
+    finally:
+        encoder.stdin.close()
+        # Stop the decoder if we finished early, handing back any slot it is waiting for
+        ring.stopped.set()
+        while decoder.is_alive():
+            try:
+                slot = ring.ready.get(timeout=0.1)
+                if slot is not None:
+                    ring.free.put(slot[1])
+            except queue.Empty:
+                pass
+        returncode = encoder.wait()
+        drain.join()
+
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg encode failed: {b''.join(stderr).decode(errors='replace').strip()}")
+    logger.info(f"Streamed {written} frames at {final_size[0]}x{final_size[1]} to {output_path}")
+    return output_path
@@ -1,10 +1,34 @@
-from moviepy import VideoFileClip, TextClip, CompositeVideoClip
-import whisper
-import os
+import subprocess
+from moviepy import VideoFileClip
+from moviepy.config import FFMPEG_BINARY
+from Captions import add_captions
+import numpy as np
 
 # font = ''
 
-def transcribe_and_highlight(video_path=None, output_path=None, load_video=None,font = "ComicRelief.ttf"):
+WHISPER_SAMPLE_RATE = 16000
+
+
+def load_audio(path):
+    """Decode a file's audio to 16 kHz mono float32 through an ffmpeg pipe"""
+    cmd = [FFMPEG_BINARY, '-nostdin', '-loglevel', 'error', '-i', path,
+           '-f', 's16le', '-ac', '1', '-ar', str(WHISPER_SAMPLE_RATE), '-']
+    pcm = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+
+def clip_audio(audio):
+    """Resample an in-memory clip's audio to 16 kHz mono float32 with ffmpeg's resampler"""
+    samples = audio.to_soundarray(fps=audio.fps).astype(np.float32)
+    channels = samples.shape[1] if samples.ndim == 2 else 1
+    cmd = [FFMPEG_BINARY, '-nostdin', '-loglevel', 'error',
+           '-f', 'f32le', '-ar', str(audio.fps), '-ac', str(channels), '-i', '-',
+           '-f', 'f32le', '-ac', '1', '-ar', str(WHISPER_SAMPLE_RATE), '-']
+    pcm = subprocess.run(cmd, input=samples.tobytes(), capture_output=True, check=True).stdout
+    return np.frombuffer(pcm, np.float32)
+
+
+def transcribe_and_highlight(video_path=None, output_path=None, load_video=None,font = "ComicRelief.ttf",model_size=None,words=None,font_size=28):
     # Load video and extract audio
 
     def get_video():
@@ -14,56 +38,24 @@ def transcribe_and_highlight(video_path=None, output_path=None, load_video=None,
 
 
     video = get_video()
-    audio = video.audio
-    audio.write_audiofile("temp_audio.mp3")
-
-    # Transcribe audio with word-level timestamps
-    model = whisper.load_model("base")
-    result = model.transcribe("temp_audio.mp3", word_timestamps=True)
-
-    # Create list of overlay clips
-    overlays = [video]
-
-    # Process each word individually
-    for segment in result['segments']:
-        words = segment['words']
-        if not words:
-            continue
-
-        for word in words:
-            highlighted = word['word']
-            start = word['start']
-            end = word['end']
-            duration = end - start
-
-            # Create highlighted text
-
-            # Create and configure text clip
-            txt_clip = (
-                TextClip(
-                    text=highlighted,
-                    size=(video.size[0], None),
-                    font_size=28,
-                    font=f'Fonts/{font}',
-                    color='yellow',
-                    stroke_color='black',
-                    stroke_width=1,
-                    method='label'
-                )
-                .with_duration(duration)
-                .with_position('center')
-                .with_start(start)
-            )
-            overlays.append(txt_clip)
-
-    # Create final composition
-    final_video = CompositeVideoClip(overlays)
+    if words is None:
+        # ffmpeg decodes straight to 16 kHz when there is a file; composed clips go through its resampler
+        audio = load_audio(video_path) if load_video is None else clip_audio(video.audio)
+
+        # Imported here so render processes that only draw captions never load whisper and torch
+        from WhisperModels import use_model
+
+        # Transcribe audio with word-level timestamps
+        with use_model(model_size) as model:
+            result = model.transcribe(audio, word_timestamps=True)
+        words = [word for segment in result['segments'] for word in segment['words'] or []]
+
+    # Draw the active word onto each frame from a cached glyph
+    final_video = add_captions(video, words, font=font, font_size=font_size)
     final_video = final_video.with_duration(video.duration)
 
     # Write output
     if load_video is not None:
-
-        os.remove("temp_audio.mp3")
         return final_video
     else :
         final_video.write_videofile(
@@ -73,7 +65,6 @@ def transcribe_and_highlight(video_path=None, output_path=None, load_video=None,
         threads=4,
         preset='fast'
     )
-    os.remove("temp_audio.mp3")
 
 # if __name__ == "__main__":
 # transcribe_and_highlight("Static/testing.mp4", "output_video5.mp4")
\ No newline at end of file
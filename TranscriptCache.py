@@ -0,0 +1,140 @@
+import os
+import glob
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger('TranscriptCache')
+
+CACHE_PATH = os.getenv('TRANSCRIPT_CACHE_PATH', '/mounts/store/transcripts')
+CACHE_SIZE = int(os.getenv('TRANSCRIPT_CACHE_SIZE', 256 * 1024 * 1024))  # bytes
+HASH_CHUNK = 1024 * 1024
+
+
+def _pointer_path(path):
+    """Sidecar remembering the content hash of a source path"""
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(CACHE_PATH, 'paths', f"{key}.json")
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def content_hash(path):
+    """SHA-256 of the file, reusing the last result while size and mtime are unchanged"""
+    stat = os.stat(path)
+    pointer = _pointer_path(path)
+    try:
+        with open(pointer) as f:
+            cached = json.load(f)
+        if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            return cached['hash']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK):
+            digest.update(chunk)
+    _write_json(pointer, {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest.hexdigest()})
+    return digest.hexdigest()
+
+
+def _transcript_path(digest, model_size):
+    return os.path.join(CACHE_PATH, f"{digest}-{model_size}.json")
+
+
+def get_words(path, model_size=None):
+    """Word-level transcript of the whole source file, transcribed at most once per content"""
+    # Imported here so the cleanup job can invalidate entries without loading torch
+    from WhisperModels import use_model, DEFAULT_MODEL
+    from TranscribeVideo import load_audio
+
+    model_size = model_size or DEFAULT_MODEL
+    cache_file = _transcript_path(content_hash(path), model_size)
+    try:
+        with open(cache_file) as f:
+            words = json.load(f)
+        os.utime(cache_file)  # mark as recently used for LRU eviction
+        logger.info(f"Transcript cache hit for {path}")
+        return words
+    except (OSError, ValueError):
+        pass
+
+    audio = load_audio(path)
+    with use_model(model_size) as model:
+        result = model.transcribe(audio, word_timestamps=True)
+    words = [
+        {'word': word['word'], 'start': word['start'], 'end': word['end']}
+        for segment in result['segments']
+        for word in segment.get('words') or []
+    ]
+    _write_json(cache_file, words)
+    logger.info(f"Cached transcript for {path} ({len(words)} words)")
+    evict()
+    return words
+
+
+def remap_words(words, points_to_split):
+    """Shift source timestamps onto the timeline split_clip builds from the same segments"""
+    remapped = []
+    offset = 0.0
+    for point in sorted(points_to_split, key=lambda p: p['order']):
+        start = float(point['start'])
+        end = float(point['end'])
+        for word in words:
+            if word['end'] <= start or word['start'] >= end:
+                continue
+            remapped.append({
+                'word': word['word'],
+                'start': offset + max(word['start'], start) - start,
+                'end': offset + min(word['end'], end) - start
+            })
+        offset += end - start
+    return remapped
+
+
+def evict():
+    """Delete least recently used transcripts until the cache fits CACHE_SIZE"""
+    entries = []
+    for path in glob.glob(os.path.join(CACHE_PATH, '*.json')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_SIZE:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            logger.info(f"Evicted transcript {path}")
+        except OSError:
+            pass
+
+
+def invalidate(path):
+    """Drop cached transcripts of a source file that is being deleted"""
+    pointer = _pointer_path(path)
+    try:
+        with open(pointer) as f:
+            digest = json.load(f)['hash']
+    except (OSError, ValueError, KeyError):
+        return
+    for cache_file in glob.glob(os.path.join(CACHE_PATH, f"{digest}-*.json")):
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+    try:
+        os.remove(pointer)
+    except OSError:
+        pass
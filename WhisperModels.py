@@ -0,0 +1,117 @@
+import os
+import gc
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import whisper
+
+logger = logging.getLogger('WhisperModels')
+
+DEFAULT_MODEL = os.getenv('WHISPER_MODEL', 'base')
+MODEL_CONCURRENCY = int(os.getenv('WHISPER_CONCURRENCY', 1))  # transcriptions sharing one model
+IDLE_SECONDS = float(os.getenv('WHISPER_IDLE_SECONDS', 900))
+MIN_AVAILABLE_MB = int(os.getenv('WHISPER_MIN_AVAILABLE_MB', 1024))
+
+# size -> {'model', 'semaphore', 'in_use', 'last_used'}
+_models = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'load_seconds': 0.0, 'wait_seconds': 0.0}
+
+
+def available_memory_mb():
+    """Return MemAvailable from /proc/meminfo in MB, or None where it isn't exposed"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def _get_entry(size):
+    with _lock:
+        entry = _models.get(size)
+        if entry is not None:
+            _stats['hits'] += 1
+        else:
+            _stats['misses'] += 1
+            started = time.monotonic()
+            entry = {
+                'model': whisper.load_model(size),
+                'semaphore': threading.BoundedSemaphore(MODEL_CONCURRENCY),
+                'in_use': 0,
+                'last_used': time.monotonic()
+            }
+            elapsed = time.monotonic() - started
+            _stats['load_seconds'] += elapsed
+            _models[size] = entry
+            logger.info(f"Loaded whisper model '{size}' in {elapsed:.2f}s (hit rate {hit_rate():.0%})")
+        entry['in_use'] += 1
+        return entry
+
+
+@contextmanager
+def use_model(size=None):
+    """Borrow a shared whisper model, loading it on first use"""
+    size = size or DEFAULT_MODEL
+    if size not in whisper.available_models():
+        raise ValueError(f"Unknown whisper model: {size}")
+
+    entry = _get_entry(size)
+    try:
+        started = time.monotonic()
+        with entry['semaphore']:
+            _stats['wait_seconds'] += time.monotonic() - started
+            yield entry['model']
+    finally:
+        with _lock:
+            entry['in_use'] -= 1
+            entry['last_used'] = time.monotonic()
+        evict_idle()
+
+
+def evict_idle():
+    """Drop models idle past IDLE_SECONDS, and idle models LRU-first while memory is low"""
+    now = time.monotonic()
+    with _lock:
+        idle = sorted(
+            (entry['last_used'], size) for size, entry in _models.items() if entry['in_use'] == 0
+        )
+        evicted = [size for last_used, size in idle if now - last_used > IDLE_SECONDS]
+        # Memory is only returned after collection, so free one model per check
+        available = available_memory_mb()
+        remaining = [size for _, size in idle if size not in evicted]
+        if remaining and available is not None and available < MIN_AVAILABLE_MB:
+            evicted.append(remaining[0])
+        for size in evicted:
+            del _models[size]
+            _stats['evictions'] += 1
+            logger.info(f"Evicted whisper model '{size}'")
+    if evicted:
+        gc.collect()
+
+
+def warm_up(sizes=None):
+    """Load models ahead of the first job, from WHISPER_WARM_MODELS (default: DEFAULT_MODEL; empty for none).
+
+    Render workers call this before forking job processes, which inherit the loaded models
+    copy-on-write instead of each loading its own.
+    """
+    if sizes is None:
+        sizes = [s for s in os.getenv('WHISPER_WARM_MODELS', DEFAULT_MODEL).split(',') if s]
+    for size in sizes:
+        with use_model(size):
+            pass
+
+
+def hit_rate():
+    total = _stats['hits'] + _stats['misses']
+    return _stats['hits'] / total if total else 0.0
+
+
+def stats():
+    with _lock:
+        return dict(_stats, hit_rate=hit_rate(), loaded=sorted(_models))
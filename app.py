@@ -1,160 +1,121 @@
-
 import os
 import time
 import re
+import fcntl
 import logging
-import pyodbc
+import tempfile
 import threading
-from datetime import datetime, timedelta, UTC
-from flask import Flask, request, jsonify, send_from_directory, abort
+from datetime import datetime, UTC
+import json
+import click
+from flask import Flask, Blueprint, request, jsonify, abort, Response, g, current_app
 from flask_cors import CORS
-from makeVid import make_vid
-import requests
-from urllib.parse import urlparse
+from jobs import enqueue_job, get_job, DONE, FAILED, PRIORITY_RENDER, PRIORITY_ASSETS, PRIORITY_PREVIEW
+from uploads import (write_stream, register_original, create_session, get_session, append_to_session, finish_session)
+from db import get_db_connection, pool_stats
+from media import send_media
+from metrics import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from Proxy import asset_dir
+from EncodeProfiles import PROFILES
+from RenderCache import render_key, lock_key, find_render, find_job, cache_filename
+from TranscriptCache import content_hash
+import hashlib
+import base64
+from urllib.parse import urlparse, urlencode
 import uuid
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 load_dotenv()
-app = Flask(__name__)
-
-# Azure Configuration from Environment Variables
-app.config.update({
-    'ALLOWED_DOMAINS': os.getenv('ALLOWED_DOMAINS', 'youtube.com,vimeo.com').split(','),
-    'MAX_URL_SIZE': int(os.getenv('MAX_URL_SIZE', 524288000)),  # 500MB
-    'UPLOAD_FOLDER': os.getenv('UPLOAD_PATH', '/mounts/store/uploads'),
-    'DOWNLOADS': os.getenv('DOWNLOAD_PATH', '/mounts/store/downloads'),
-    'FILE_LIFETIME': int(os.getenv('FILE_LIFETIME', 30)),  # minutes
-    'SQL_SERVER': os.environ['SQL_SERVER'],
-    'SQL_DATABASE': os.environ['SQL_DATABASE'],
-    'SQL_USERNAME': os.environ['SQL_USERNAME'],
-    'SQL_PASSWORD': os.environ['SQL_PASSWORD']
-})
-
-# Ensure directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['DOWNLOADS'], exist_ok=True)
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('VideoEditor')
 
+# One web worker per host runs expiry and quota cleanup (the flock below, plus the 'cleanup'
+# applock across hosts); set CLEANUP_IN_APP=0 where `python cleanup.py` runs on its own instead
+CLEANUP_IN_APP = os.getenv('CLEANUP_IN_APP', '1') == '1'
+# Only the web worker holding this lock runs the cleanup thread on a host
+CLEANUP_LOCK_PATH = os.getenv('CLEANUP_LOCK_PATH', os.path.join(tempfile.gettempdir(), 'make_clips_cleanup.lock'))
 
-def get_db_connection():
-    """Create and return a new database connection for each operation"""
-    conn_str = f"Driver={{ODBC Driver 18 for SQL Server}};Server={app.config['SQL_SERVER']};Database={app.config['SQL_DATABASE']};Uid={app.config['SQL_USERNAME']};Pwd={app.config['SQL_PASSWORD']};Encrypt=yes;TrustServerCertificate=no;"
-    return pyodbc.connect(conn_str)
+api = Blueprint('api', __name__)
 
 
 def init_db():
-    """Initialize database schema in Azure SQL"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        # Create tables if they don't exist
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='original_files')
-        CREATE TABLE original_files (
-            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
-            filename NVARCHAR(255) NOT NULL,
-            path NVARCHAR(MAX) NOT NULL,
-            created_at DATETIME DEFAULT GETDATE()
-        )
-        """)
-        cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='processed_files')
-        CREATE TABLE processed_files (
-            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
-            filename NVARCHAR(255) NOT NULL,
-            title NVARCHAR(255) NOT NULL,
-            path NVARCHAR(MAX) NOT NULL,
-            original_id UNIQUEIDENTIFIER,
-            created_at DATETIME DEFAULT GETDATE(),
-            expires_at DATETIME,
-            FOREIGN KEY (original_id) REFERENCES original_files(id)
-        )
-        """)
-        conn.commit()
-        logger.info("Database tables initialized")
+    """Bring the Azure SQL schema up to date"""
+    from migrations import migrate
 
+    with get_db_connection() as conn:
+        applied = migrate(conn)
+        logger.info(f"Database schema up to date ({len(applied)} migration(s) applied)")
 
-# Initialize database on app start
-init_db()
 
-CORS(app, resources={r"/api/*": {"origins": os.getenv('CORS_ORIGINS')}})
+@click.command('init-db')
+def init_db_command():
+    """Apply pending schema migrations once, before web workers start"""
+    init_db()
 
 
-def cleanup_files():
+def cleanup_loop():
     """Background task to clean up expired files"""
+    from scheduler import ExpiryScheduler
+
     logger.info("Cleanup thread started")
-    while True:
-        try:
-            now = datetime.now(UTC)
-            logger.info("Running cleanup cycle")
-
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-
-                # Cleanup expired processed files
-                cursor.execute("""
-                    SELECT id, path, original_id 
-                    FROM processed_files 
-                    WHERE expires_at < ?
-                """, now)
-                expired_processed = cursor.fetchall()
-
-                for row in expired_processed:
-                    file_id, path, original_id = row
-                    try:
-                        # Delete processed file
-                        if os.path.exists(path):
-                            os.remove(path)
-                            logger.info(f"Deleted expired processed file: {path}")
-
-                        # Delete original file if exists
-                        if original_id:
-                            cursor.execute("SELECT path FROM original_files WHERE id = ?", original_id)
-                            original_path = cursor.fetchone()
-                            if original_path and os.path.exists(original_path[0]):
-                                os.remove(original_path[0])
-                                logger.info(f"Deleted original file: {original_path[0]}")
-
-                        # Delete database records
-                        cursor.execute("DELETE FROM processed_files WHERE id = ?", file_id)
-                        if original_id:
-                            cursor.execute("DELETE FROM original_files WHERE id = ?", original_id)
-                    except Exception as e:
-                        logger.error(f"Error deleting files: {str(e)}")
-
-                # Cleanup orphaned original files (older than 30 minutes)
-                cursor.execute("""
-                    SELECT id, path FROM original_files
-                    WHERE id NOT IN (SELECT original_id FROM processed_files)
-                    AND created_at < DATEADD(minute, -30, GETDATE())
-                """)
-                orphaned_originals = cursor.fetchall()
-
-                for row in orphaned_originals:
-                    file_id, path = row
-                    try:
-                        if os.path.exists(path):
-                            os.remove(path)
-                            logger.info(f"Deleted orphaned original file: {path}")
-                        cursor.execute("DELETE FROM original_files WHERE id = ?", file_id)
-                    except Exception as e:
-                        logger.error(f"Error deleting orphaned file: {str(e)}")
-
-                conn.commit()
-
-        except Exception as e:
-            logger.error(f"Cleanup error: {str(e)}")
-
-        # Run every 5 minutes
-        time.sleep(300)
-
-
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_files, daemon=True)
-cleanup_thread.start()
+    ExpiryScheduler().run()
+
+
+_cleanup_lock = None
+
+
+def start_cleanup():
+    """Start the cleanup thread unless another worker process on this host already runs it"""
+    global _cleanup_lock
+    if _cleanup_lock is not None:
+        return True
+    lock = open(CLEANUP_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    # The lock lives as long as this process; the kernel releases it if the worker dies
+    _cleanup_lock = lock
+    threading.Thread(target=cleanup_loop, daemon=True).start()
+    return True
+
+
+def create_app(config=None):
+    """Build the web app. No database work or background threads happen unless configured."""
+    app = Flask(__name__)
+
+    # Azure Configuration from Environment Variables
+    app.config.update({
+        'ALLOWED_DOMAINS': os.getenv('ALLOWED_DOMAINS', 'youtube.com,vimeo.com').split(','),
+        'MAX_URL_SIZE': int(os.getenv('MAX_URL_SIZE', 524288000)),  # 500MB
+        'MAX_UPLOAD_SIZE': int(os.getenv('MAX_UPLOAD_SIZE', 2147483648)),  # 2GB
+        'UPLOAD_FOLDER': os.getenv('UPLOAD_PATH', '/mounts/store/uploads'),
+        'DOWNLOADS': os.getenv('DOWNLOAD_PATH', '/mounts/store/downloads'),
+        'FILE_LIFETIME': int(os.getenv('FILE_LIFETIME', 30)),  # minutes
+        'WHISPER_MODELS': os.getenv('WHISPER_MODELS', 'tiny,base,small').split(','),
+        'JOB_POLL_INTERVAL': float(os.getenv('JOB_POLL_INTERVAL', 1)),  # seconds
+        'JOB_LONG_POLL_MAX': float(os.getenv('JOB_LONG_POLL_MAX', 30)),  # seconds
+        'JOB_EVENTS_MAX': float(os.getenv('JOB_EVENTS_MAX', 60)),  # seconds one event stream holds a thread
+        'BATCH_MAX_SHORTS': int(os.getenv('BATCH_MAX_SHORTS', 20)),
+        'CLEANUP_IN_APP': CLEANUP_IN_APP,
+    })
+    app.config.update(config or {})
+
+    # Ensure directories exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['DOWNLOADS'], exist_ok=True)
+
+    CORS(app, resources={r"/api/*": {"origins": os.getenv('CORS_ORIGINS')}})
+    app.register_blueprint(api)
+    app.cli.add_command(init_db_command)
+
+    if app.config['CLEANUP_IN_APP'] and start_cleanup():
+        logger.info(f"This process owns file cleanup (pid {os.getpid()})")
+    return app
 
 
 def is_valid_video_url(url):
@@ -163,21 +124,93 @@ def is_valid_video_url(url):
         result = urlparse(url)
         if all([result.scheme, result.netloc]):
             domain = '.'.join(result.netloc.split('.')[-2:])
-            return domain in app.config['ALLOWED_DOMAINS']
+            return domain in current_app.config['ALLOWED_DOMAINS']
         return False
     except:
         return False
 
-@app.route('/api/uploads/<filename>', methods=['GET'])
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', 'Time to build each response',
+                                     ('endpoint', 'method', 'status'))
+# Media bodies are streamed after the view returns, so bytes are counted from Content-Length
+MEDIA_BYTES = registry.counter('media_bytes_sent_total', 'Response body bytes of media endpoints', ('endpoint',))
+MEDIA_ENDPOINTS = {'serve_video', 'serve_proxy', 'download_file'}
+
+
+@api.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@api.after_app_request
+def record_request(response):
+    # Labels use the view name without the blueprint prefix
+    endpoint = (request.endpoint or 'unmatched').rpartition('.')[2]
+    if 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    if endpoint in MEDIA_ENDPOINTS and request.method == 'GET' and response.content_length:
+        MEDIA_BYTES.inc(response.content_length, endpoint=endpoint)
+    return response
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this web worker process"""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api.route('/api/stats/db', methods=['GET'])
+def db_stats():
+    return jsonify(pool_stats()), 200
+
+
+@api.route('/api/uploads/<filename>', methods=['GET'])
 def serve_video(filename):
-    return send_from_directory(
-        app.config['UPLOAD_FOLDER'],
-        filename,
-        mimetype='video/mp4'
-    )
+    return send_media(current_app.config['UPLOAD_FOLDER'], filename, accel_dir='uploads')
+
+
+def queue_proxy(conn, filename, path):
+    """Build the preview proxy, sprite sheet and waveform in the worker pool"""
+    return enqueue_job(conn, {'kind': 'proxy', 'filename': filename, 'path': path}, priority=PRIORITY_ASSETS)
+
+
+@api.route('/api/uploads/<filename>/proxy', methods=['GET'])
+def serve_proxy(filename):
+    filename = secure_filename(filename)
+    return send_media(asset_dir(filename), 'proxy.mp4', accel_dir=f"proxies/{filename}")
+
 
+@api.route('/api/uploads/<filename>/sprite', methods=['GET'])
+def serve_sprite(filename):
+    filename = secure_filename(filename)
+    return send_media(asset_dir(filename), 'sprite.jpg', mimetype='image/jpeg', accel_dir=f"proxies/{filename}")
 
-@app.route('/api/process_url', methods=['POST'])
+
+@api.route('/api/uploads/<filename>/waveform', methods=['GET'])
+def serve_waveform(filename):
+    filename = secure_filename(filename)
+    return send_media(asset_dir(filename), 'waveform.json', mimetype='application/json',
+                      accel_dir=f"proxies/{filename}")
+
+
+@api.route('/api/uploads/<filename>/assets', methods=['GET'])
+def upload_assets(filename):
+    """Sprite sheet layout and asset URLs, or 404 until the proxy job has finished"""
+    manifest_path = os.path.join(asset_dir(secure_filename(filename)), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        abort(404, description="Assets not ready")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    base = f'/api/uploads/{filename}'
+    return jsonify({
+        'proxyUrl': f'{base}/proxy',
+        'spriteUrl': f'{base}/sprite',
+        'waveformUrl': f'{base}/waveform',
+        'sprite': manifest['sprite']
+    }), 200
+
+
+@api.route('/api/process_url', methods=['POST'])
 def process_url():
     data = request.json
     url = data.get('url', '').strip()
@@ -188,110 +221,301 @@ def process_url():
     if not is_valid_video_url(url):
         return jsonify({'error': 'Invalid or unauthorized URL'}), 400
 
-    try:
-        # Verify URL points to a video
-        head_response = requests.head(url, allow_redirects=True, timeout=10)
-        content_type = head_response.headers.get('Content-Type', '')
+    # Download off the request thread; the client follows progress on the job
+    filename = secure_filename(os.path.basename(urlparse(url).path)) or 'video.mp4'
+    timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+    unique_name = f"url_{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+    save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_name)
 
-        if 'video/' not in content_type:
-            return jsonify({'error': 'URL does not point to a video file'}), 400
-
-        # Download the video
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
+    with get_db_connection() as conn:
+        task_id = enqueue_job(conn, {
+            'kind': 'ingest',
+            'url': url,
+            'filename': unique_name,
+            'path': save_path,
+            'max_size': current_app.config['MAX_URL_SIZE']
+        }, priority=PRIORITY_ASSETS)
 
-        # Generate filename
-        filename = secure_filename(os.path.basename(urlparse(url).path)) or 'video.mp4'
-        timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
-        unique_name = f"url_{timestamp}_{filename}"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
+    return jsonify({
+        'task_id': str(task_id),
+        'statusUrl': f'/api/jobs/{task_id}',
+        'eventsUrl': f'/api/jobs/{task_id}/events'
+    }), 202
 
-        # Save file
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:  # filter out keep-alive chunks
-                    f.write(chunk)
 
-        # Save to database
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            file_id = uuid.uuid4()
-            cursor.execute("""
-                INSERT INTO original_files (id, filename, path) 
-                VALUES (?, ?, ?)
-            """, (file_id, unique_name, save_path))
+def find_source(conn, source):
+    """(input path, original id, content hash) of an uploaded source URL; hash is None when it's missing"""
+    # Extract filename from source URL
+    filename = source.split('/')[-1]
+    input_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, content_hash FROM original_files WHERE filename = ?", filename)
+    original_row = cursor.fetchone()
+    original_id = original_row[0] if original_row else None
+    source_hash = original_row[1] if original_row else None
+    if source_hash is None and os.path.isfile(input_path):
+        # Rows from before uploads were hashed: hash once and keep it, so later renders skip it
+        source_hash = content_hash(input_path)
+        if original_id is not None:
+            cursor.execute("UPDATE original_files SET content_hash = ? WHERE id = ? AND content_hash IS NULL",
+                           (source_hash, original_id))
             conn.commit()
+    return input_path, original_id, source_hash
 
-        return jsonify({
-            'fileId': str(file_id),
-            'videoName': unique_name,
-            'message': 'Video processed successfully',
-            'videoUrl': f"/api/uploads/{unique_name}"
-        }), 200
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"URL fetch failed: {str(e)}")
-        return jsonify({'error': f'Failed to fetch URL: {str(e)}'}), 500
-    except Exception as e:
-        logger.error(f"URL processing error: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+def segments_error(input_path, segments_list):
+    """Why the segment lists can't be cut from the source, or None; checked here so bad input gets a
+    400 instead of a job that fails later"""
+    # Imported here so app startup doesn't pull in moviepy
+    from FfmpegTools import probe
+    from SplitVideo import validate_segments
+    try:
+        duration = probe(input_path).get('duration') if os.path.isfile(input_path) else None
+    except OSError:
+        duration = None
+    try:
+        for segments in segments_list:
+            validate_segments(segments, duration)
+    except TypeError:
+        return 'segments must be a list of {start, end, order}'
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def queue_render(conn, input_path, original_id, cache_key, segments, title, model, preview, profile, cprofile,
+                 batch_id=None, commit=True):
+    """Serve a render from the cache, join one in flight, or queue it; returns (response body, status).
+
+    commit=False leaves the transaction, and the key lock, open for the caller to commit.
+    """
+    # The output is named after the render key, so identical requests share one file; the title
+    # only becomes the name the browser saves it under
+    download_name = secure_filename(f"{'Preview' if preview else 'Short'}-{title}.mp4") or 'Short.mp4'
+    # Previews render from the proxy at low resolution; the full render runs when the user commits
+    output_filename = cache_filename(cache_key, preview)
+    output_path = os.path.join(current_app.config['DOWNLOADS'], output_filename)
+    video_url = f"/api/download/{output_filename}?{urlencode({'name': download_name})}"
+
+    cursor = conn.cursor()
+    if not lock_key(cursor, cache_key):
+        # Without the lock a lookup could miss a render being queued and enqueue a duplicate
+        conn.rollback()
+        logger.warning(f"Timed out waiting for the render lock on {cache_key[:12]}")
+        return {'error': 'Render is busy, retry shortly'}, 503
+    cached = find_render(conn, cache_key, current_app.config['FILE_LIFETIME'])
+    if cached is not None:
+        if commit:
+            conn.commit()
+        task_id, output_filename, expires_at = cached
+        return {
+            'videoUrl': video_url,
+            'filename': output_filename,
+            'task_id': str(task_id),
+            'statusUrl': f'/api/jobs/{task_id}',
+            'expires_at': expires_at.isoformat(),
+            'cached': True
+        }, 200
+
+    # Coalesce onto an identical render that is still queued or running
+    task_id = find_job(conn, cache_key)
+    if task_id is None:
+        # Queue the render for the worker pool; committing releases the key lock
+        payload = {
+            'segments': segments,
+            'title': title,
+            'model': model,
+            'preview': preview,
+            'profile': profile,
+            'input_path': input_path,
+            'output_filename': output_filename,
+            'output_path': output_path,
+            'download_name': download_name,
+            'cache_key': cache_key,
+            'cprofile': cprofile,
+            'original_id': str(original_id) if original_id else None
+        }
+        if batch_id is not None:
+            payload['batch_id'] = str(batch_id)
+        task_id = enqueue_job(conn, payload, cache_key=cache_key, batch_id=batch_id,
+                              priority=PRIORITY_PREVIEW if preview else PRIORITY_RENDER, commit=commit)
+    elif commit:
+        conn.commit()
+
+    return {
+        'videoUrl': video_url,
+        'filename': output_filename,
+        'task_id': str(task_id),
+        'statusUrl': f'/api/jobs/{task_id}',
+        'cached': False
+    }, 202
 
 
-@app.route('/api/process', methods=['POST'])
+@api.route('/api/process', methods=['POST'])
 def process_video():
     data = request.json
     source = data.get('source')
     segments = data.get('segments')
     title = data.get('title')
+    model = data.get('model')
+    preview = bool(data.get('preview', False))
+    profile = data.get('profile')
+    # Asks the worker for a cProfile dump of this render, when it has JOB_PROFILE_DIR set
+    cprofile = bool(data.get('cprofile', False))
+
+    if not source or not segments or not title:
+        return jsonify({'error': 'source, segments and title are required'}), 400
+
+    if model is not None and model not in current_app.config['WHISPER_MODELS']:
+        return jsonify({'error': f"model must be one of {', '.join(current_app.config['WHISPER_MODELS'])}"}), 400
+
+    if profile is not None and profile not in PROFILES:
+        return jsonify({'error': f"profile must be one of {', '.join(PROFILES)}"}), 400
+
+    with get_db_connection() as conn:
+        input_path, original_id, source_hash = find_source(conn, source)
+        if source_hash is None:
+            return jsonify({'error': 'Source not found'}), 404
+
+        error = segments_error(input_path, [segments])
+        if error is not None:
+            return jsonify({'error': error}), 400
+        try:
+            cache_key = render_key(source_hash, segments, model, profile, preview)
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'segments need start, end and order'}), 400
+
+        body, status = queue_render(conn, input_path, original_id, cache_key, segments, title, model, preview,
+                                    profile, cprofile)
+    return jsonify(body), status
 
-    # Extract filename from source URL
-    filename = source.split('/')[-1]
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    output_filename = f"Short-{title}.mp4"
-    output_path = os.path.join(app.config['DOWNLOADS'], output_filename)
-    expires_at = datetime.now(UTC) + timedelta(minutes=app.config['FILE_LIFETIME'])
 
-    # Process video
-    make_vid(segments, input_path, output_path)
+@api.route('/api/process/batch', methods=['POST'])
+def process_batch():
+    """Queue several shorts of one source; the worker renders them together, decoding shared ranges once.
 
-    # Save to database
+    Body: {"source", "model"?, "shorts": [{"title", "segments", "profile"?}, ...]}. Each short gets
+    its own job (or cache hit), as from /api/process; queued ones share a batchId.
+    """
+    data = request.json
+    source = data.get('source')
+    shorts = data.get('shorts')
+    model = data.get('model')
+    cprofile = bool(data.get('cprofile', False))
+
+    if not source or not shorts or not isinstance(shorts, list):
+        return jsonify({'error': 'source and shorts are required'}), 400
+    if len(shorts) > current_app.config['BATCH_MAX_SHORTS']:
+        return jsonify({'error': f"at most {current_app.config['BATCH_MAX_SHORTS']} shorts per batch"}), 400
+    if any(not isinstance(short, dict) or not short.get('segments') or not short.get('title') for short in shorts):
+        return jsonify({'error': 'every short needs segments and a title'}), 400
+    if model is not None and model not in current_app.config['WHISPER_MODELS']:
+        return jsonify({'error': f"model must be one of {', '.join(current_app.config['WHISPER_MODELS'])}"}), 400
+    for short in shorts:
+        if short.get('profile') is not None and short['profile'] not in PROFILES:
+            return jsonify({'error': f"profile must be one of {', '.join(PROFILES)}"}), 400
+
+    batch_id = uuid.uuid4()
+    results = []
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        processed_id = uuid.uuid4()
-
-        # Get original file ID
-        cursor.execute("SELECT id FROM original_files WHERE filename = ?", filename)
-        original_row = cursor.fetchone()
-        original_id = original_row[0] if original_row else None
-
-        cursor.execute("""
-            INSERT INTO processed_files 
-            (id, filename, title, path, original_id, expires_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (processed_id, output_filename, title, output_path, original_id, expires_at))
+        input_path, original_id, source_hash = find_source(conn, source)
+        if source_hash is None:
+            return jsonify({'error': 'Source not found'}), 404
+
+        error = segments_error(input_path, [short['segments'] for short in shorts])
+        if error is not None:
+            return jsonify({'error': error}), 400
+        try:
+            keys = [render_key(source_hash, short['segments'], model, short.get('profile')) for short in shorts]
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'segments need start, end and order'}), 400
+
+        # Every key is locked up front in one order, so concurrent batches can't deadlock on them
+        for cache_key in sorted(set(keys)):
+            if not lock_key(conn.cursor(), cache_key):
+                conn.rollback()
+                logger.warning(f"Timed out waiting for the render lock on {cache_key[:12]}")
+                return jsonify({'error': 'Render is busy, retry shortly'}), 503
+        # One transaction for the whole batch, so a worker claiming a member finds all the others
+        for short, cache_key in zip(shorts, keys):
+            body, _ = queue_render(conn, input_path, original_id, cache_key, short['segments'], short['title'],
+                                   model, False, short.get('profile'), cprofile, batch_id=batch_id, commit=False)
+            results.append(body)
         conn.commit()
 
+    queued = any(not body['cached'] for body in results)
     return jsonify({
-        'videoUrl': f'/api/download/{output_filename}',
-        'filename': output_filename,
-        'task_id': str(processed_id)
-    }), 202
+        'batchId': str(batch_id) if queued else None,
+        'shorts': results
+    }), 202 if queued else 200
 
 
-@app.route('/api/download/<filename>')
-def download_file(filename):
+def load_job(task_id):
     try:
-        return send_from_directory(
-            app.config['DOWNLOADS'],
-            filename,
-            mimetype='video/mp4',
-            as_attachment=True
-        )
-    except FileNotFoundError:
-        abort(404, description="File not found")
+        job_id = uuid.UUID(task_id)
+    except ValueError:
+        abort(404, description="Job not found")
+    with get_db_connection() as conn:
+        return get_job(conn, job_id)
+
+
+@api.route('/api/jobs/<task_id>', methods=['GET'])
+def job_status(task_id):
+    """Return job status; with ?wait=N long-poll until progress moves past ?progress"""
+    job = load_job(task_id)
+    if job is None:
+        abort(404, description="Job not found")
+
+    wait = min(request.args.get('wait', 0, type=float), current_app.config['JOB_LONG_POLL_MAX'])
+    seen_status = request.args.get('status', job['status'])
+    seen_progress = request.args.get('progress', job['progress'], type=float)
+    deadline = time.monotonic() + wait
+    while (time.monotonic() < deadline and job['status'] == seen_status
+           and job['progress'] == seen_progress and job['status'] not in (DONE, FAILED)):
+        time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+        job = load_job(task_id)
+
+    return jsonify(job), 200
+
+
+@api.route('/api/jobs/<task_id>/events', methods=['GET'])
+def job_events(task_id):
+    """Stream job progress as server-sent events until the job finishes or JOB_EVENTS_MAX passes"""
+    if load_job(task_id) is None:
+        abort(404, description="Job not found")
+    interval = current_app.config['JOB_POLL_INTERVAL']
+    max_seconds = current_app.config['JOB_EVENTS_MAX']
+
+    def stream():
+        # Each stream holds a gunicorn thread, so it ends after max_seconds; EventSource reconnects
+        # by itself after the retry delay and picks up the current state
+        yield f"retry: {int(interval * 1000)}\n\n"
+        deadline = time.monotonic() + max_seconds
+        last = None
+        while time.monotonic() < deadline:
+            job = load_job(task_id)
+            if job is None:
+                # Purged or deleted while streaming
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            state = (job['status'], job['stage'], job['progress'])
+            if state != last:
+                last = state
+                yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+            if job['status'] in (DONE, FAILED):
+                return
+            time.sleep(interval)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@api.route('/api/download/<filename>')
+def download_file(filename):
+    return send_media(current_app.config['DOWNLOADS'], filename, as_attachment=True,
+                      download_name=secure_filename(request.args.get('name', '')) or None, accel_dir='downloads')
 
 
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/upload', methods=['POST'])
 def upload_video():
     if 'video' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -304,24 +528,24 @@ def upload_video():
         # Generate unique filename
         filename = secure_filename(file.filename)
         timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
-        unique_name = f"upload_{timestamp}_{filename}"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
-        file.save(save_path)
+        unique_name = f"upload_{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+        save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_name)
+
+        # Hash while writing so identical uploads can share one stored file
+        hasher = hashlib.sha256()
+        with open(save_path, 'wb') as f:
+            size = write_stream(file.stream, f, hasher)
 
         # Save to database
         with get_db_connection() as conn:
-            cursor = conn.cursor()
-            file_id = uuid.uuid4()
-            cursor.execute("""
-                INSERT INTO original_files (id, filename, path) 
-                VALUES (?, ?, ?)
-            """, (file_id, unique_name, save_path))
-            conn.commit()
+            file_id, unique_name, save_path = register_original(conn, unique_name, save_path, hasher.hexdigest(), size)
+            proxy_task_id = queue_proxy(conn, unique_name, save_path)
 
         return jsonify({
             "fileId": str(file_id),
             'videoName': unique_name,
-            'videoUrl': f'/api/uploads/{unique_name}'
+            'videoUrl': f'/api/uploads/{unique_name}',
+            'proxyTaskId': str(proxy_task_id)
         }), 200
 
     except Exception as e:
@@ -329,6 +553,101 @@ def upload_video():
         return jsonify({'error': str(e)}), 500
 
 
+def upload_metadata():
+    """Parse a tus Upload-Metadata header ("key base64value, ...") into a dict"""
+    metadata = {}
+    for pair in request.headers.get('Upload-Metadata', '').split(','):
+        parts = pair.strip().split(' ', 1)
+        if parts[0]:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode() if len(parts) > 1 else ''
+    return metadata
+
+
+def load_session(conn, upload_id):
+    try:
+        return get_session(conn, uuid.UUID(upload_id))
+    except ValueError:
+        return None
+
+
+@api.route('/api/uploads/resumable', methods=['POST'])
+def create_resumable_upload():
+    """Start a tus-style upload; the body is sent with PATCH requests to the returned Location"""
+    length = request.headers.get('Upload-Length', type=int)
+    if length is None or length <= 0:
+        return jsonify({'error': 'Upload-Length header required'}), 400
+    if length > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': 'File too large'}), 413
+
+    filename = secure_filename(upload_metadata().get('filename') or request.args.get('filename', '')) or 'video.mp4'
+    timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+    unique_name = f"upload_{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+    save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_name)
+
+    with get_db_connection() as conn:
+        upload_id = create_session(conn, unique_name, save_path, length)
+
+    location = f'/api/uploads/resumable/{upload_id}'
+    return jsonify({'uploadId': str(upload_id), 'location': location}), 201, {
+        'Location': location,
+        'Upload-Offset': '0',
+        'Tus-Resumable': '1.0.0'
+    }
+
+
+@api.route('/api/uploads/resumable/<upload_id>', methods=['HEAD'])
+def resumable_upload_offset(upload_id):
+    with get_db_connection() as conn:
+        session = load_session(conn, upload_id)
+    if session is None:
+        abort(404, description="Upload not found")
+    return '', 200, {
+        'Upload-Offset': str(session['received']),
+        'Upload-Length': str(session['length']),
+        'Cache-Control': 'no-store',
+        'Tus-Resumable': '1.0.0'
+    }
+
+
+@api.route('/api/uploads/resumable/<upload_id>', methods=['PATCH'])
+def resumable_upload_chunk(upload_id):
+    """Append the request body at Upload-Offset, streaming it to disk and into the running hash"""
+    if request.headers.get('Content-Type') != 'application/offset+octet-stream':
+        return jsonify({'error': 'Content-Type must be application/offset+octet-stream'}), 415
+
+    try:
+        with get_db_connection() as conn:
+            session = load_session(conn, upload_id)
+            if session is None:
+                return jsonify({'error': 'Upload not found'}), 404
+            if request.headers.get('Upload-Offset', type=int) != session['received']:
+                return jsonify({'error': 'Upload-Offset mismatch'}), 409, {'Upload-Offset': str(session['received'])}
+
+            received, hasher = append_to_session(conn, session, request.stream)
+            headers = {'Upload-Offset': str(received), 'Tus-Resumable': '1.0.0'}
+            if received < session['length']:
+                return '', 204, headers
+
+            file_id, unique_name, save_path = finish_session(conn, session, hasher)
+            proxy_task_id = queue_proxy(conn, unique_name, save_path)
+
+        return jsonify({
+            'fileId': str(file_id),
+            'videoName': unique_name,
+            'videoUrl': f'/api/uploads/{unique_name}',
+            'proxyTaskId': str(proxy_task_id)
+        }), 200, headers
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        logger.error(f"Resumable upload failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# gunicorn app:app; startup.sh applies the schema first (or `flask --app app init-db` by hand)
+app = create_app()
+
 if __name__ == '__main__':
     # For local development
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
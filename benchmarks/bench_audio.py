@@ -0,0 +1,55 @@
+"""Compare the old temp_audio.mp3 round-trip with in-memory audio extraction.
+
+    python benchmarks/bench_audio.py [source.mp4] [--repeat N]
+"""
+import os
+import sys
+import argparse
+import tempfile
+from common import synthetic_source, run_measured, report
+
+
+def extract(variant, source):
+    from moviepy import VideoFileClip
+    import TranscribeVideo
+
+    clip = VideoFileClip(source)
+    if variant == 'file':
+        # The previous path: encode MP3 to disk, then decode it again for whisper
+        temp_path = os.path.join(tempfile.mkdtemp(), 'temp_audio.mp3')
+        clip.audio.write_audiofile(temp_path, logger=None)
+        audio = TranscribeVideo.load_audio(temp_path)
+        os.remove(temp_path)
+    elif variant == 'memory':
+        audio = TranscribeVideo.audio_array(clip.audio)
+    else:
+        audio = TranscribeVideo.load_audio(source)
+    clip.close()
+    return audio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--variant')
+    args = parser.parse_args()
+
+    source = args.source or synthetic_source(duration=120, size=(1280, 720))
+    if args.variant:
+        extract(args.variant, source)
+        return
+
+    results = {'source': source}
+    for variant in ('file', 'memory', 'pipe'):
+        runs = [run_measured([sys.executable, __file__, source, '--variant', variant])
+                for _ in range(args.repeat)]
+        results[variant] = {
+            'wall_seconds': min(wall for wall, _ in runs),
+            'peak_rss_mb': max(rss for _, rss in runs)
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""CPU time of rendering several shorts of one source as a batch vs one make_vid per short.
+
+The shorts overlap, as creators' cuts of one upload usually do. Both modes use the ffmpeg
+layout with fixed captions, so the difference is decoding and cutting; encoding is the same
+work in both. Each mode runs in its own process and reports CPU time including ffmpeg.
+
+    python benchmarks/bench_batch.py [--duration 120] [--shorts 2 4 8] [--segments 3] [--segment-seconds 8]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+from common import synthetic_source, report
+
+WORDS = [{'word': f" word{i}", 'start': i * 0.5, 'end': i * 0.5 + 0.4} for i in range(2000)]
+
+
+def make_shorts(duration, count, segments, length, seed=1):
+    """Shorts whose segments come from a few shared stretches of the source"""
+    rng = random.Random(seed)
+    # Stretches two segments apart, so a short never uses overlapping segments
+    stretches = [1 + k * 2 * length for k in range(int((duration - 1) // (2 * length)))][:segments + 1]
+    shorts = []
+    for _ in range(count):
+        points = []
+        for order, base in enumerate(sorted(rng.sample(stretches, segments))):
+            start = round(base + rng.uniform(0, length / 2), 3)
+            points.append({'start': start, 'end': round(start + length, 3), 'order': order})
+        shorts.append(points)
+    return shorts
+
+
+def render(mode, source, shorts, work_dir):
+    import TranscriptCache
+    from metrics import cpu_seconds
+
+    TranscriptCache.get_words = lambda vid, model_size=None: WORDS
+    if mode == 'batch':
+        import BatchRender
+        BatchRender.get_words = TranscriptCache.get_words
+        BatchRender.render_batch([{'segments': s, 'output_path': os.path.join(work_dir, f"short{i}.mp4")}
+                                  for i, s in enumerate(shorts)], source)
+    else:
+        import makeVid
+        makeVid.get_words = TranscriptCache.get_words
+        for i, segments in enumerate(shorts):
+            makeVid.make_vid(segments, source, os.path.join(work_dir, f"short{i}.mp4"), backend='ffmpeg')
+    return cpu_seconds()
+
+
+def unique_seconds(shorts):
+    from BatchRender import merge_ranges
+    return sum(end - start for start, end in merge_ranges([(p['start'], p['end']) for s in shorts for p in s]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=int, default=120)
+    parser.add_argument('--shorts', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--segments', type=int, default=3)
+    parser.add_argument('--segment-seconds', type=float, default=8)
+    parser.add_argument('--render', nargs=4, metavar=('MODE', 'SOURCE', 'SHORTS', 'WORK_DIR'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        mode, source, shorts, work_dir = args.render
+        # ffmpeg and MoviePy messages stay off the JSON on stdout
+        sys.stdout.flush()
+        stdout = os.dup(1)
+        os.dup2(2, 1)
+        cpu = render(mode, source, json.loads(shorts), work_dir)
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        print(json.dumps({'cpu_seconds': cpu}))
+        return
+
+    source = synthetic_source(duration=args.duration)
+    results = []
+    for count in args.shorts:
+        shorts = make_shorts(args.duration, count, args.segments, args.segment_seconds)
+        result = {'shorts': count, 'unique_source_seconds': round(unique_seconds(shorts), 1),
+                  'output_seconds': count * args.segments * args.segment_seconds}
+        for mode in ('separate', 'batch'):
+            with tempfile.TemporaryDirectory(prefix=f"bench_batch_{mode}_") as work_dir:
+                output = subprocess.run([sys.executable, __file__, '--render', mode, source, json.dumps(shorts),
+                                         work_dir], stdout=subprocess.PIPE, text=True, check=True).stdout
+            result[f"{mode}_cpu_seconds"] = round(json.loads(output.strip().splitlines()[-1])['cpu_seconds'], 1)
+        result['cpu_saved'] = round(1 - result['batch_cpu_seconds'] / result['separate_cpu_seconds'], 3)
+        results.append(result)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Black bar detection: the old 3-frame float analysis through MoviePy vs detect_crop over every keyframe.
+
+    python benchmarks/bench_crop.py [source.mp4 ...]
+"""
+import time
+import argparse
+import numpy as np
+from common import letterboxed_source, report
+
+
+def old_detect(path, sample_time=2.0, analysis_frames=3):
+    """What EditVideo.remove_black_bars used to do: seek with get_frame and average channels as floats"""
+    from moviepy import VideoFileClip
+
+    clip = VideoFileClip(path)
+    boundaries = []
+    for t in np.linspace(sample_time, clip.duration * 0.5, analysis_frames):
+        gray = np.mean(clip.get_frame(t), axis=2).astype(np.uint8)
+        mask = gray > 15
+        rows, cols = np.any(mask, axis=1), np.any(mask, axis=0)
+        boundaries.append((np.argmax(rows), len(rows) - np.argmax(rows[::-1]),
+                           np.argmax(cols), len(cols) - np.argmax(cols[::-1])))
+    clip.close()
+    return tuple(int(v) for v in np.median(boundaries, axis=0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='*')
+    args = parser.parse_args()
+
+    from EditVideo import detect_crop
+
+    results = []
+    for source in args.sources or [letterboxed_source()]:
+        started = time.perf_counter()
+        old = old_detect(source)
+        old_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        crop = detect_crop(source)
+        new_seconds = time.perf_counter() - started
+        results.append({'source': source, 'old_bounds': old, 'old_seconds': round(old_seconds, 2),
+                        'crop': crop, 'detect_crop_seconds': round(new_seconds, 2)})
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
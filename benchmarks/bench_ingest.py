@@ -0,0 +1,154 @@
+"""URL ingestion throughput against a local Range-capable HTTP stand-in.
+
+Serves a generated file from a thread-per-request server (optionally with per-connection
+latency and a bandwidth cap, like a remote CDN), then downloads it sequentially and with
+parallel ranges, checks the SHA-256, and finally checks that interrupted parts resume and that
+a download that fails leaves no files behind.
+
+    python benchmarks/bench_ingest.py [--size-mb 256] [--latency-ms 50] [--mbps 400]
+"""
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from common import report
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    data = b''
+    latency = 0.0
+    rate = 0  # bytes per second per connection, 0 = unlimited
+    fail_after = None  # drop connections after this many bytes, once armed
+    failures = None  # connections left to drop; None drops every one
+    served = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, start, end):
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"stand-in"')
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{len(self.data)}")
+        self.end_headers()
+
+    @classmethod
+    def _count(cls, size):
+        with cls.lock:
+            cls.served += size
+
+    @classmethod
+    def _take_failure(cls):
+        with cls.lock:
+            if cls.failures is None:
+                return True
+            if cls.failures > 0:
+                cls.failures -= 1
+                return True
+            return False
+
+    def do_HEAD(self):
+        self._headers(200, 0, len(self.data))
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        start, end, status = 0, len(self.data), 200
+        spec = self.headers.get('Range')
+        if spec and spec.startswith('bytes='):
+            first, _, last = spec[6:].partition('-')
+            start, end, status = int(first), (int(last) + 1 if last else len(self.data)), 206
+        self._headers(status, start, end)
+        sent, block = 0, 256 * 1024
+        view = memoryview(self.data)[start:end]
+        started = time.monotonic()
+        try:
+            while sent < len(view):
+                if self.fail_after is not None and sent >= self.fail_after and self._take_failure():
+                    return
+                self.wfile.write(view[sent:sent + block])
+                self._count(len(view[sent:sent + block]))
+                sent += block
+                if self.rate:
+                    ahead = sent / self.rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve(data, latency, rate):
+    StandInHandler.data = data
+    StandInHandler.latency = latency
+    StandInHandler.rate = rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/sample.mp4"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--mbps', type=float, default=400, help="per-connection cap, 0 for none")
+    args = parser.parse_args()
+
+    import ingest
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    expected = hashlib.sha256(data).hexdigest()
+    server, url = serve(data, args.latency_ms / 1000, int(args.mbps * 125000))
+    work_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    results = {'size_mb': args.size_mb, 'latency_ms': args.latency_ms, 'mbps': args.mbps, 'runs': []}
+
+    for connections in (1, 2, 4, 8):
+        path = os.path.join(work_dir, f"ranges{connections}.mp4")
+        ingest.INGEST_CONNECTIONS = connections
+        started = time.perf_counter()
+        size, hasher = ingest.ingest_url(url, path, max_size=len(data))
+        elapsed = time.perf_counter() - started
+        assert size == len(data) and hasher.hexdigest() == expected, "corrupt download"
+        results['runs'].append({'connections': connections, 'seconds': round(elapsed, 2),
+                                'MBps': round(args.size_mb / elapsed, 1)})
+        os.remove(path)
+
+    # Size limit: rejected from Content-Length before any body is fetched
+    try:
+        ingest.ingest_url(url, os.path.join(work_dir, 'big.mp4'), max_size=len(data) - 1)
+        results['size_limit'] = 'not enforced'
+    except ingest.TooLarge:
+        results['size_limit'] = 'rejected'
+
+    # Resume: the first connection of each part dies after 8MB and its retry continues from there
+    path = os.path.join(work_dir, 'resume.mp4')
+    ingest.INGEST_RETRIES = 2
+    StandInHandler.fail_after = 8 * 1024 * 1024
+    StandInHandler.failures = len(ingest.plan_parts(len(data)))
+    StandInHandler.served = 0
+    size, hasher = ingest.ingest_url(url, path, max_size=len(data))
+    results['resume'] = {'resent_mb': round((StandInHandler.served - len(data)) / 1024 / 1024, 1),
+                         'intact': hasher.hexdigest() == expected}
+
+    # Failure: once retries run out the partial file and its sidecar are removed
+    path = os.path.join(work_dir, 'failed.mp4')
+    ingest.INGEST_RETRIES = 1
+    StandInHandler.failures = None
+    try:
+        ingest.ingest_url(url, path, max_size=len(data))
+    except Exception:
+        pass
+    StandInHandler.fail_after = None
+    results['failed_leftovers'] = sorted(name for name in os.listdir(work_dir) if name.startswith('failed'))
+
+    server.shutdown()
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Concurrent Range-request throughput of send_media against send_from_directory.
+
+Starts gunicorn with a two-route app over a generated media file, then has N clients
+scrub through it with random 1MB-8MB Range requests (what a seeking <video> element does)
+and reports throughput, latency percentiles and the gunicorn workers' CPU time.
+
+    python benchmarks/bench_media.py [--size-mb 512] [--clients 32] [--seconds 10] [--workers 4]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from common import ROOT, percentile, report
+
+MEDIA_DIR = os.getenv('BENCH_MEDIA_DIR', '')
+
+
+def create_bench_app():
+    from flask import Flask, send_from_directory
+    from media import send_media
+
+    app = Flask(__name__)
+
+    @app.route('/media/<filename>')
+    def media(filename):
+        return send_media(MEDIA_DIR, filename)
+
+    @app.route('/flask/<filename>')
+    def flask_send(filename):
+        return send_from_directory(MEDIA_DIR, filename, mimetype='video/mp4')
+
+    return app
+
+
+def children_cpu(pid):
+    """User+system seconds of a process and its children (the gunicorn workers)"""
+    total = 0.0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    ticks = os.sysconf('SC_CLK_TCK')
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except OSError:
+            pass
+    return total
+
+
+def scrub(base_url, size, deadline, latencies, transferred, lock):
+    import requests
+
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        length = random.randint(1, 8) * 1024 * 1024
+        start = random.randrange(0, max(1, size - length))
+        started = time.perf_counter()
+        response = session.get(base_url, headers={'Range': f"bytes={start}-{start + length - 1}"})
+        body = response.content
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 206 and len(body) == length, response.status_code
+        with lock:
+            latencies.append(elapsed * 1000)
+            transferred[0] += len(body)
+
+
+def run(route, port, size, clients, seconds):
+    latencies, transferred, lock = [], [0], threading.Lock()
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=scrub, args=(f"http://127.0.0.1:{port}/{route}/sample.mp4", size,
+                                                     deadline, latencies, transferred, lock))
+               for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'route': route, 'requests': len(latencies), 'MBps': round(transferred[0] / seconds / 1e6, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 1), 'p95_ms': round(percentile(latencies, 0.95), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5089)
+    args = parser.parse_args()
+
+    media_dir = tempfile.mkdtemp(prefix='bench_media_')
+    path = os.path.join(media_dir, 'sample.mp4')
+    with open(path, 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    size = os.path.getsize(path)
+
+    env = dict(os.environ, BENCH_MEDIA_DIR=media_dir,
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, 'benchmarks')]))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b',
+                               f"127.0.0.1:{args.port}", '--log-level', 'warning',
+                               'bench_media:create_bench_app()'], env=env)
+    try:
+        time.sleep(3)
+        results = {'size_mb': args.size_mb, 'clients': args.clients, 'workers': args.workers, 'runs': []}
+        for route in ('flask', 'media'):
+            cpu = children_cpu(server.pid)
+            result = run(route, args.port, size, args.clients, args.seconds)
+            result['server_cpu_s'] = round(children_cpu(server.pid) - cpu, 2)
+            results['runs'].append(result)
+    finally:
+        server.terminate()
+        server.wait()
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Scaling of chunked parallel rendering from 1 to N processes.
+
+    python benchmarks/bench_parallel.py [source.mp4] [--max-chunks N]
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from common import synthetic_source, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('--max-chunks', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    from makeVid import compose_short
+    from ParallelRender import render_parallel
+
+    source = args.source or synthetic_source(duration=60, size=(1920, 1080))
+    description = {'source': source, 'points_to_split': None, 'words': []}
+
+    counts = sorted({1, *[2 ** i for i in range(1, args.max_chunks.bit_length())], args.max_chunks})
+    results = {'source': source, 'runs': []}
+    baseline = None
+    for chunks in counts:
+        work_dir = tempfile.mkdtemp(prefix='bench_parallel_')
+        output_path = os.path.join(work_dir, 'short.mp4')
+        clip = compose_short(**description)
+        started = time.perf_counter()
+        if chunks == 1:
+            clip.write_videofile(output_path, logger=None)
+        else:
+            render_parallel(compose_short, description, clip, output_path, work_dir, chunks)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        results['runs'].append({'chunks': chunks, 'seconds': round(elapsed, 2),
+                                'speedup': round(baseline / elapsed, 2)})
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
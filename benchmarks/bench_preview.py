@@ -0,0 +1,48 @@
+"""Preview render time against the full render, plus the one-off cost of building the proxy assets.
+
+The transcript is warmed first so both renders measure splitting, layout, captions and encode.
+
+    python benchmarks/bench_preview.py [source.mp4] [--backend moviepy|ffmpeg]
+"""
+import os
+import time
+import argparse
+import tempfile
+from common import synthetic_source, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('--backend', default='moviepy')
+    args = parser.parse_args()
+
+    from makeVid import make_vid
+    from Proxy import generate_assets, remove_assets
+    from TranscriptCache import get_words
+
+    source = args.source or synthetic_source(duration=120, size=(1920, 1080))
+    segments = [{'start': 10, 'end': 25, 'order': 0}, {'start': 60, 'end': 80, 'order': 1}]
+    work_dir = tempfile.mkdtemp(prefix='bench_preview_')
+    get_words(source, None)
+
+    remove_assets(source)
+    started = time.perf_counter()
+    manifest = generate_assets(source)
+    assets_seconds = time.perf_counter() - started
+
+    results = {'source': source, 'backend': args.backend, 'assets_seconds': round(assets_seconds, 2),
+               'sprite': manifest['sprite'], 'runs': []}
+    for preview in (False, True):
+        output_path = os.path.join(work_dir, f"{'preview' if preview else 'full'}.mp4")
+        started = time.perf_counter()
+        make_vid([dict(s) for s in segments], source, output_path, backend=args.backend, chunks=1,
+                 preview=preview)
+        results['runs'].append({'preview': preview, 'seconds': round(time.perf_counter() - started, 2),
+                                'bytes': os.path.getsize(output_path)})
+    results['speedup'] = round(results['runs'][0]['seconds'] / results['runs'][1]['seconds'], 1)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
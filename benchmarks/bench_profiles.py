@@ -0,0 +1,88 @@
+"""Encode time, file size and quality of each encode profile on the same rendered short.
+
+A lossless reference short is rendered once with the ffmpeg layout; every profile then encodes
+that reference with its own settings and is scored against it with PSNR, SSIM and (when ffmpeg
+was built with libvmaf) VMAF, after scaling back up to the reference size.
+
+    python benchmarks/bench_profiles.py [--duration 20] [--profiles fast-preview archive]
+"""
+import os
+import re
+import time
+import argparse
+import subprocess
+from common import FFMPEG, SAMPLES_PATH, synthetic_source, report
+
+
+def reference_short(source):
+    """Render (once) the short layout of `source` losslessly, as the baseline every profile is scored on"""
+    from getClips import create_short_ffmpeg
+
+    path = f"{os.path.splitext(source)[0]}.reference.mkv"
+    if not os.path.exists(path):
+        create_short_ffmpeg(source, path, encode_args=['-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0',
+                                                       '-c:a', 'pcm_s16le'])
+    return path
+
+
+def has_filter(name):
+    result = subprocess.run([FFMPEG, '-hide_banner', '-filters'], capture_output=True, text=True)
+    return re.search(rf"\s{name}\s", result.stdout) is not None
+
+
+def score(distorted, reference, size, fps, vmaf):
+    """PSNR, SSIM and optionally VMAF of distorted against reference, compared at the reference size and rate"""
+    metrics = ['psnr', 'ssim'] + (['libvmaf'] if vmaf else [])
+    split = ''.join(f"[d{i}]" for i in range(len(metrics)))
+    refs = ''.join(f"[r{i}]" for i in range(len(metrics)))
+    graph = [f"[0:v]scale={size[0]}:{size[1]}:flags=bicubic,fps={fps},setpts=PTS-STARTPTS,"
+             f"split={len(metrics)}{split}",
+             # Both sides go through fps so their timestamps share a time base and frames pair up
+             f"[1:v]fps={fps},setpts=PTS-STARTPTS,split={len(metrics)}{refs}"]
+    graph += [f"[d{i}][r{i}]{metric}" for i, metric in enumerate(metrics)]
+    result = subprocess.run([FFMPEG, '-hide_banner', '-nostdin', '-i', distorted, '-i', reference,
+                             '-filter_complex', ';'.join(graph), '-f', 'null', '-'],
+                            capture_output=True, text=True, check=True)
+    scores = {'psnr': float(re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr).group(1)),
+              'ssim': float(re.search(r"SSIM .*All:([\d.]+)", result.stderr).group(1))}
+    if vmaf:
+        scores['vmaf'] = float(re.search(r"VMAF score: ([\d.]+)", result.stderr).group(1))
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=int, default=20)
+    parser.add_argument('--source', help='existing 16:9 source to use instead of a test pattern')
+    parser.add_argument('--profiles', nargs='+')
+    args = parser.parse_args()
+
+    from EncodeProfiles import PROFILES, get_profile, ffmpeg_args
+    from FfmpegTools import probe
+
+    reference = reference_short(args.source or synthetic_source(duration=args.duration))
+    infos = probe(reference)
+    vmaf = has_filter('libvmaf')
+    os.makedirs(SAMPLES_PATH, exist_ok=True)
+
+    results = []
+    for name in args.profiles or PROFILES:
+        profile = get_profile(name)
+        fps = profile['fps'] or infos['video_fps']
+        output_path = os.path.join(SAMPLES_PATH, f"profile_{name}.mp4")
+        size = profile['size']
+        started = time.perf_counter()
+        subprocess.run([FFMPEG, '-y', '-loglevel', 'error', '-i', reference,
+                        '-vf', f"scale={size[0]}:{size[1]}:flags=bicubic", '-r', str(fps),
+                        *ffmpeg_args(profile, fps), '-movflags', '+faststart', output_path], check=True)
+        seconds = time.perf_counter() - started
+        results.append({'profile': name, 'size': f"{size[0]}x{size[1]}", 'fps': fps,
+                        'encode_seconds': round(seconds, 2), 'realtime': round(infos['duration'] / seconds, 2),
+                        'mb': round(os.path.getsize(output_path) / 1e6, 2),
+                        **{k: round(v, 3) for k, v in score(output_path, reference, infos['video_size'],
+                                                            infos['video_fps'], vmaf).items()}})
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Cold start of a web worker: time to import the app module and the RSS it leaves behind.
+
+Each run is a fresh interpreter that imports the module the way gunicorn does (app:app), so
+numbers include everything import-time code pulls in. Also lists the heavy media/ML modules
+that ended up loaded; a web worker should have none of them.
+
+    python benchmarks/bench_startup.py [--module app] [--repeat 10]
+
+Needs the SQL_* variables set (db.py reads them at import) but makes no database calls unless
+the imported module does.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from common import ROOT, percentile, report
+
+HEAVY_MODULES = ['numpy', 'moviepy', 'cv2', 'PIL', 'whisper', 'torch', 'requests']
+
+
+def _rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def child(module):
+    started = time.perf_counter()
+    __import__(module)
+    import_seconds = time.perf_counter() - started
+    print(json.dumps({
+        'import_seconds': import_seconds,
+        'rss_mb': _rss_mb(),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, ROOT)
+        child(args.child)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    # In-app cleanup is on by default and would start its thread against the database
+    env = dict(os.environ, UPLOAD_PATH=os.path.join(work_dir, 'uploads'),
+               DOWNLOAD_PATH=os.path.join(work_dir, 'downloads'), CLEANUP_IN_APP='0')
+    runs = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, __file__, '--child', args.module],
+                                cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process_seconds'] = time.perf_counter() - started
+        runs.append(run)
+
+    results = {'module': args.module, 'runs': args.repeat, 'heavy_modules': runs[-1]['heavy_modules']}
+    for metric in ('import_seconds', 'process_seconds', 'rss_mb', 'peak_rss_mb'):
+        values = [run[metric] for run in runs]
+        results[f"{metric}_p50"] = round(percentile(values, 0.5), 3)
+        results[f"{metric}_p95"] = round(percentile(values, 0.95), 3)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
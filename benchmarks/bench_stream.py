@@ -0,0 +1,57 @@
+"""Peak RSS and throughput of the MoviePy composite render vs the streaming engine on long sources.
+
+Each render runs in its own process and peak RSS is summed over it and its ffmpeg
+subprocesses. Segments are spread over the whole source so readers seek deep into long files.
+
+    python benchmarks/bench_stream.py [--durations 600 3600] [--segments 8] [--segment-seconds 6]
+"""
+import sys
+import json
+import argparse
+from common import synthetic_source, segments_for, run_tree_measured, report
+
+WORDS = [{'word': f" word{i}", 'start': i * 0.5, 'end': i * 0.5 + 0.4} for i in range(2000)]
+
+
+def render(backend, source, segments, output_path):
+    from TranscriptCache import remap_words
+
+    words = remap_words(WORDS, segments)
+    if backend == 'stream':
+        from StreamRender import render_stream
+        render_stream(source, segments, output_path, words=words)
+    else:
+        from makeVid import compose_short
+        compose_short(source, segments, words).write_videofile(output_path, logger=None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--durations', type=int, nargs='+', default=[600, 3600])
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--segment-seconds', type=float, default=6)
+    parser.add_argument('--render', nargs=4, metavar=('BACKEND', 'SOURCE', 'SEGMENTS', 'OUTPUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        backend, source, segments, output_path = args.render
+        render(backend, source, json.loads(segments), output_path)
+        return
+
+    results = []
+    for duration in args.durations:
+        source = synthetic_source(duration=duration, size=(1920, 1080))
+        segments = segments_for(duration, args.segments, args.segment_seconds)
+        frames = int(args.segments * args.segment_seconds * 30)
+        for backend in ('moviepy', 'stream'):
+            output_path = f"{source}.{backend}.mp4"
+            wall, rss = run_tree_measured([sys.executable, __file__, '--render', backend, source,
+                                           json.dumps(segments), output_path])
+            results.append({'source_seconds': duration, 'backend': backend, 'seconds': round(wall, 1),
+                            'fps': round(frames / wall, 1), 'peak_tree_rss_mb': round(rss)})
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+# Benchmarks run as scripts from anywhere; make the service modules importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from imageio_ffmpeg import get_ffmpeg_exe
+    FFMPEG = get_ffmpeg_exe()
+except ImportError:
+    FFMPEG = 'ffmpeg'
+
+SAMPLES_PATH = os.getenv('BENCH_SAMPLES_PATH', os.path.join(ROOT, 'benchmarks', 'samples'))
+
+
+def synthetic_source(duration=30, size=(1920, 1080), fps=30, name=None):
+    """Generate (once) a test pattern video with a sine tone and return its path"""
+    os.makedirs(SAMPLES_PATH, exist_ok=True)
+    name = name or f"testsrc_{size[0]}x{size[1]}_{duration}s.mp4"
+    path = os.path.join(SAMPLES_PATH, name)
+    if not os.path.exists(path):
+        subprocess.run([
+            FFMPEG, '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=size={size[0]}x{size[1]}:rate={fps}:duration={duration}",
+            '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={duration}",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', str(fps * 2),
+            '-c:a', 'aac', '-shortest', path
+        ], check=True)
+    return path
+
+
+def letterboxed_source(duration=120, picture=(1920, 800), size=(1920, 1080), fps=30):
+    """Generate (once) a test video with black bars of known size around the picture, and a tone"""
+    os.makedirs(SAMPLES_PATH, exist_ok=True)
+    path = os.path.join(SAMPLES_PATH, f"letterbox_{picture[0]}x{picture[1]}_in_{size[0]}x{size[1]}_{duration}s.mp4")
+    if not os.path.exists(path):
+        x, y = (size[0] - picture[0]) // 2, (size[1] - picture[1]) // 2
+        subprocess.run([
+            FFMPEG, '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=size={picture[0]}x{picture[1]}:rate={fps}:duration={duration}",
+            '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={duration}",
+            '-vf', f"pad={size[0]}:{size[1]}:{x}:{y}:black",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', str(fps * 2),
+            '-c:a', 'aac', '-shortest', path
+        ], check=True)
+    return path
+
+
+def segments_for(duration, count, length):
+    """`count` segments of `length` seconds spread evenly over a source of `duration` seconds"""
+    step = duration / count
+    return [{'start': round(i * step + 1, 3), 'end': round(i * step + 1 + length, 3), 'order': i}
+            for i in range(count)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_measured(cmd):
+    """Run a command and return (wall seconds, peak RSS in MB) of that child alone"""
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{cmd} exited with status {status}")
+    # ru_maxrss is KB on Linux
+    return wall, usage.ru_maxrss / 1024
+
+
+def _descendants(pid):
+    children = []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return [pid] + [d for child in children for d in _descendants(child)]
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0
+
+
+def run_tree_measured(cmd, interval=0.2):
+    """Run a command and return (wall seconds, peak summed RSS in MB of it and all its subprocesses).
+
+    ru_maxrss only reports the largest single process, which hides renders that keep several
+    ffmpeg readers alive at once; this samples the whole process tree instead (Linux only).
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd)
+    peak = 0
+    while process.poll() is None:
+        peak = max(peak, sum(_rss_mb(pid) for pid in _descendants(process.pid)))
+        time.sleep(interval)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"{cmd} exited with status {process.returncode}")
+    return wall, peak
+
+
+def report(results):
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,60 @@
+"""Pixel-diff the ffmpeg filtergraph short layout against the MoviePy create_short output.
+
+    python benchmarks/compare_layout.py [source.mp4] [--min-psnr 30]
+
+Exits non-zero when any sampled frame falls below the PSNR threshold.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from common import synthetic_source, report
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('--samples', type=int, default=8)
+    parser.add_argument('--min-psnr', type=float, default=30.0)
+    args = parser.parse_args()
+
+    from moviepy import VideoFileClip
+    from getClips import create_short, create_short_ffmpeg
+
+    source = args.source or synthetic_source(duration=10, size=(1280, 720))
+    work_dir = tempfile.mkdtemp(prefix='compare_layout_')
+    native_path = os.path.join(work_dir, 'native.mkv')
+
+    started = time.perf_counter()
+    # Lossless RGB so only the layout itself is compared
+    create_short_ffmpeg(source, native_path, pix_fmt='rgb24',
+                        encode_args=['-c:v', 'libx264rgb', '-crf', '0', '-preset', 'ultrafast', '-an'])
+    native_seconds = time.perf_counter() - started
+
+    clip = VideoFileClip(source)
+    short = create_short(clip)
+    native = VideoFileClip(native_path)
+
+    frames = []
+    for t in np.linspace(0, min(short.duration, native.duration) - 1 / clip.fps, args.samples):
+        expected = short.get_frame(t)
+        actual = native.get_frame(t)
+        diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+        frames.append({'t': round(float(t), 3), 'psnr': round(psnr(expected, actual), 2),
+                       'mean_abs_diff': round(float(diff.mean()), 3), 'max_abs_diff': int(diff.max())})
+
+    worst = min(frame['psnr'] for frame in frames)
+    report({'source': source, 'native_render_seconds': round(native_seconds, 2),
+            'worst_psnr': worst, 'frames': frames})
+    sys.exit(0 if worst >= args.min_psnr else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Query plans and latencies of the hot cleanup/lookup queries before and after the indexes.
+
+Fills the configured database (SQL_* environment) with synthetic rows, so point it at a
+scratch database only.
+
+    python benchmarks/db_load.py --yes [--rows 1000000] [--repeat 50]
+"""
+import time
+import uuid
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from common import report
+
+# Read-only versions of the statements the service runs on every request or cleanup cycle
+QUERIES = {
+    'expired_processed': ("SELECT TOP (500) path, original_id FROM processed_files WHERE expires_at < ?",
+                          lambda: (datetime.now(),)),
+    'original_by_filename': ("SELECT id FROM original_files WHERE filename = ?",
+                             lambda: (f"upload_{random.randrange(QUERY_ROWS)}.mp4",)),
+    'orphaned_originals': ("""
+        SELECT TOP (500) id FROM original_files
+        WHERE created_at < DATEADD(minute, -30, GETDATE())
+        AND NOT EXISTS (SELECT 1 FROM processed_files p WHERE p.original_id = original_files.id)
+    """, lambda: ()),
+    'orphaned_originals_not_in': ("""
+        SELECT TOP (500) id FROM original_files
+        WHERE id NOT IN (SELECT original_id FROM processed_files)
+        AND created_at < DATEADD(minute, -30, GETDATE())
+    """, lambda: ()),
+    'blob_by_hash': ("SELECT filename, path FROM blobs WHERE content_hash = ?",
+                     lambda: (f"{random.randrange(QUERY_ROWS):064x}",)),
+}
+QUERY_ROWS = 1
+
+
+def fill(conn, rows, batch=10000):
+    """Insert `rows` originals, about two thirds of them with a processed short"""
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    now = datetime.now()
+    for start in range(0, rows, batch):
+        originals, processed, blobs = [], [], []
+        for i in range(start, min(start + batch, rows)):
+            original_id = uuid.uuid4()
+            content_hash = f"{i:064x}"
+            path = f"/uploads/upload_{i}.mp4"
+            created = now - timedelta(minutes=random.randrange(60 * 24 * 7))
+            originals.append((original_id, f"upload_{i}.mp4", path, created, content_hash))
+            blobs.append((content_hash, f"upload_{i}.mp4", path, 0, 1))
+            if i % 3:
+                expires = created + timedelta(hours=random.randrange(1, 48))
+                processed.append((uuid.uuid4(), f"Short-{i}.mp4", 'title', f"/downloads/Short-{i}.mp4",
+                                  original_id, created, expires))
+        cursor.executemany("INSERT INTO original_files (id, filename, path, created_at, content_hash) "
+                           "VALUES (?, ?, ?, ?, ?)", originals)
+        cursor.executemany("INSERT INTO blobs (content_hash, filename, path, size, ref_count) "
+                           "VALUES (?, ?, ?, ?, ?)", blobs)
+        if processed:
+            cursor.executemany("INSERT INTO processed_files (id, filename, title, path, original_id, "
+                               "created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)", processed)
+        conn.commit()
+
+
+def drop_indexes(conn):
+    from migrations import INDEXES
+    cursor = conn.cursor()
+    for name, table, _ in INDEXES:
+        cursor.execute(f"IF EXISTS (SELECT * FROM sys.indexes WHERE name = '{name}' "
+                       f"AND object_id = OBJECT_ID('{table}')) DROP INDEX {name} ON {table}")
+    # Only the index migration is replayed; later ones alter columns and cannot run twice
+    cursor.execute("DELETE FROM schema_migrations WHERE version = 4")
+    conn.commit()
+
+
+def plan(conn, sql, params):
+    cursor = conn.cursor()
+    cursor.execute("SET SHOWPLAN_TEXT ON")
+    try:
+        cursor.execute(sql, params)
+        lines = []
+        # The first result set echoes the statement; the operator tree follows
+        while True:
+            lines.extend(row[0].rstrip() for row in cursor.fetchall())
+            if not cursor.nextset():
+                break
+        return lines[1:]
+    finally:
+        cursor.execute("SET SHOWPLAN_TEXT OFF")
+
+
+def measure(conn, repeat):
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        cursor = conn.cursor()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params())
+            cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+            'plan': plan(conn, sql, params()),
+        }
+    return results
+
+
+def main():
+    global QUERY_ROWS
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--skip-fill', action='store_true', help="reuse rows from an earlier run")
+    parser.add_argument('--yes', action='store_true', help="confirm the database is disposable")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this writes --rows rows into the SQL_* database; pass --yes to continue")
+
+    from db import get_db_connection
+    from migrations import migrate
+
+    QUERY_ROWS = args.rows
+    with get_db_connection() as conn:
+        migrate(conn)
+        if not args.skip_fill:
+            fill(conn, args.rows)
+        drop_indexes(conn)
+        before = measure(conn, args.repeat)
+        started = time.perf_counter()
+        migrate(conn)
+        index_seconds = time.perf_counter() - started
+        after = measure(conn, args.repeat)
+
+    report({'rows': args.rows, 'index_build_seconds': round(index_seconds, 1),
+            'before': before, 'after': after})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""End-to-end benchmark suite over synthetic sources, with JSON output and baseline comparison.
+
+Generates test pattern sources (testsrc2 + sine tone) at each size and duration, plus a
+letterboxed variant per size for black bar detection, then runs every pipeline stage on them
+in a fresh process per run. Each stage reports latency percentiles over --repeat runs,
+throughput and the peak RSS of the process tree (ffmpeg included).
+
+With --flow, it also drives the whole service: upload, proxy job, /api/process render and the
+cached repeat, through the Flask test client and in-process workers. This needs the SQL_*
+variables pointing at a disposable local SQL Server, e.g.
+
+    docker run -e ACCEPT_EULA=Y -e MSSQL_SA_PASSWORD=Bench-pass1 -p 1433:1433 mcr.microsoft.com/mssql/server:2022-latest
+
+and Whisper installed. The transcribe stage is skipped when Whisper is missing; render stages use
+fixed captions so they measure rendering only.
+
+    python benchmarks/suite.py [--sizes 720p 1080p 4k] [--durations 30 120] [--repeat 3]
+                               [--stages probe render_ffmpeg ...] [--flow]
+                               [--output results.json] [--baseline benchmarks/baseline.json]
+                               [--save-baseline] [--tolerance 0.15]
+
+Exits with status 1 when a stage is slower or larger than the baseline by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from common import (ROOT, FFMPEG, synthetic_source, letterboxed_source, segments_for, percentile,
+                    run_tree_measured, report)
+
+SIZES = {'720p': (1280, 720), '1080p': (1920, 1080), '4k': (3840, 2160)}
+STAGES = ['probe', 'detect_crop', 'cut', 'transcribe', 'proxy', 'render_moviepy', 'render_ffmpeg',
+          'render_stream', 'render_preview']
+SEGMENTS = 3
+SEGMENT_SECONDS = 5
+WORDS = [{'word': f" word{i}", 'start': i * 0.5, 'end': i * 0.5 + 0.4} for i in range(20000)]
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def render(source, work_dir, backend='ffmpeg', preview=False):
+    import makeVid
+    from FfmpegTools import probe
+
+    # Fixed captions keep Whisper out of render timings; the transcribe stage measures it
+    makeVid.get_words = lambda vid, model_size=None: WORDS
+    duration = probe(source)['duration']
+    segments = segments_for(duration, SEGMENTS, SEGMENT_SECONDS)
+    output_path = os.path.join(work_dir, 'short.mp4')
+    trace = makeVid.JobTrace()
+    makeVid.make_vid(segments, source, output_path, backend=backend, preview=preview, trace=trace, chunks=1)
+    return {'frames': sum(stage.get('frames', 0) for stage in trace.stages),
+            'output_mb': round(os.path.getsize(output_path) / 1e6, 2)}
+
+
+def run_stage(stage, source, work_dir):
+    """Run one stage once in this process and return what it processed"""
+    from FfmpegTools import probe
+
+    infos = probe(source)
+    frames = int(infos['duration'] * infos['video_fps'])
+    if stage == 'probe':
+        return {'files': 1}
+    if stage == 'detect_crop':
+        from EditVideo import detect_crop
+        return {'frames': frames, 'crop': detect_crop(source)}
+    if stage == 'cut':
+        from SplitVideo import cut_segments
+        cut_segments(source, segments_for(infos['duration'], SEGMENTS, SEGMENT_SECONDS),
+                     os.path.join(work_dir, 'cut.mp4'), work_dir, infos=infos)
+        return {'seconds_cut': SEGMENTS * SEGMENT_SECONDS}
+    if stage == 'transcribe':
+        try:
+            import whisper  # noqa: F401
+        except ImportError:
+            return {'skipped': 'whisper not installed'}
+        import TranscriptCache
+        TranscriptCache.CACHE_PATH = work_dir  # cold cache every run
+        words = TranscriptCache.get_words(source, os.getenv('BENCH_WHISPER_MODEL', 'tiny'))
+        return {'audio_seconds': round(infos['duration'], 1), 'words': len(words)}
+    if stage == 'proxy':
+        import Proxy
+        Proxy.PROXY_PATH = work_dir
+        Proxy.generate_assets(source)
+        return {'frames': frames}
+    if stage == 'render_preview':
+        return render(source, work_dir, backend='ffmpeg', preview=True)
+    if stage.startswith('render_'):
+        return render(source, work_dir, backend=stage[len('render_'):])
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def measure_stage(stage, source, repeat):
+    """Run a stage `repeat` times in fresh processes; percentiles, throughput and peak tree RSS"""
+    walls, peaks, output = [], [], {}
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix=f"suite_{stage}_")
+        result_path = os.path.join(work_dir, 'result.json')
+        try:
+            wall, peak = run_tree_measured([sys.executable, __file__, '--run-stage', stage, source, work_dir,
+                                            result_path])
+            with open(result_path) as f:
+                output = json.load(f)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        if 'skipped' in output:
+            return {'stage': stage, 'skipped': output['skipped']}
+        walls.append(wall)
+        peaks.append(peak)
+
+    median = percentile(walls, 0.5)
+    result = {'stage': stage, 'runs': repeat, 'p50_seconds': round(median, 3),
+              'p95_seconds': round(percentile(walls, 0.95), 3), 'mean_seconds': round(sum(walls) / repeat, 3),
+              'peak_rss_mb': round(max(peaks)), **output}
+    for unit in ('frames', 'audio_seconds', 'seconds_cut', 'files'):
+        if output.get(unit):
+            result[f"{unit}_per_second"] = round(output[unit] / median, 2)
+    return result
+
+
+def drain_jobs(worker_name='bench'):
+    """Run every queued job in this process's workers; returns the number run"""
+    from db import get_db_connection
+    from jobs import claim_job
+    from worker import run_isolated
+
+    count = 0
+    while True:
+        with get_db_connection() as conn:
+            claimed = claim_job(conn, worker_name)
+        if claimed is None:
+            return count
+        run_isolated(*claimed)
+        count += 1
+
+
+def run_flow(source, repeat, work_dir):
+    """Upload, proxy, render and cached repeat through the real app and worker code"""
+    for name in ('UPLOAD_PATH', 'DOWNLOAD_PATH', 'PROXY_PATH', 'TRANSCRIPT_CACHE_PATH'):
+        os.environ[name] = os.path.join(work_dir, name.split('_')[0].lower())
+    from app import app, init_db
+
+    init_db()
+    client = app.test_client()
+    duration = None
+    runs = []
+    for i in range(repeat):
+        timings = {}
+        started = time.perf_counter()
+        with open(source, 'rb') as f:
+            response = client.post('/api/upload', data={'video': (f, f"bench{i}.mp4")},
+                                   content_type='multipart/form-data')
+        timings['upload'] = time.perf_counter() - started
+        upload = response.get_json()
+
+        started = time.perf_counter()
+        drain_jobs()
+        timings['proxy'] = time.perf_counter() - started
+
+        if duration is None:
+            from FfmpegTools import probe
+            duration = probe(source)['duration']
+        # Shift the segments each run so the render cache never answers the first request
+        segments = [dict(s, start=s['start'] + i * 0.1, end=s['end'] + i * 0.1)
+                    for s in segments_for(duration - 1, SEGMENTS, SEGMENT_SECONDS)]
+        body = {'source': upload['videoUrl'], 'segments': segments, 'title': f"bench{i}", 'model': 'tiny'}
+        started = time.perf_counter()
+        response = client.post('/api/process', json=body)
+        task_id = response.get_json()['task_id']
+        drain_jobs()
+        job = client.get(f"/api/jobs/{task_id}").get_json()
+        timings['render'] = time.perf_counter() - started
+        if job['status'] != 'done':
+            raise RuntimeError(f"Render failed: {job.get('error')}")
+
+        started = time.perf_counter()
+        cached = client.post('/api/process', json=body)
+        timings['cached_request'] = time.perf_counter() - started
+        if cached.status_code != 200:
+            raise RuntimeError(f"Repeat request was not served from the cache ({cached.status_code})")
+        timings['end_to_end'] = timings['upload'] + timings['proxy'] + timings['render']
+        runs.append({'timings': timings, 'stages': (job.get('timings') or {}).get('stages', [])})
+    return runs
+
+
+def measure_flow(source, repeat):
+    work_dir = tempfile.mkdtemp(prefix='suite_flow_')
+    result_path = os.path.join(work_dir, 'result.json')
+    try:
+        wall, peak = run_tree_measured([sys.executable, __file__, '--run-flow', source, str(repeat), work_dir,
+                                        result_path])
+        with open(result_path) as f:
+            runs = json.load(f)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result = {'stage': 'flow', 'runs': repeat, 'wall_seconds': round(wall, 1), 'peak_rss_mb': round(peak)}
+    for step in runs[0]['timings']:
+        values = [run['timings'][step] for run in runs]
+        result[f"{step}_p50_seconds"] = round(percentile(values, 0.5), 3)
+        result[f"{step}_p95_seconds"] = round(percentile(values, 0.95), 3)
+    result['p50_seconds'] = result['end_to_end_p50_seconds']
+    result['render_stages'] = runs[-1]['stages']
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Entries whose p50 time or peak RSS grew by more than `tolerance` over the baseline"""
+    previous = {(r['source'], r['stage']): r for r in baseline.get('results', [])}
+    rows, regressions = [], []
+    for result in results:
+        old = previous.get((result['source'], result['stage']))
+        if old is None or 'skipped' in result or 'skipped' in old:
+            continue
+        row = {'source': result['source'], 'stage': result['stage']}
+        for metric in ('p50_seconds', 'peak_rss_mb'):
+            if old.get(metric) and metric in result:
+                row[metric] = {'baseline': old[metric], 'current': result[metric],
+                               'ratio': round(result[metric] / old[metric], 3)}
+                if result[metric] > old[metric] * (1 + tolerance):
+                    regressions.append(f"{result['source']} {result['stage']} {metric}: "
+                                       f"{old[metric]} -> {result[metric]}")
+        rows.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['720p', '1080p'])
+    parser.add_argument('--durations', type=int, nargs='+', default=[30])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--flow', action='store_true', help='also run the full API flow (needs SQL_* and Whisper)')
+    parser.add_argument('--output', help='also write the results JSON here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    parser.add_argument('--run-stage', nargs=4, metavar=('STAGE', 'SOURCE', 'WORK_DIR', 'RESULT'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--run-flow', nargs=4, metavar=('SOURCE', 'REPEAT', 'WORK_DIR', 'RESULT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage or args.run_flow:
+        # MoviePy and ffmpeg chatter must not end up in the JSON report on stdout
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    if args.run_stage:
+        stage, source, work_dir, result_path = args.run_stage
+        with open(result_path, 'w') as f:
+            json.dump(run_stage(stage, source, work_dir), f)
+        return
+    if args.run_flow:
+        source, repeat, work_dir, result_path = args.run_flow
+        with open(result_path, 'w') as f:
+            json.dump(run_flow(source, int(repeat), work_dir), f)
+        return
+
+    results = []
+    for label in args.sizes:
+        size = SIZES[label]
+        for duration in args.durations:
+            source = synthetic_source(duration=duration, size=size)
+            for stage in args.stages:
+                if stage != 'detect_crop':
+                    results.append({'source': f"{label}-{duration}s", **measure_stage(stage, source, args.repeat)})
+            if 'detect_crop' in args.stages:
+                # 2.35:1 picture letterboxed into the frame
+                picture = (size[0], int(size[0] / 2.35) // 2 * 2)
+                letterboxed = letterboxed_source(duration=duration, picture=picture, size=size)
+                results.append({'source': f"{label}-{duration}s-letterbox",
+                                **measure_stage('detect_crop', letterboxed, args.repeat)})
+            if args.flow:
+                results.append({'source': f"{label}-{duration}s", **measure_flow(source, args.repeat)})
+
+    output = {
+        'machine': {'cpus': os.cpu_count(), 'python': platform.python_version(), 'platform': platform.platform(),
+                    'ffmpeg': FFMPEG},
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+    }
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            output['comparison'], regressions = compare(results, json.load(f), args.tolerance)
+        output['regressions'] = regressions
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    report(output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 import os
+import json
+import shutil
 import logging
-import pyodbc
-from datetime import datetime
+from TranscriptCache import invalidate as invalidate_transcripts
+from Proxy import remove_assets, asset_dir, PROXY_PATH
+from uploads import release_blobs
+from jobs import QUEUED, RUNNING, DONE, FAILED
+from db import get_db_connection, get_applock
+from datetime import datetime, UTC
 import time
 
 # Configure logging
@@ -9,81 +15,270 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('CleanupJob')
 
 # Get environment variables
-SQL_SERVER = os.environ['SQL_SERVER']
-SQL_DATABASE = os.environ['SQL_DATABASE']
-SQL_USERNAME = os.environ['SQL_USERNAME']
-SQL_PASSWORD = os.environ['SQL_PASSWORD']
 UPLOAD_PATH = os.getenv('UPLOAD_PATH', r'D:\home\site\wwwroot\uploads')
 DOWNLOAD_PATH = os.getenv('DOWNLOAD_PATH', r'D:\home\site\wwwroot\downloads')
+CLEANUP_BATCH = int(os.getenv('CLEANUP_BATCH', 500))  # rows per DELETE statement
+ORPHAN_MINUTES = 30  # originals no short uses are deleted this long after upload
+UPLOAD_SESSION_HOURS = int(os.getenv('UPLOAD_SESSION_HOURS', 24))  # resumable uploads idle this long are dropped
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', 7))  # finished jobs and their timings are kept this long
+# Combined size limit of UPLOAD_PATH, DOWNLOAD_PATH and the PROXY_PATH asset folders; 0 disables eviction
+DISK_QUOTA_MB = int(os.getenv('DISK_QUOTA_MB', 0))
+DISK_QUOTA_TARGET = float(os.getenv('DISK_QUOTA_TARGET', 0.9))  # evict down to this fraction of the quota
+QUOTA_MIN_AGE = float(os.getenv('QUOTA_MIN_AGE', 300))  # seconds; younger files may still be written
 
 
-def get_db_connection():
-    conn_str = f"Driver={{ODBC Driver 18 for SQL Server}};Server={SQL_SERVER};Database={SQL_DATABASE};Uid={SQL_USERNAME};Pwd={SQL_PASSWORD};Encrypt=yes;TrustServerCertificate=no;"
-    return pyodbc.connect(conn_str)
+def remove_file(path, kind):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Deleted {kind} file: {path}")
+    except OSError as e:
+        logger.error(f"Error deleting {kind} file {path}: {str(e)}")
+
+
+def remove_original(path):
+    """Delete an upload with its cached transcript and preview assets"""
+    invalidate_transcripts(path)
+    remove_assets(path)
+    remove_file(path, 'original')
+
+
+def delete_originals(cursor, where, params, keep=()):
+    """Delete original_files rows in batches, except those whose path is in `keep`; returns the
+    file paths no longer referenced"""
+    paths = []
+    while True:
+        cursor.execute(f"""
+            DELETE TOP (?) FROM original_files
+            OUTPUT deleted.path
+            WHERE {where}
+            AND path NOT IN (SELECT value FROM OPENJSON(?))
+        """, (CLEANUP_BATCH, *params, json.dumps(sorted(keep))))
+        batch = [row[0] for row in cursor.fetchall()]
+        paths.extend(batch)
+        if len(batch) < CLEANUP_BATCH:
+            break
+    return release_blobs(cursor, paths)
 
 
 def cleanup_files():
+    """Delete expired processed files and their originals with set-based batch statements.
+
+    Returns False without doing anything while another process holds the cleanup lock.
+    """
+    now = datetime.now(UTC)
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        now = datetime.utcnow()
+        # One cleanup per deployment: skip this cycle while another instance or process runs one
+        if not get_applock(cursor, 'cleanup'):
+            logger.info("Cleanup already running elsewhere; skipping this cycle")
+            return False
 
         # Cleanup expired processed files
-        cursor.execute("""
-            SELECT id, path, original_id 
-            FROM processed_files 
-            WHERE expires_at < ?
-        """, now)
-        expired_processed = cursor.fetchall()
-
-        for row in expired_processed:
-            file_id, path, original_id = row
-            try:
-                # Delete processed file
-                if os.path.exists(path):
-                    os.remove(path)
-                    logger.info(f"Deleted expired file: {path}")
-
-                # Delete original file if exists
-                if original_id:
-                    cursor.execute("SELECT path FROM original_files WHERE id = ?", original_id)
-                    original_path = cursor.fetchone()
-                    if original_path and os.path.exists(original_path[0]):
-                        os.remove(original_path[0])
-                        logger.info(f"Deleted original file: {original_path[0]}")
-
-                # Delete database records
-                cursor.execute("DELETE FROM processed_files WHERE id = ?", file_id)
-                if original_id:
-                    cursor.execute("DELETE FROM original_files WHERE id = ?", original_id)
-            except Exception as e:
-                logger.error(f"Error deleting files: {str(e)}")
-
-        # Cleanup orphaned original files (older than 30 minutes)
-        cursor.execute("""
-            SELECT id, path FROM original_files
-            WHERE id NOT IN (SELECT original_id FROM processed_files)
-            AND created_at < DATEADD(minute, -30, GETDATE())
-        """)
-        orphaned_originals = cursor.fetchall()
-
-        for row in orphaned_originals:
-            file_id, path = row
+        processed_paths, original_ids = [], set()
+        while True:
+            cursor.execute("""
+                DELETE TOP (?) FROM processed_files
+                OUTPUT deleted.path, deleted.original_id
+                WHERE expires_at < ?
+            """, (CLEANUP_BATCH, now))
+            batch = cursor.fetchall()
+            processed_paths.extend(row[0] for row in batch)
+            original_ids.update(str(row[1]) for row in batch if row[1])
+            if len(batch) < CLEANUP_BATCH:
+                break
+
+        # Renders are content-addressed, so a live row or a render in flight may share an expired file
+        if processed_paths:
+            cursor.execute("""
+                SELECT path FROM processed_files
+                WHERE path IN (SELECT value FROM OPENJSON(?))
+                UNION
+                SELECT JSON_VALUE(payload, '$.output_path') FROM jobs
+                WHERE status IN (?, ?) AND JSON_VALUE(payload, '$.output_path') IN (SELECT value FROM OPENJSON(?))
+            """, (json.dumps(processed_paths), QUEUED, RUNNING, json.dumps(processed_paths)))
+            in_use = {row[0] for row in cursor.fetchall()}
+            processed_paths = [path for path in set(processed_paths) if path not in in_use]
+
+        # Resumable uploads nobody has written to in a while; a PATCH in progress locks its row
+        abandoned_uploads = []
+        while True:
+            cursor.execute(f"""
+                DELETE TOP (?) FROM upload_sessions WITH (READPAST)
+                OUTPUT deleted.path
+                WHERE updated_at < DATEADD(hour, -{UPLOAD_SESSION_HOURS}, GETDATE())
+            """, CLEANUP_BATCH)
+            batch = [row[0] for row in cursor.fetchall()]
+            abandoned_uploads.extend(batch)
+            if len(batch) < CLEANUP_BATCH:
+                break
+
+        # Finished jobs past retention, with their payloads and timings
+        purged_jobs = 0
+        while True:
+            cursor.execute(f"""
+                DELETE TOP (?) FROM jobs
+                WHERE status IN (?, ?) AND finished_at < DATEADD(day, -{JOB_RETENTION_DAYS}, SYSUTCDATETIME())
+            """, (CLEANUP_BATCH, DONE, FAILED))
+            purged_jobs += cursor.rowcount
+            if cursor.rowcount < CLEANUP_BATCH:
+                break
+
+        # Queued and running jobs read their input whatever its age
+        referenced = referenced_paths(cursor)
+
+        # Originals of expired shorts, unless another short or a job still uses them
+        expired_originals = set()
+        if original_ids:
+            expired_originals = delete_originals(cursor, """
+                id IN (SELECT CAST(value AS UNIQUEIDENTIFIER) FROM OPENJSON(?))
+                AND NOT EXISTS (SELECT 1 FROM processed_files p WHERE p.original_id = original_files.id)
+            """, (json.dumps(sorted(original_ids)),), keep=referenced)
+
+        # Cleanup orphaned original files (older than ORPHAN_MINUTES)
+        orphaned_originals = delete_originals(cursor, f"""
+            created_at < DATEADD(minute, -{ORPHAN_MINUTES}, GETDATE())
+            AND NOT EXISTS (SELECT 1 FROM processed_files p WHERE p.original_id = original_files.id)
+        """, (), keep=referenced)
+
+        conn.commit()
+
+    # Files go only after the rows are committed, so a failed cycle never leaves dangling rows
+    for path in processed_paths:
+        remove_file(path, 'expired processed')
+    for path in expired_originals | orphaned_originals:
+        remove_original(path)
+    for path in abandoned_uploads:
+        remove_file(path, 'abandoned upload')
+    logger.info(f"Cleanup removed {len(processed_paths)} processed, "
+                f"{len(expired_originals | orphaned_originals)} original and {len(abandoned_uploads)} "
+                f"abandoned upload files, and {purged_jobs} finished jobs")
+    return True
+
+
+def disk_usage(folders):
+    """(total bytes, [(last access, size, path)]) of the regular files directly inside folders"""
+    total, files = 0, []
+    for folder in folders:
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
             try:
-                if os.path.exists(path):
-                    os.remove(path)
-                    logger.info(f"Deleted orphaned file: {path}")
-                cursor.execute("DELETE FROM original_files WHERE id = ?", file_id)
-            except Exception as e:
-                logger.error(f"Error deleting orphaned file: {str(e)}")
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            total += stat.st_size
+            # Serving a file may not bump atime (relatime, noatime); a rewrite counts as access too
+            files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+    return total, files
+
+
+def asset_usage(root):
+    """(total bytes, [(last access, size, folder)]) of the per-video asset folders under root.
+
+    Each folder counts as one entry, since its proxy, sprite sheet and waveform go together.
+    """
+    total, folders = 0, []
+    try:
+        entries = [entry for entry in os.scandir(root) if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return total, folders
+    for entry in entries:
+        size, files = disk_usage([entry.path])
+        if files:
+            total += size
+            folders.append((max(accessed for accessed, _, _ in files), size, entry.path))
+    return total, folders
+
+
+def referenced_paths(cursor):
+    """Files that must stay whatever their age: job inputs and outputs, uploads in progress and
+    originals that a live short still points to"""
+    cursor.execute("""
+        SELECT JSON_VALUE(payload, '$.input_path') FROM jobs WHERE status IN (?, ?)
+        UNION SELECT JSON_VALUE(payload, '$.output_path') FROM jobs WHERE status IN (?, ?)
+        UNION SELECT JSON_VALUE(payload, '$.path') FROM jobs WHERE status IN (?, ?)
+        UNION SELECT path FROM upload_sessions
+        UNION SELECT o.path FROM original_files o
+              WHERE EXISTS (SELECT 1 FROM processed_files p WHERE p.original_id = o.id)
+    """, (QUEUED, RUNNING) * 3)
+    return {row[0] for row in cursor.fetchall() if row[0]}
+
+
+def enforce_quota(quota_mb=None):
+    """Evict least recently accessed unreferenced files until the folders are under the quota.
 
+    Returns the number of files and asset folders removed. Rows go in batched set-based deletes
+    before the files.
+    """
+    quota = (DISK_QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024
+    if quota <= 0:
+        return 0
+    usage, files = disk_usage([UPLOAD_PATH, DOWNLOAD_PATH])
+    asset_bytes, asset_folders = asset_usage(PROXY_PATH)
+    usage += asset_bytes
+    files += asset_folders
+    if usage <= quota:
+        return 0
+
+    target = quota * DISK_QUOTA_TARGET
+    cutoff = time.time() - QUOTA_MIN_AGE
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        referenced = referenced_paths(cursor)
+        # Assets of files in use stay too; a proxy job may be writing them
+        referenced |= {asset_dir(path) for path in referenced}
+        victims = []
+        for accessed, size, path in sorted(files):
+            if usage <= target:
+                break
+            if path in referenced or accessed > cutoff:
+                continue
+            victims.append(path)
+            usage -= size
+        downloads, proxies = os.path.abspath(DOWNLOAD_PATH), os.path.abspath(PROXY_PATH)
+        # Asset folders have no rows; previews fall back to the original without them
+        assets = [p for p in victims if os.path.dirname(os.path.abspath(p)) == proxies]
+        processed = [p for p in victims if os.path.dirname(os.path.abspath(p)) == downloads]
+        originals = [p for p in victims if os.path.dirname(os.path.abspath(p)) not in (downloads, proxies)]
+
+        for i in range(0, len(processed), CLEANUP_BATCH):
+            cursor.execute("""
+                DELETE FROM processed_files WHERE path IN (SELECT value FROM OPENJSON(?))
+            """, json.dumps(processed[i:i + CLEANUP_BATCH]))
+        released = set()
+        for i in range(0, len(originals), CLEANUP_BATCH):
+            batch = originals[i:i + CLEANUP_BATCH]
+            released |= delete_originals(cursor, """
+                path IN (SELECT value FROM OPENJSON(?))
+                AND NOT EXISTS (SELECT 1 FROM processed_files p WHERE p.original_id = original_files.id)
+            """, (json.dumps(batch),))
+            # Files without a row (abandoned partial uploads) have nothing to release
+            cursor.execute("SELECT path FROM original_files WHERE path IN (SELECT value FROM OPENJSON(?))",
+                           json.dumps(batch))
+            tracked = {row[0] for row in cursor.fetchall()}
+            released |= {path for path in batch if path not in tracked}
         conn.commit()
 
+    for path in processed:
+        remove_file(path, 'evicted processed')
+    for path in released:
+        remove_original(path)
+    for path in assets:
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Deleted evicted assets: {path}")
+    logger.info(f"Quota eviction removed {len(processed) + len(released)} files and {len(assets)} asset "
+                f"folders ({usage / 1024 / 1024:.0f}MB of {quota / 1024 / 1024:.0f}MB in use)")
+    return len(processed) + len(released) + len(assets)
+
 
 if __name__ == '__main__':
-    logger.info("Starting cleanup WebJob")
-    while True:
-        try:
-            cleanup_files()
-        except Exception as e:
-            logger.error(f"Cleanup cycle failed: {str(e)}")
-        time.sleep(300)  # Run every 5 minutes
\ No newline at end of file
+    from scheduler import ExpiryScheduler
+
+    logger.info("Starting standalone cleanup")
+    # Deletes as rows expire and evicts over DISK_QUOTA_MB, instead of polling every 5 minutes
+    ExpiryScheduler().run()
@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+import pyodbc
+from metrics import registry
+
+logger = logging.getLogger('Database')
+
+# Get environment variables
+SQL_SERVER = os.environ['SQL_SERVER']
+SQL_DATABASE = os.environ['SQL_DATABASE']
+SQL_USERNAME = os.environ['SQL_USERNAME']
+SQL_PASSWORD = os.environ['SQL_PASSWORD']
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds to wait for a free connection
+POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds before a connection is replaced
+POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))  # idle seconds before a health check
+
+DB_WAIT_SECONDS = registry.histogram('db_pool_wait_seconds', 'Time waiting for a pooled connection')
+# Covers every statement run while the connection is borrowed, plus the final commit
+DB_HOLD_SECONDS = registry.histogram('db_connection_hold_seconds', 'Time a connection stays borrowed',
+                                     ('outcome',))
+
+# SQLSTATEs meaning the connection itself is unusable
+DISCONNECT_STATES = ('08S01', '08001', '08003', '08007', 'HYT00', 'HYT01')
+
+
+def connect():
+    conn_str = f"Driver={{ODBC Driver 18 for SQL Server}};Server={SQL_SERVER};Database={SQL_DATABASE};Uid={SQL_USERNAME};Pwd={SQL_PASSWORD};Encrypt=yes;TrustServerCertificate=no;"
+    return pyodbc.connect(conn_str)
+
+
+class ConnectionPool:
+    """Thread-safe pool of open connections with health checks, a size cap and recycling"""
+
+    def __init__(self, connect, max_size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE,
+                 ping_after=POOL_PING_AFTER):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._condition = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # Connections must not be shared with a forked child, so each process starts empty
+        self._pid = os.getpid()
+        self._idle = deque()  # (conn, created, last_used)
+        self._size = 0
+        self._stats = {'created': 0, 'reused': 0, 'recycled': 0, 'discarded': 0, 'waits': 0,
+                       'timeouts': 0, 'wait_seconds': 0.0}
+
+    def _take(self, started):
+        """Under the lock: pop an idle connection young enough to reuse, or reserve a slot for a
+        new one (returns None), waiting up to the timeout for either"""
+        if self._pid != os.getpid():
+            self._reset()
+        while True:
+            while self._idle:
+                conn, created, last_used = self._idle.pop()
+                if time.monotonic() - created <= self.recycle:
+                    return conn, created, last_used
+                self._stats['recycled'] += 1
+                self._close(conn)
+            if self._size < self.max_size:
+                self._size += 1
+                return None
+            self._stats['waits'] += 1
+            remaining = self.timeout - (time.monotonic() - started)
+            if remaining <= 0 or not self._condition.wait(remaining):
+                self._stats['timeouts'] += 1
+                raise TimeoutError(f"No database connection free after {self.timeout}s")
+
+    def _ping(self, conn):
+        try:
+            conn.cursor().execute("SELECT 1").fetchone()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self):
+        """Return (conn, created) from the pool, opening a new connection if there is room"""
+        started = time.monotonic()
+        try:
+            while True:
+                with self._condition:
+                    taken = self._take(started)
+                if taken is None:
+                    break
+                conn, created, last_used = taken
+                # Pinged outside the lock, so a slow or half-dead connection holds up only this thread
+                healthy = time.monotonic() - last_used <= self.ping_after or self._ping(conn)
+                with self._condition:
+                    if healthy:
+                        self._stats['reused'] += 1
+                        return conn, created
+                    self._stats['discarded'] += 1
+                    self._close(conn)
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._stats['wait_seconds'] += time.monotonic() - started
+            DB_WAIT_SECONDS.observe(time.monotonic() - started)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats['created'] += 1
+        return conn, time.monotonic()
+
+    def release(self, conn, created, broken=False):
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            if broken:
+                self._stats['discarded'] += 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, created, time.monotonic()))
+            self._condition.notify()
+
+    def _close(self, conn):
+        self._size -= 1
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error, like pyodbc's own context"""
+        conn, created = self.acquire()
+        broken = False
+        started, outcome = time.monotonic(), 'error'
+        try:
+            yield conn
+            conn.commit()
+            outcome = 'ok'
+        except Exception as e:
+            broken = isinstance(e, pyodbc.Error) and e.args and e.args[0] in DISCONNECT_STATES
+            if not broken:
+                try:
+                    conn.rollback()
+                except pyodbc.Error:
+                    broken = True
+            raise
+        finally:
+            DB_HOLD_SECONDS.observe(time.monotonic() - started, outcome=outcome)
+            self.release(conn, created, broken)
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, size=self._size, idle=len(self._idle), max_size=self.max_size)
+
+
+pool = ConnectionPool(connect)
+
+
+def get_db_connection():
+    """Context manager yielding a pooled connection"""
+    return pool.connection()
+
+
+def pool_stats():
+    return pool.stats()
+
+
+def get_applock(cursor, resource, timeout_ms=0):
+    """Take an exclusive application lock held until the transaction ends; False if it timed out"""
+    # A manual-commit connection only opens its transaction at the first data statement, and
+    # NOCOUNT goes back on before returning so the pooled session keeps its row counts
+    cursor.execute("""
+        SET NOCOUNT ON;
+        IF @@TRANCOUNT = 0 BEGIN TRANSACTION;
+        DECLARE @result INT;
+        EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockTimeout = ?;
+        SET NOCOUNT OFF;
+        SELECT @result
+    """, (resource, timeout_ms))
+    return cursor.fetchone()[0] >= 0
@@ -1,10 +1,12 @@
 # from humanfriendly.terminal import output
-from moviepy import CompositeVideoClip, vfx, afx
+from moviepy import CompositeVideoClip
+import numpy as np
 #     CompositeAudioClip, clips_array
 # import os
 # from TranscribeVideo import transcribe_and_highlight
 # import re
 import cv2
+from FfmpegTools import run_ffmpeg, probe
 
 
 # from moviepy.video.fx import Crop
@@ -35,54 +37,64 @@ import cv2
 
 # sub.get_fra
 
-# clips = [{'clip':'clip1','start':'00','end':'10','order':0}]
-def create_short(input_clip,output_clip=None):
-    final_size = (1080, 1920)
-    #remove black outline
-    def remove_black_outline(clip):
-        clip.save_frame("temp_frame1.png", t = clip.duration/2)
+# Background bands are blurred at 1/BAND_DOWNSCALE resolution with a single box blur whose
+# kernel matches the spread of the original two 15x15 full-resolution passes
+BAND_DOWNSCALE = 4
+BAND_BLUR = max(3, int(round(15 * 2 ** 0.5 / BAND_DOWNSCALE)) | 1)
+
+
+def make_band_renderer(y1, y2, out_size):
+    """Frame function cropping rows y1:y2, blurring them small and scaling to out_size.
 
+    Intermediate and output buffers are allocated once and reused for every frame; the compositor
+    copies the returned frame onto its canvas before the next one is requested.
+    """
+    buffers = {}
 
-    #resize
-    def resize_ends(clip,center_clip_size):
-        y_size = ((final_size[1] - center_clip_size - (center_clip_size * 0.1)) / 2)
-        resized = clip.with_effects([vfx.Resize((clip.size[0],y_size))])
-        return resized
+    def render(frame):
+        strip = frame[y1:y2]
+        if 'small' not in buffers or buffers['small'].shape[2] != strip.shape[2]:
+            small_w = max(1, strip.shape[1] // BAND_DOWNSCALE)
+            small_h = max(1, strip.shape[0] // BAND_DOWNSCALE)
+            buffers['small'] = np.empty((small_h, small_w, strip.shape[2]), dtype=np.uint8)
+            buffers['blurred'] = np.empty_like(buffers['small'])
+            buffers['out'] = np.empty((out_size[1], out_size[0], strip.shape[2]), dtype=np.uint8)
+        small, blurred, out = buffers['small'], buffers['blurred'], buffers['out']
+        cv2.resize(strip, (small.shape[1], small.shape[0]), dst=small, interpolation=cv2.INTER_AREA)
+        cv2.blur(small, (BAND_BLUR, BAND_BLUR), dst=blurred)
+        cv2.resize(blurred, out_size, dst=out, interpolation=cv2.INTER_LINEAR)
+        return out
 
-    #blur,crop, create split screen clip
-    def blur(img):
-        return cv2.blur(img,(15,15))
+    return render
 
-    def blur_clip(clip):
-        blurred = clip.image_transform( blur )
-        return blurred
 
-    def split_screen(clip):
-        clip1 = blur_clip( clip )
-        w,h = clip1.size
-        cropped1 = clip1.cropped(x_center=w * 0.5,y_center=h * 0.125,width=w,height=h * 0.25)
-        cropped2 = clip1.cropped(x_center=w * 0.5,y_center=h * 0.875,width=w,height=h * 0.25)
-        return [cropped1,cropped2]
+# clips = [{'clip':'clip1','start':'00','end':'10','order':0}]
+def create_short(input_clip,output_clip=None,final_size=(1080, 1920)):
+    #remove black outline
+    def remove_black_outline(clip):
+        clip.save_frame("temp_frame1.png", t = clip.duration/2)
 
 
+    #blurred background bands: crop the strip, then blur a downscaled copy once
+    def band_clip(clip, y1, y2, band_h):
+        band = make_band_renderer(y1, y2, (clip.size[0], band_h))
+        return clip.image_transform(band).without_audio()
 
     #combine clips
     def combine_clips(clip):
         center_clip = clip.subclipped(0,clip.duration)
-        blurred = blur_clip(clip)
-        cropped = split_screen(blurred)
-        top = cropped[0]
-        bottom = cropped[1]
-        y_size = top.size[1] + bottom.size[1] + center_clip.size[1]
+        w,h = clip.size
+        layout = short_layout(clip.size, final_size)
 
         center_clip = center_clip.with_position("center","center").with_duration(clip.duration)
-        # center_pos = center_clip.pos(center_clip.duration * 0.5)
-        top = resize_ends(top,center_clip.size[1])
-        bottom = resize_ends(bottom,center_clip.size[1])
-        top = top.with_position("top").with_duration(clip.duration).with_effects([afx.MultiplyVolume(0)])
-        bottom = bottom.with_position("bottom").with_duration(clip.duration).with_effects([afx.MultiplyVolume(0)])
+        clips = [center_clip]
+        if layout['band_h'] > 0:
+            top = band_clip(clip, 0, layout['crop_h'], layout['band_h'])
+            bottom = band_clip(clip, int(h * 0.75), h, layout['band_h'])
+            top = top.with_position("top").with_duration(clip.duration)
+            bottom = bottom.with_position("bottom").with_duration(clip.duration)
+            clips += [top,bottom]
 
-        clips = [center_clip,top,bottom]
         final_clip = CompositeVideoClip(clips=clips,size=final_size)
 
 
@@ -100,4 +112,73 @@ def create_short(input_clip,output_clip=None):
 
 
 
+def short_layout(size, final_size=(1080, 1920)):
+    """Geometry create_short uses for a source of the given size, as ints in output pixels"""
+    w, h = size
+    band_h = int((final_size[1] - h - (h * 0.1)) / 2)
+    return {
+        'x': int((final_size[0] - w) / 2),
+        'center_y': int((final_size[1] - h) / 2),
+        'crop_h': int(h * 0.25),
+        'band_h': band_h,
+        'bottom_y': final_size[1] - band_h
+    }
+
+
+def _escape_filter_path(path):
+    # Quoted filter arguments keep ':' literal; only quotes themselves need breaking out
+    return path.replace('\\', '/').replace("'", "'\\''")
+
+
+def short_filtergraph(size, fps, final_size=(1080, 1920), subtitles=None, pix_fmt='yuv420p', crop=None,
+                      source='[0:v]', label=''):
+    """ffmpeg filter_complex producing the same layout as create_short, ending in [v].
+
+    `source` is the input pad and `label` prefixes every pad, so several layouts fit in one graph.
+    """
+    graph = [f"color=c=black:s={final_size[0]}x{final_size[1]}:r={fps}[{label}bg]"]
+    if crop is not None:
+        # Black bars come off first, so the layout is computed for the picture alone
+        graph.append(f"{source}crop={crop[2]}:{crop[3]}:{crop[0]}:{crop[1]}[{label}cropped]")
+        source, size = f'[{label}cropped]', crop[2:]
+    w, h = size
+    layout = short_layout(size, final_size)
+    x, crop_h, band_h = layout['x'], layout['crop_h'], layout['band_h']
+    band = (f"scale=iw/{BAND_DOWNSCALE}:ih/{BAND_DOWNSCALE}:flags=area,"
+            f"boxblur=luma_radius={BAND_BLUR // 2}:luma_power=1,"
+            f"scale={w}:{band_h}:flags=bilinear")
+    if band_h > 0:
+        graph += [
+            f"{source}split=2[{label}center][{label}bands]",
+            f"[{label}bg][{label}center]overlay=x={x}:y={layout['center_y']}:shortest=1[{label}canvas]",
+            # Same steps as make_band_renderer: crop, area downscale, one RGB box blur, bilinear upscale
+            f"[{label}bands]format=gbrp,split=2[{label}strip_top][{label}strip_bottom]",
+            f"[{label}strip_top]crop={w}:{crop_h}:0:0,{band}[{label}top]",
+            f"[{label}strip_bottom]crop={w}:{h - int(h * 0.75)}:0:{int(h * 0.75)},{band}[{label}bottom]",
+            f"[{label}canvas][{label}top]overlay=x={x}:y=0[{label}with_top]",
+            f"[{label}with_top][{label}bottom]overlay=x={x}:y={layout['bottom_y']}[{label}layout]",
+        ]
+    else:
+        graph.append(f"[{label}bg]{source}overlay=x={x}:y={layout['center_y']}:shortest=1[{label}layout]")
+    if subtitles:
+        graph.append(f"[{label}layout]subtitles='{_escape_filter_path(subtitles)}':fontsdir=Fonts,"
+                     f"format={pix_fmt}[{label}v]")
+    else:
+        graph.append(f"[{label}layout]format={pix_fmt}[{label}v]")
+    return ';'.join(graph)
+
+
+def create_short_ffmpeg(input_path, output_path, subtitles=None, encode_args=None, final_size=(1080, 1920),
+                        pix_fmt='yuv420p', crop=None):
+    """Render the vertical short layout natively in one ffmpeg pass; captions come from an ASS track"""
+    infos = probe(input_path)
+    graph = short_filtergraph(infos['video_size'], infos['video_fps'], final_size, subtitles, pix_fmt, crop)
+    audio_map = ['-map', '0:a:0?']
+    if encode_args is None:
+        encode_args = ['-c:v', 'libx264', '-preset', 'medium', '-c:a', 'aac']
+    run_ffmpeg(['-i', input_path, '-filter_complex', graph, '-map', '[v]', *audio_map,
+                *encode_args, '-movflags', '+faststart', output_path])
+    return output_path
+
+
 # create_short(final_path,sub)
\ No newline at end of file
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from uploads import hash_prefix
+
+logger = logging.getLogger('Ingest')
+
+INGEST_CONNECTIONS = int(os.getenv('INGEST_CONNECTIONS', 4))  # parallel Range requests per file
+INGEST_PART_SIZE = int(os.getenv('INGEST_PART_SIZE', 16 * 1024 * 1024))  # smallest part worth a request
+INGEST_BUFFER = int(os.getenv('INGEST_BUFFER', 1024 * 1024))  # bytes read per socket read
+INGEST_RETRIES = int(os.getenv('INGEST_RETRIES', 3))  # attempts per part before the job fails
+INGEST_TIMEOUT = float(os.getenv('INGEST_TIMEOUT', 30))  # seconds without data before a retry
+
+# One keep-alive pool per process so repeated fetches from a host skip the TCP/TLS handshake
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=INGEST_CONNECTIONS * 2))
+session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=INGEST_CONNECTIONS * 2))
+
+
+class TooLarge(ValueError):
+    pass
+
+
+def probe_url(url):
+    """HEAD the URL and return (length or None, supports ranges, validator, content type)"""
+    response = session.head(url, allow_redirects=True, timeout=INGEST_TIMEOUT)
+    response.raise_for_status()
+    length = response.headers.get('Content-Length')
+    ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+    return (int(length) if length else None), ranges, validator, response.headers.get('Content-Type', '')
+
+
+def plan_parts(length, connections=None, part_size=None):
+    """Split [0, length) into at most `connections` contiguous [start, end) parts"""
+    connections = connections or INGEST_CONNECTIONS
+    part_size = part_size or INGEST_PART_SIZE
+    count = max(1, min(connections, length // part_size))
+    step = -(-length // count)
+    return [[start, min(start + step, length)] for start in range(0, length, step)]
+
+
+class PartState:
+    """Per-part progress persisted next to the download so a retry resumes where it stopped"""
+
+    def __init__(self, path, url, length, validator):
+        self.path = f"{path}.parts"
+        self.lock = threading.Lock()
+        state = self._load()
+        if state and state['url'] == url and state['length'] == length and state['validator'] == validator:
+            self.parts = state['parts']
+        else:
+            self.parts = [[start, start, end] for start, end in plan_parts(length)]  # start, next, end
+        self.state = {'url': url, 'length': length, 'validator': validator}
+        self.resumed = sum(next_byte - start for start, next_byte, _ in self.parts)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def advance(self, index, next_byte):
+        with self.lock:
+            self.parts[index][1] = next_byte
+
+    def save(self):
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(dict(self.state, parts=self.parts), f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def preallocate(path, length):
+    """Size the file up front so parts can be written at their offsets in any order"""
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        if os.fstat(fd).st_size != length:
+            os.ftruncate(fd, length)
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, length)
+    finally:
+        os.close(fd)
+
+
+def _write_at(fd, offset, data):
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _fetch_part(url, fd, state, index, validator, counter):
+    """Download one part from its recorded offset, retrying and resuming on errors"""
+    for attempt in range(1, INGEST_RETRIES + 1):
+        start, next_byte, end = state.parts[index]
+        if next_byte >= end:
+            return
+        headers = {'Range': f"bytes={next_byte}-{end - 1}"}
+        if validator:
+            # If the file changed upstream the server answers 200 and we must not splice parts
+            headers['If-Range'] = validator
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=INGEST_TIMEOUT) as response:
+                if response.status_code != 206:
+                    raise ValueError(f"Server ignored the Range request (HTTP {response.status_code})")
+                for chunk in response.iter_content(chunk_size=INGEST_BUFFER):
+                    if len(chunk) > end - next_byte:
+                        chunk = chunk[:end - next_byte]
+                    _write_at(fd, next_byte, chunk)
+                    next_byte += len(chunk)
+                    state.advance(index, next_byte)
+                    counter(len(chunk))
+                    if next_byte >= end:
+                        break
+            if next_byte >= end:
+                return
+            raise requests.exceptions.ChunkedEncodingError(f"Part {index} ended early at byte {next_byte}")
+        except requests.exceptions.RequestException as e:
+            state.save()
+            if attempt == INGEST_RETRIES:
+                raise
+            logger.warning(f"Part {index} of {url} failed ({str(e)}), retry {attempt}")
+            time.sleep(attempt)
+
+
+def _download_ranges(url, path, length, validator, progress):
+    state = PartState(path, url, length, validator)
+    preallocate(path, length)
+    received = [state.resumed]
+    lock = threading.Lock()
+    last_save = [time.monotonic()]
+
+    def counter(size):
+        # Under the lock so the progress callback (and its DB connection) sees one thread at a time
+        with lock:
+            received[0] += size
+            now = time.monotonic()
+            if now - last_save[0] > 1:
+                last_save[0] = now
+                state.save()
+            if progress is not None:
+                progress(received[0] / length)
+
+    if state.resumed:
+        logger.info(f"Resuming {url} at {state.resumed} of {length} bytes")
+    fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        with ThreadPoolExecutor(max_workers=len(state.parts)) as executor:
+            futures = [executor.submit(_fetch_part, url, fd, state, i, validator, counter)
+                       for i in range(len(state.parts))]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+        state.save()
+    state.remove()
+    # Parts arrive out of order, so hash the finished file in one sequential pass
+    return length, hash_prefix(path, length)
+
+
+def _download_stream(url, path, max_size, progress, length=None):
+    """Single sequential GET for servers without Range support or a known length"""
+    hasher = hashlib.sha256()
+    received = 0
+    with session.get(url, stream=True, timeout=INGEST_TIMEOUT) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=INGEST_BUFFER):
+                received += len(chunk)
+                if received > max_size:
+                    raise TooLarge(f"Download exceeds the {max_size} byte limit")
+                f.write(chunk)
+                hasher.update(chunk)
+                if progress is not None and length:
+                    progress(received / length)
+    return received, hasher
+
+
+def ingest_url(url, path, max_size, progress=None):
+    """Download `url` to `path`, enforcing max_size; returns (size, sha256 hasher).
+
+    Large files with Range support are fetched as parallel parts written at their offsets;
+    a `.parts` sidecar records each part's position. Failed parts are retried from there, and
+    a job requeued after its worker died resumes from it. A download that fails removes the
+    file and the sidecar, since the job is not retried and nothing else would.
+    """
+    length, ranges, validator, content_type = probe_url(url)
+    if 'video/' not in content_type:
+        raise ValueError("URL does not point to a video file")
+    if length is not None and length > max_size:
+        raise TooLarge(f"Video is {length} bytes, over the {max_size} byte limit")
+
+    try:
+        if length and ranges:
+            return _download_ranges(url, path, length, validator, progress)
+        return _download_stream(url, path, max_size, progress, length)
+    except Exception:
+        for leftover in (path, f"{path}.parts", f"{path}.parts.tmp"):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+        raise
@@ -0,0 +1,155 @@
+import json
+import uuid
+from datetime import datetime, UTC
+
+# Job states stored in the jobs table
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# Claim order: higher priority first, FIFO within a priority
+PRIORITY_RENDER = 0
+PRIORITY_ASSETS = 5  # ingests and proxies, which previews wait on
+PRIORITY_PREVIEW = 10
+
+
+def enqueue_job(conn, payload, cache_key=None, priority=PRIORITY_RENDER, batch_id=None, commit=True):
+    """Insert a queued job and return its id; commit=False leaves the caller to commit, so several
+    jobs become visible to workers together"""
+    job_id = uuid.uuid4()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO jobs (id, status, payload, cache_key, priority, batch_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (job_id, QUEUED, json.dumps(payload), cache_key, priority, batch_id))
+    if commit:
+        conn.commit()
+    return job_id
+
+
+def claim_job(conn, worker):
+    """Atomically move the next queued job to running and return (id, payload)"""
+    cursor = conn.cursor()
+    # READPAST lets concurrent workers skip rows another worker is claiming
+    cursor.execute("""
+        WITH next_job AS (
+            SELECT TOP (1) * FROM jobs WITH (UPDLOCK, READPAST, ROWLOCK)
+            WHERE status = ?
+            ORDER BY priority DESC, created_at
+        )
+        UPDATE next_job
+        SET status = ?, worker = ?, attempts = attempts + 1,
+            started_at = SYSUTCDATETIME(), updated_at = SYSUTCDATETIME()
+        OUTPUT inserted.id, inserted.payload
+    """, (QUEUED, RUNNING, worker))
+    row = cursor.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    return row[0], json.loads(row[1])
+
+
+def claim_batch(conn, batch_id, worker):
+    """Move the still queued jobs of a batch to running for the worker that claimed one of them;
+    returns [(id, payload)] in submission order"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs WITH (UPDLOCK, READPAST, ROWLOCK)
+        SET status = ?, worker = ?, attempts = attempts + 1,
+            started_at = SYSUTCDATETIME(), updated_at = SYSUTCDATETIME()
+        OUTPUT inserted.id, inserted.payload, inserted.created_at
+        WHERE batch_id = ? AND status = ?
+    """, (RUNNING, worker, batch_id, QUEUED))
+    rows = sorted(cursor.fetchall(), key=lambda row: row[2])
+    conn.commit()
+    return [(row[0], json.loads(row[1])) for row in rows]
+
+
+def update_progress(conn, job_id, stage, progress):
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs SET stage = ?, progress = ?, updated_at = SYSUTCDATETIME()
+        WHERE id = ?
+    """, (stage, progress, job_id))
+    conn.commit()
+
+
+def finish_job(conn, job_id, result):
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs
+        SET status = ?, progress = 1, result = ?, updated_at = SYSUTCDATETIME(), finished_at = SYSUTCDATETIME()
+        WHERE id = ?
+    """, (DONE, json.dumps(result), job_id))
+    conn.commit()
+
+
+def fail_job(conn, job_id, error, only_running=False):
+    """Mark a job failed; only_running leaves jobs that already recorded an outcome alone"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE jobs
+        SET status = ?, error = ?, updated_at = SYSUTCDATETIME(), finished_at = SYSUTCDATETIME()
+        WHERE id = ? {'AND status = ?' if only_running else ''}
+    """, (FAILED, error, job_id, *([RUNNING] if only_running else [])))
+    conn.commit()
+    return cursor.rowcount
+
+
+def requeue_running(conn, worker, max_attempts):
+    """Put jobs left running by a dead worker back on the queue, failing those out of attempts"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs
+        SET status = ?, error = ?, updated_at = SYSUTCDATETIME(), finished_at = SYSUTCDATETIME()
+        WHERE status = ? AND worker = ? AND attempts >= ?
+    """, (FAILED, f"Worker died {max_attempts} time(s) running this job", RUNNING, worker, max_attempts))
+    cursor.execute("""
+        UPDATE jobs SET status = ?, worker = NULL, stage = NULL, progress = 0, updated_at = SYSUTCDATETIME()
+        WHERE status = ? AND worker = ?
+    """, (QUEUED, RUNNING, worker))
+    conn.commit()
+    return cursor.rowcount
+
+
+def save_timings(conn, job_id, timings):
+    """Store the job's per-stage timing record (see metrics.JobTrace)"""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE jobs SET timings = ? WHERE id = ?", (json.dumps(timings), job_id))
+    conn.commit()
+
+
+def get_job(conn, job_id):
+    """Return the job as a dict, or None if it doesn't exist"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, status, stage, progress, result, error, created_at, started_at, updated_at, finished_at,
+               timings
+        FROM jobs WHERE id = ?
+    """, job_id)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'task_id': str(row[0]),
+        'status': row[1],
+        'stage': row[2],
+        'progress': row[3],
+        'result': json.loads(row[4]) if row[4] else None,
+        'error': row[5],
+        'created_at': _isoformat(row[6]),
+        'started_at': _isoformat(row[7]),
+        'updated_at': _isoformat(row[8]),
+        'finished_at': _isoformat(row[9]),
+        'timings': json.loads(row[10]) if row[10] else None,
+    }
+
+
+def _isoformat(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.isoformat()
@@ -1,19 +1,147 @@
 import os
+import shutil
+import tempfile
+from proglog import ProgressBarLogger
 from TranscribeVideo import transcribe_and_highlight
-from getClips import  create_short
-from SplitVideo import split_clip
+from getClips import  create_short, create_short_ffmpeg
+from Captions import write_ass
+from ParallelRender import render_parallel, chunk_count
+from StreamRender import render_stream
+from SplitVideo import split_clip, cut_segments, can_stream_cut, validate_segments
+from FfmpegTools import probe, run_ffmpeg
+from TranscriptCache import get_words, remap_words
+from Proxy import proxy_path, has_proxy
+from EditVideo import remove_black_bars, scale_crop
+from EncodeProfiles import get_profile, ffmpeg_args, moviepy_args, PREVIEW_PROFILE
+from metrics import JobTrace
 from moviepy import VideoFileClip, CompositeVideoClip
 
-download = os.getenv("DOWNLOAD_PATH")
-
-def make_vid(points_to_split,vid,filename):
-    new_vid = VideoFileClip(vid)
-    new_vid = split_clip(new_vid,points_to_split)
-    new_vid = create_short(new_vid)
-    new_vid= transcribe_and_highlight(load_video = new_vid)
-    filename = f"Short-{filename}.mp4"
-    download_path = f"{download}/{filename}"
-    new_vid.write_videofile(download_path)
-    return download_path
+# 'moviepy' composes frames in Python, 'ffmpeg' renders layout and captions in one native filtergraph,
+# 'stream' decodes once into a fixed ring of frames and pipes to one encoder (bounded memory)
+RENDER_BACKEND = os.getenv('RENDER_BACKEND', 'moviepy')
+FINAL_SIZE = (1080, 1920)
+CAPTION_FONT_SIZE = 28  # at FINAL_SIZE; scaled with the output width
+
+
+class RenderProgressLogger(ProgressBarLogger):
+    """Forward MoviePy's frame progress to a job progress callback"""
+
+    def __init__(self, progress, start, end):
+        super().__init__()
+        self.progress = progress
+        self.start = start
+        self.end = end
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != 'frame_index' or attr != 'index':
+            return
+        total = self.bars[bar]['total']
+        if total:
+            self.progress('encode', self.start + (self.end - self.start) * (value + 1) / total)
+
+
+def caption_font_size(final_size):
+    return max(8, round(CAPTION_FONT_SIZE * final_size[0] / FINAL_SIZE[0]))
+
+
+def compose_short(source, points_to_split=None, words=(), final_size=FINAL_SIZE, crop=None):
+    """Build the captioned short as a MoviePy clip; points_to_split=None means source is already cut"""
+    new_vid = remove_black_bars(VideoFileClip(source), crop)
+    if points_to_split is not None:
+        new_vid = split_clip(new_vid,points_to_split)
+    new_vid = create_short(new_vid, final_size=final_size)
+    return transcribe_and_highlight(load_video = new_vid, words=words, font_size=caption_font_size(final_size))
+
+
+def make_vid(points_to_split,vid,output_path,progress=None,model_size=None,backend=None,chunks=None,preview=False,
+             crop=None,profile=None,trace=None):
+    def report(stage, fraction):
+        if progress is not None:
+            progress(stage, fraction)
+
+    # Every stage is timed into the trace; callers pass one in to collect the record
+    trace = trace or JobTrace()
+    # Output size, frame rate and x264 settings come from the named encode profile
+    profile = get_profile(profile or (PREVIEW_PROFILE if preview else None))
+    final_size = profile['size']
+    with trace.stage('probe'):
+        # Previews read frames from the proxy when it exists; the transcript always comes from vid
+        source = proxy_path(vid) if preview and has_proxy(vid) else vid
+        infos = probe(source)
+        validate_segments(points_to_split, infos.get('duration'))
+        if source != vid:
+            # The stored crop is in original pixels; the proxy is smaller
+            crop = scale_crop(crop, probe(vid)['video_size'], infos['video_size'])
+    fps = profile['fps'] or infos['video_fps']
+    frames = int(sum(float(p['end']) - float(p['start']) for p in points_to_split) * fps)
+
+    report('transcribe', 0.0)
+    with trace.stage('transcribe'):
+        words = remap_words(get_words(vid, model_size), points_to_split)
+    report('split', 0.2)
+    work_dir = tempfile.mkdtemp(prefix='make_vid_', dir=os.path.dirname(output_path) or None)
+    try:
+        backend = backend or RENDER_BACKEND
+        if backend == 'stream':
+            report('encode', 0.3)
+            with trace.stage('encode', frames):
+                render_stream(source, points_to_split, output_path, words=words, final_size=final_size, crop=crop,
+                              fps=profile['fps'], encode_args=ffmpeg_args(profile, fps),
+                              font_size=caption_font_size(final_size),
+                              progress=lambda fraction: report('encode', 0.3 + 0.7 * fraction))
+            return output_path
+
+        # The cut's audio is AAC at the profile's bitrate, so it can go into the short untouched
+        audio_source = None
+        if can_stream_cut(infos):
+            with trace.stage('cut'):
+                cut_path = cut_segments(source, points_to_split, os.path.join(work_dir, 'cut.mp4'), work_dir,
+                                        infos=infos, audio_bitrate=profile['audio_bitrate'])
+            if infos.get('audio_found'):
+                audio_source = cut_path
+
+        if backend == 'ffmpeg' and can_stream_cut(infos):
+            report('encode', 0.3)
+            with trace.stage('encode', frames):
+                captions = write_ass(words, os.path.join(work_dir, 'captions.ass'), final_size,
+                                     font_size=caption_font_size(final_size))
+                create_short_ffmpeg(cut_path, output_path, subtitles=captions, final_size=final_size, crop=crop,
+                                    encode_args=[*ffmpeg_args(profile, fps, passthrough=audio_source is not None),
+                                                 *(['-r', str(profile['fps'])] if profile['fps'] else [])])
+            return output_path
+
+        # Only the layout stage reads frames, so cut with stream copy when the codecs allow it
+        if can_stream_cut(infos):
+            description = {'source': cut_path, 'points_to_split': None, 'words': words,
+                           'final_size': final_size, 'crop': crop}
+        else:
+            description = {'source': source, 'points_to_split': points_to_split, 'words': words,
+                           'final_size': final_size, 'crop': crop}
+        report('layout', 0.25)
+        with trace.stage('layout'):
+            new_vid = compose_short(**description)
+        report('encode', 0.3)
+        chunks = 1 if preview else chunk_count(new_vid.duration, chunks)
+        logger = RenderProgressLogger(progress, 0.3, 1.0) if progress is not None else 'bar'
+        # MoviePy composites frames lazily, so this stage includes layout and captions per frame
+        with trace.stage('encode', frames) as stage:
+            stage['chunks'] = chunks
+            if chunks > 1:
+                render_parallel(compose_short, description, new_vid, output_path, work_dir, chunks,
+                                progress=lambda fraction: report('encode', 0.3 + 0.7 * fraction),
+                                write_args=moviepy_args(profile, fps, gop=False), audio_source=audio_source,
+                                fps=fps)
+            elif audio_source is not None:
+                write_args = {k: v for k, v in moviepy_args(profile, fps).items() if not k.startswith('audio')}
+                video_path = os.path.join(work_dir, 'video.mp4')
+                new_vid.write_videofile(video_path, fps=fps, audio=False, logger=logger, **write_args)
+                run_ffmpeg(['-i', video_path, '-i', audio_source, '-map', '0:v:0', '-map', '1:a:0',
+                            '-c', 'copy', '-shortest', '-movflags', '+faststart', output_path])
+            else:
+                # moov atom up front so playback starts before the whole file arrives
+                new_vid.write_videofile(output_path, fps=fps, logger=logger, **moviepy_args(profile, fps))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return output_path
 
 # make_vid(clips,video_file)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+from flask import request, current_app, abort
+from werkzeug.http import http_date, parse_date
+from werkzeug.security import safe_join
+
+# '' serves from Python, 'x-accel' hands the transfer to nginx, 'x-sendfile' to Apache/lighttpd
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '').lower()
+# nginx `internal` location whose uploads/, downloads/ and proxies/ alias the storage folders
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected').rstrip('/')
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 3600))  # seconds browsers may reuse a file
+MEDIA_BLOCK_SIZE = 1024 * 1024
+
+
+def _etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _not_modified(etag, mtime):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag.strip('"'))
+    since = request.if_modified_since
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _range_applies(etag, last_modified):
+    """If-Range: only honour Range when the client's copy is still current"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    date = parse_date(if_range)
+    return date is not None and http_date(date) == last_modified
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(MEDIA_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def send_media(directory, filename, mimetype='video/mp4', as_attachment=False, download_name=None,
+               accel_dir=None):
+    """Serve a file with Range/206, ETag and Last-Modified, streamed zero-copy where the server allows.
+
+    Under gunicorn the body is the open file positioned at the range start, wrapped in
+    wsgi.file_wrapper with an exact Content-Length, so the worker uses sendfile(2) for
+    full and partial responses alike. With MEDIA_OFFLOAD set, only headers are sent and
+    the front proxy streams the file; for x-accel, `accel_dir` is the directory's path under
+    MEDIA_ACCEL_PREFIX (files without one are streamed from Python).
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404, description="File not found")
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = _etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'private, max-age={MEDIA_MAX_AGE}',
+    }
+    if as_attachment:
+        headers['Content-Disposition'] = f'attachment; filename="{download_name or os.path.basename(path)}"'
+
+    if _not_modified(etag, stat.st_mtime):
+        return current_app.response_class(status=304, headers=headers)
+
+    if MEDIA_OFFLOAD == 'x-accel' and accel_dir is not None:
+        # nginx answers Range and conditional requests itself from the internal location
+        headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}/{accel_dir.strip('/')}/{filename}"
+        return current_app.response_class(headers=headers, mimetype=mimetype)
+    if MEDIA_OFFLOAD == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return current_app.response_class(headers=headers, mimetype=mimetype)
+
+    status, start, length = 200, 0, size
+    byte_range = request.range if _range_applies(etag, last_modified) else None
+    # Multipart ranges are rare for media players; answering them with the whole file is allowed
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return current_app.response_class(status=416, headers=headers)
+        start, stop = bounds
+        status, length = 206, stop - start
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    headers['Content-Length'] = str(length)
+
+    if request.method == 'HEAD':
+        body = ()
+    elif 'wsgi.file_wrapper' in request.environ:
+        f = open(path, 'rb')
+        f.seek(start)
+        # The server sends Content-Length bytes from the current offset (sendfile under gunicorn)
+        body = request.environ['wsgi.file_wrapper'](f, MEDIA_BLOCK_SIZE)
+    else:
+        body = _read_range(path, start, length)
+
+    return current_app.response_class(body, status=status, headers=headers, mimetype=mimetype,
+                                      direct_passthrough=True)
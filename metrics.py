@@ -0,0 +1,252 @@
+import os
+import time
+import json
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('Metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds; spans fast DB calls up to hour-long renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; values are kept per label tuple"""
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, (('le', _format_value(bound)),), count))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Metrics of this process; each gunicorn worker and the render pool supervisor keep their own
+registry = Registry()
+
+
+def peak_rss_mb():
+    """High-water RSS of this process and of its waited-for children (ffmpeg), in MB"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def cpu_seconds():
+    """CPU time of this process plus its finished children"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class JobTrace:
+    """Per-stage wall time, CPU time, peak RSS and frame counts of one job"""
+
+    def __init__(self, job_id=None, kind='render'):
+        self.job_id = str(job_id) if job_id is not None else None
+        self.kind = kind
+        self.pid = os.getpid()
+        self.stages = []
+        self._started = time.perf_counter()
+        self._cpu = cpu_seconds()
+
+    @contextmanager
+    def stage(self, name, frames=None):
+        """Measure a block; the yielded dict takes 'frames' (or other fields) set while it runs"""
+        record = {'stage': name}
+        if frames is not None:
+            record['frames'] = frames
+        started, cpu = time.perf_counter(), cpu_seconds()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 3)
+            record['cpu_seconds'] = round(cpu_seconds() - cpu, 3)
+            record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            if record.get('frames') and record['seconds'] > 0:
+                record['fps'] = round(record['frames'] / record['seconds'], 2)
+            self.stages.append(record)
+
+    def summary(self, status=None):
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'pid': self.pid,
+            'status': status,
+            'seconds': round(time.perf_counter() - self._started, 3),
+            'cpu_seconds': round(cpu_seconds() - self._cpu, 3),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'stages': self.stages,
+        }
+
+
+JOB_SECONDS = registry.histogram('job_duration_seconds', 'Wall time of jobs', ('kind', 'status'))
+JOB_CPU = registry.counter('job_cpu_seconds_total', 'CPU time of jobs including ffmpeg', ('kind',))
+JOB_PEAK_RSS = registry.gauge('job_peak_rss_bytes', 'Peak RSS of the last job of each kind', ('kind',))
+STAGE_SECONDS = registry.histogram('job_stage_duration_seconds', 'Wall time of job stages', ('kind', 'stage'))
+STAGE_CPU = registry.counter('job_stage_cpu_seconds_total', 'CPU time of job stages', ('kind', 'stage'))
+STAGE_FRAMES = registry.counter('job_stage_frames_total', 'Frames processed by job stages', ('kind', 'stage'))
+STAGE_FPS = registry.gauge('job_stage_fps', 'Frames per second of the last run of each stage', ('kind', 'stage'))
+WHISPER_MODELS = registry.counter('job_whisper_models_total', 'Whisper models used by jobs, warm or loaded',
+                                  ('result',))
+WHISPER_LOAD = registry.counter('job_whisper_load_seconds_total', 'Time jobs spent loading whisper models')
+
+
+def record_job(summary):
+    """Fold a JobTrace summary into this process's metrics and log it as one JSON line"""
+    kind, status = summary['kind'], summary['status']
+    JOB_SECONDS.observe(summary['seconds'], kind=kind, status=status)
+    JOB_CPU.inc(summary['cpu_seconds'], kind=kind)
+    JOB_PEAK_RSS.set(int(summary['peak_rss_mb'] * 1024 * 1024), kind=kind)
+    for stage in summary['stages']:
+        STAGE_SECONDS.observe(stage['seconds'], kind=kind, stage=stage['stage'])
+        STAGE_CPU.inc(stage['cpu_seconds'], kind=kind, stage=stage['stage'])
+        if stage.get('frames'):
+            STAGE_FRAMES.inc(stage['frames'], kind=kind, stage=stage['stage'])
+        if stage.get('fps'):
+            STAGE_FPS.set(stage['fps'], kind=kind, stage=stage['stage'])
+    whisper = summary.get('whisper') or {}
+    if whisper.get('hits'):
+        WHISPER_MODELS.inc(whisper['hits'], result='warm')
+    if whisper.get('misses'):
+        WHISPER_MODELS.inc(whisper['misses'], result='loaded')
+        WHISPER_LOAD.inc(whisper['load_seconds'])
+    logger.info(f"job_timing {json.dumps(summary)}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    """Expose /metrics on a background thread, for processes without a web app"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{server.server_address[1]}")
+    return server
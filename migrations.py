@@ -0,0 +1,201 @@
+import logging
+from db import get_db_connection, get_applock
+
+logger = logging.getLogger('Migrations')
+
+# Indexes for the hot queries: expiry scans, the filename lookup in process_video, the
+# processed -> original anti-join, orphan age checks, dedup lookups and job claiming
+INDEXES = [
+    ('ix_processed_files_expires_at', 'processed_files',
+     "CREATE INDEX ix_processed_files_expires_at ON processed_files (expires_at) INCLUDE (original_id)"),
+    ('ix_processed_files_original_id', 'processed_files',
+     "CREATE INDEX ix_processed_files_original_id ON processed_files (original_id)"),
+    ('ix_original_files_filename', 'original_files',
+     "CREATE INDEX ix_original_files_filename ON original_files (filename)"),
+    ('ix_original_files_created_at', 'original_files',
+     "CREATE INDEX ix_original_files_created_at ON original_files (created_at)"),
+    ('ix_original_files_content_hash', 'original_files',
+     "CREATE INDEX ix_original_files_content_hash ON original_files (content_hash)"),
+    ('ix_blobs_path', 'blobs',
+     "CREATE INDEX ix_blobs_path ON blobs (path)"),
+    ('ix_jobs_status_created_at', 'jobs',
+     "CREATE INDEX ix_jobs_status_created_at ON jobs (status, created_at)"),
+]
+
+
+def create_index_sql(name, table, sql):
+    return f"IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}')) {sql}"
+
+
+# (version, description, statements). Early versions are guarded so databases created by the
+# old init_db pick up the history without errors. Never edit an applied migration; add one.
+MIGRATIONS = [
+    (1, 'original and processed file tables', [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='original_files')
+        CREATE TABLE original_files (
+            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
+            filename NVARCHAR(255) NOT NULL,
+            path NVARCHAR(MAX) NOT NULL,
+            created_at DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='processed_files')
+        CREATE TABLE processed_files (
+            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
+            filename NVARCHAR(255) NOT NULL,
+            title NVARCHAR(255) NOT NULL,
+            path NVARCHAR(MAX) NOT NULL,
+            original_id UNIQUEIDENTIFIER,
+            created_at DATETIME DEFAULT GETDATE(),
+            expires_at DATETIME,
+            FOREIGN KEY (original_id) REFERENCES original_files(id)
+        )
+        """,
+    ]),
+    (2, 'render jobs', [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='jobs')
+        CREATE TABLE jobs (
+            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
+            status NVARCHAR(16) NOT NULL DEFAULT 'queued',
+            stage NVARCHAR(64),
+            progress FLOAT NOT NULL DEFAULT 0,
+            payload NVARCHAR(MAX) NOT NULL,
+            result NVARCHAR(MAX),
+            error NVARCHAR(MAX),
+            worker NVARCHAR(255),
+            created_at DATETIME2 DEFAULT SYSUTCDATETIME(),
+            started_at DATETIME2,
+            updated_at DATETIME2 DEFAULT SYSUTCDATETIME(),
+            finished_at DATETIME2
+        )
+        """,
+    ]),
+    (3, 'upload blobs, resumable sessions and original content hash', [
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='blobs')
+        CREATE TABLE blobs (
+            content_hash CHAR(64) PRIMARY KEY,
+            filename NVARCHAR(255) NOT NULL,
+            path NVARCHAR(450) NOT NULL,
+            size BIGINT NOT NULL,
+            ref_count INT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='upload_sessions')
+        CREATE TABLE upload_sessions (
+            id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
+            filename NVARCHAR(255) NOT NULL,
+            path NVARCHAR(MAX) NOT NULL,
+            length BIGINT NOT NULL,
+            received BIGINT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT GETDATE()
+        )
+        """,
+        """
+        IF COL_LENGTH('original_files', 'content_hash') IS NULL
+        ALTER TABLE original_files ADD content_hash CHAR(64) NULL
+        """,
+    ]),
+    (4, 'indexes for expiry, lookup and orphan scans', [
+        create_index_sql(name, table, sql) for name, table, sql in INDEXES
+    ]),
+    (5, 'black bar crop rectangle of originals', [
+        # NULL until analysed, '' when the video has no bars, otherwise 'x:y:w:h'
+        "ALTER TABLE original_files ADD crop NVARCHAR(32) NULL",
+    ]),
+    (6, 'render cache keys', [
+        "ALTER TABLE processed_files ADD cache_key CHAR(64) NULL",
+        "ALTER TABLE jobs ADD cache_key CHAR(64) NULL",
+        create_index_sql('ix_processed_files_cache_key', 'processed_files',
+                         "CREATE INDEX ix_processed_files_cache_key ON processed_files (cache_key) "
+                         "INCLUDE (expires_at) WHERE cache_key IS NOT NULL"),
+        create_index_sql('ix_jobs_cache_key', 'jobs',
+                         "CREATE INDEX ix_jobs_cache_key ON jobs (cache_key) INCLUDE (status) "
+                         "WHERE cache_key IS NOT NULL"),
+    ]),
+    (7, 'job priorities and attempt counts', [
+        "ALTER TABLE jobs ADD priority INT NOT NULL CONSTRAINT df_jobs_priority DEFAULT 0",
+        "ALTER TABLE jobs ADD attempts INT NOT NULL CONSTRAINT df_jobs_attempts DEFAULT 0",
+        # Claiming now orders by priority, so the index leads with it after status
+        create_index_sql('ix_jobs_status_priority', 'jobs',
+                         "CREATE INDEX ix_jobs_status_priority ON jobs (status, priority DESC, created_at)"),
+        "IF EXISTS (SELECT * FROM sys.indexes WHERE name = 'ix_jobs_status_created_at' "
+        "AND object_id = OBJECT_ID('jobs')) DROP INDEX ix_jobs_status_created_at ON jobs",
+    ]),
+    (8, 'per-job stage timings', [
+        "ALTER TABLE jobs ADD timings NVARCHAR(MAX) NULL",
+    ]),
+    (9, 'render batches', [
+        "ALTER TABLE jobs ADD batch_id UNIQUEIDENTIFIER NULL",
+        create_index_sql('ix_jobs_batch_id', 'jobs',
+                         "CREATE INDEX ix_jobs_batch_id ON jobs (batch_id) INCLUDE (status) "
+                         "WHERE batch_id IS NOT NULL"),
+    ]),
+    (10, 'upload session activity', [
+        # Sessions idle past UPLOAD_SESSION_HOURS are abandoned; existing rows start the clock now
+        "ALTER TABLE upload_sessions ADD updated_at DATETIME NOT NULL "
+        "CONSTRAINT df_upload_sessions_updated_at DEFAULT GETDATE() WITH VALUES",
+    ]),
+    (11, 'finished job retention', [
+        create_index_sql('ix_jobs_finished_at', 'jobs',
+                         "CREATE INDEX ix_jobs_finished_at ON jobs (finished_at) INCLUDE (status) "
+                         "WHERE finished_at IS NOT NULL"),
+    ]),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='schema_migrations')
+    CREATE TABLE schema_migrations (
+        version INT PRIMARY KEY,
+        description NVARCHAR(255) NOT NULL,
+        applied_at DATETIME2 DEFAULT SYSUTCDATETIME()
+    )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def lock_migrations(cursor):
+    """Serialize concurrent deploys on an application lock held for this transaction"""
+    if not get_applock(cursor, 'schema_migrations', 60000):
+        raise RuntimeError("Timed out waiting for the schema_migrations lock")
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, each in its own transaction; returns versions applied"""
+    cursor = conn.cursor()
+    lock_migrations(cursor)
+    done = applied_versions(cursor)
+    conn.commit()
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        lock_migrations(cursor)
+        # Another process may have applied it while we waited for the lock
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = ?", version)
+        if cursor.fetchone():
+            conn.commit()
+            continue
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (?, ?)", (version, description))
+        conn.commit()
+        applied.append(version)
+        logger.info(f"Applied migration {version}: {description}")
+    return applied
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    with get_db_connection() as conn:
+        versions = migrate(conn)
+    logger.info(f"Schema up to date ({len(versions)} migration(s) applied)")
@@ -0,0 +1,157 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from db import get_db_connection
+from cleanup import cleanup_files, enforce_quota, ORPHAN_MINUTES, UPLOAD_SESSION_HOURS, DISK_QUOTA_MB
+
+logger = logging.getLogger('ExpiryScheduler')
+
+EXPIRY_REFRESH_INTERVAL = float(os.getenv('EXPIRY_REFRESH_INTERVAL', 15))  # seconds between scans for new rows
+# Expirations this close together share one cleanup cycle, so bursts become one batch of deletes
+EXPIRY_COALESCE = float(os.getenv('EXPIRY_COALESCE', 5))  # seconds
+QUOTA_INTERVAL = float(os.getenv('QUOTA_INTERVAL', 60))  # seconds between disk usage checks
+REFRESH_PAGE = 5000
+EPOCH = '1900-01-01'
+
+
+class ExpiryScheduler:
+    """Run cleanup when rows expire rather than on a fixed poll.
+
+    Keeps a min-heap of upcoming due times (monotonic seconds, one entry per distinct second).
+    It is rebuilt from the database on start, then refresh() polls every EXPIRY_REFRESH_INTERVAL
+    for rows added or extended since, through the expires_at and created_at indexes and the upload
+    sessions' last writes. Inserts happen in other processes (render workers, other web workers),
+    so nothing calls add() directly; rows expire minutes after they are written, so the poll's lag
+    doesn't delay cleanup.
+    """
+
+    def __init__(self, quota_mb=None):
+        self.quota_mb = DISK_QUOTA_MB if quota_mb is None else quota_mb
+        self._heap = []
+        self._seconds = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        # Highest expires_at / created_at / updated_at already scheduled; later rows are new or extended
+        self._processed_mark = EPOCH
+        self._original_mark = EPOCH
+        self._session_mark = EPOCH
+
+    def add(self, delay):
+        """Schedule a cleanup `delay` seconds from now"""
+        due = int(time.monotonic() + max(delay, 0)) + 1
+        with self._lock:
+            if due in self._seconds:
+                return
+            self._seconds.add(due)
+            heapq.heappush(self._heap, due)
+        self._wake.set()
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove every entry due by `now`; returns how many there were"""
+        count = 0
+        with self._lock:
+            while self._heap and self._heap[0] <= now:
+                self._seconds.discard(heapq.heappop(self._heap))
+                count += 1
+        return count
+
+    def refresh(self):
+        """Schedule rows inserted or extended since the last refresh; returns the number seen"""
+        seen = 0
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Delays come from the database clock, the same one cleanup_files compares against
+            while True:
+                cursor.execute("""
+                    SELECT TOP (?) expires_at, DATEDIFF_BIG(millisecond, SYSUTCDATETIME(), expires_at)
+                    FROM processed_files
+                    WHERE expires_at > ?
+                    ORDER BY expires_at
+                """, (REFRESH_PAGE, self._processed_mark))
+                rows = cursor.fetchall()
+                for expires_at, delay_ms in rows:
+                    self.add(delay_ms / 1000)
+                if rows:
+                    self._processed_mark = rows[-1][0]
+                seen += len(rows)
+                if len(rows) < REFRESH_PAGE:
+                    break
+            while True:
+                cursor.execute(f"""
+                    SELECT TOP (?) created_at,
+                           DATEDIFF_BIG(millisecond, GETDATE(), DATEADD(minute, {ORPHAN_MINUTES}, created_at))
+                    FROM original_files
+                    WHERE created_at > ?
+                    ORDER BY created_at
+                """, (REFRESH_PAGE, self._original_mark))
+                rows = cursor.fetchall()
+                for created_at, delay_ms in rows:
+                    self.add(delay_ms / 1000)
+                if rows:
+                    self._original_mark = rows[-1][0]
+                seen += len(rows)
+                if len(rows) < REFRESH_PAGE:
+                    break
+            while True:
+                cursor.execute(f"""
+                    SELECT TOP (?) updated_at,
+                           DATEDIFF_BIG(millisecond, GETDATE(), DATEADD(hour, {UPLOAD_SESSION_HOURS}, updated_at))
+                    FROM upload_sessions
+                    WHERE updated_at > ?
+                    ORDER BY updated_at
+                """, (REFRESH_PAGE, self._session_mark))
+                rows = cursor.fetchall()
+                for updated_at, delay_ms in rows:
+                    self.add(delay_ms / 1000)
+                if rows:
+                    self._session_mark = rows[-1][0]
+                seen += len(rows)
+                if len(rows) < REFRESH_PAGE:
+                    break
+        return seen
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def run(self):
+        """Loop until stop(): clean up as entries fall due, rescan for new rows, enforce the quota"""
+        logger.info(f"Expiry scheduler started (quota {self.quota_mb or 'off'}MB)")
+        next_refresh = next_quota = next_cleanup = 0
+        while not self._stopped:
+            now = time.monotonic()
+            try:
+                if now >= next_refresh:
+                    self.refresh()
+                    next_refresh = now + EXPIRY_REFRESH_INTERVAL
+                # Wait out the coalescing window after the first due entry so neighbours join it
+                due = self.next_due()
+                if due is not None and due + EXPIRY_COALESCE <= now and now >= next_cleanup:
+                    # Entries stay queued until a cycle has actually covered them; the refresh
+                    # marks are past their rows, so nothing else would schedule them again
+                    if cleanup_files():
+                        logger.info(f"Cleanup covered {self.pop_due(now)} expiration(s)")
+                    else:
+                        next_cleanup = now + EXPIRY_COALESCE
+                if self.quota_mb and now >= next_quota:
+                    enforce_quota(self.quota_mb)
+                    next_quota = now + QUOTA_INTERVAL
+            except Exception as e:
+                logger.error(f"Scheduler cycle failed: {str(e)}")
+                # Retry after the intervals instead of spinning on a broken connection
+                next_refresh = now + EXPIRY_REFRESH_INTERVAL
+                next_cleanup = now + EXPIRY_COALESCE
+                next_quota = now + QUOTA_INTERVAL
+
+            due = self.next_due()
+            deadlines = [next_refresh, *([next_quota] if self.quota_mb else []),
+                         *([max(due + EXPIRY_COALESCE, next_cleanup)] if due is not None else [])]
+            self._wake.wait(max(0.0, min(deadlines) - time.monotonic()))
+            self._wake.clear()
@@ -0,0 +1,22 @@
+#!/bin/sh
+# App Service startup command (set by the deploy workflow): migrate the schema, start the render
+# worker pool, then serve. Migrations take an application lock, so instances starting together
+# apply them once; workers claim jobs with READPAST, so every instance can run its own pool.
+set -e
+python migrations.py
+
+# worker.py restarts its render processes itself; this loop brings the supervisor back if it
+# dies. Set RUN_WORKER=0 where the pool runs as a separate App Service or WebJob instead.
+if [ "${RUN_WORKER:-1}" = "1" ]; then
+    (
+        while true; do
+            python worker.py || echo "worker.py exited with code $?, restarting in 5s" >&2
+            sleep 5
+        done
+    ) &
+fi
+
+# Threaded workers, so job event streams and long-polls only hold a thread each; they hold no
+# database connection between polls, so the default pool of 5 covers the threads
+exec gunicorn --bind=0.0.0.0:${PORT:-8000} --timeout 600 \
+    --workers ${WEB_WORKERS:-2} --worker-class gthread --threads ${WEB_THREADS:-8} app:app
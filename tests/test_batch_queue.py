@@ -0,0 +1,114 @@
+"""A batch's shorts are queued in one transaction, so a worker never claims part of a batch."""
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, UTC
+import pytest
+
+pytest.importorskip('pyodbc')
+pytest.importorskip('flask_cors')
+for name in ('SQL_SERVER', 'SQL_DATABASE', 'SQL_USERNAME', 'SQL_PASSWORD'):
+    os.environ.setdefault(name, 'test')
+os.environ['CLEANUP_IN_APP'] = '0'
+
+import app as app_module  # noqa: E402
+from jobs import claim_batch, RUNNING  # noqa: E402
+
+
+class Store:
+    """Committed rows of the jobs table, shared by every connection"""
+
+    def __init__(self):
+        self.jobs = []
+        self.on_insert = None
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        params = params if isinstance(params, tuple) else (params,)
+        self.rows = []
+        if 'sp_getapplock' in sql:
+            self.rows = [(0,)]
+        elif 'FROM original_files' in sql:
+            self.rows = [(uuid.uuid4(), 'a' * 64)]
+        elif 'INSERT INTO jobs' in sql:
+            job_id, status, payload, cache_key, priority, batch_id = params
+            job = {'id': job_id, 'status': status, 'payload': payload, 'batch_id': batch_id,
+                   'created_at': datetime.now(UTC)}
+            self.conn.pending.append(job)
+            if self.conn.store.on_insert is not None:
+                self.conn.store.on_insert(job)
+        elif sql.lstrip().startswith('UPDATE jobs WITH (UPDLOCK, READPAST, ROWLOCK)'):
+            # claim_batch: only committed rows are visible to another connection
+            status, worker, batch_id, queued = params
+            for job in self.conn.store.jobs:
+                if job['batch_id'] == batch_id and job['status'] == queued:
+                    job['status'] = status
+                    self.rows.append((job['id'], job['payload'], job['created_at']))
+        return self
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class Connection:
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.store.jobs.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = Store()
+
+    @contextmanager
+    def get_db_connection():
+        conn = Connection(store)
+        yield conn
+        conn.commit()
+
+    monkeypatch.setattr(app_module, 'get_db_connection', get_db_connection)
+    return store
+
+
+@pytest.fixture
+def client(store, tmp_path):
+    app = app_module.create_app({'UPLOAD_FOLDER': str(tmp_path / 'uploads'), 'DOWNLOADS': str(tmp_path / 'downloads'),
+                                 'CLEANUP_IN_APP': False})
+    return app.test_client()
+
+
+def test_claim_never_sees_a_partial_batch(client, store):
+    claims = []
+
+    def claim_during_insert(job):
+        # A worker polling on its own connection while the request is still queueing shorts
+        claims.append(len(claim_batch(Connection(store), job['batch_id'], 'worker-1')))
+
+    store.on_insert = claim_during_insert
+    shorts = [{'title': f"Short {i}", 'segments': [{'start': i, 'end': i + 5, 'order': 0}]} for i in range(3)]
+    response = client.post('/api/process/batch', json={'source': '/uploads/source.mp4', 'shorts': shorts})
+
+    assert response.status_code == 202
+    assert claims == [0, 0, 0]
+    claimed = claim_batch(Connection(store), uuid.UUID(response.get_json()['batchId']), 'worker-1')
+    assert len(claimed) == 3
+    assert {job['status'] for job in store.jobs} == {RUNNING}
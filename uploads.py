@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+from metrics import registry
+
+CHUNK_SIZE = 1024 * 1024
+
+# Running SHA-256 per upload session in this process: id -> (bytes hashed, hasher)
+_hashers = {}
+
+# Byte rate is rate(upload_bytes_total) / rate(upload_seconds_total)
+UPLOAD_BYTES = registry.counter('upload_bytes_total', 'Bytes received from upload request bodies')
+UPLOAD_SECONDS = registry.counter('upload_seconds_total', 'Time spent receiving upload request bodies')
+
+
+def write_stream(stream, f, hasher, limit=None):
+    """Copy a stream into an open file while hashing it; returns the number of bytes written"""
+    written = 0
+    started = time.perf_counter()
+    while True:
+        size = CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit - written)
+        if size <= 0:
+            break
+        try:
+            chunk = stream.read(size)
+        except Exception:
+            # The client went away; keep what arrived so the upload can resume from here
+            break
+        if not chunk:
+            break
+        f.write(chunk)
+        hasher.update(chunk)
+        written += len(chunk)
+    UPLOAD_BYTES.inc(written)
+    UPLOAD_SECONDS.inc(time.perf_counter() - started)
+    return written
+
+
+def hash_prefix(path, length):
+    """Hash the first `length` bytes of a file, used when resuming in another process"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def register_original(conn, filename, path, content_hash, size):
+    """Insert an original_files row, reusing an identical stored blob when there is one.
+
+    Returns (file_id, filename, path) of the file the row points at.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT filename, path FROM blobs WITH (UPDLOCK, HOLDLOCK) WHERE content_hash = ?
+    """, content_hash)
+    blob = cursor.fetchone()
+    if blob and os.path.exists(blob[1]):
+        # Identical content is already stored: drop the new copy and share the existing file
+        if os.path.abspath(blob[1]) != os.path.abspath(path):
+            os.remove(path)
+        filename, path = blob
+        cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE content_hash = ?", content_hash)
+    else:
+        if blob:
+            cursor.execute("DELETE FROM blobs WHERE content_hash = ?", content_hash)
+        cursor.execute("""
+            INSERT INTO blobs (content_hash, filename, path, size, ref_count)
+            VALUES (?, ?, ?, ?, 1)
+        """, (content_hash, filename, path, size))
+
+    file_id = uuid.uuid4()
+    cursor.execute("""
+        INSERT INTO original_files (id, filename, path, content_hash)
+        VALUES (?, ?, ?, ?)
+    """, (file_id, filename, path, content_hash))
+    conn.commit()
+    return file_id, filename, path
+
+
+def get_crop(conn, filename):
+    """Stored crop of an original: None if not analysed yet, '' if it has no black bars"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT TOP (1) crop FROM original_files WHERE filename = ?
+        ORDER BY CASE WHEN crop IS NULL THEN 1 ELSE 0 END
+    """, filename)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def save_crop(conn, filename, crop):
+    """Record the crop on every original_files row sharing the stored file"""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE original_files SET crop = ? WHERE filename = ?", (crop, filename))
+    conn.commit()
+
+
+def release_blobs(cursor, paths):
+    """Drop one reference per entry in paths; returns the paths nothing uses any more"""
+    if not paths:
+        return set()
+    cursor.execute("""
+        UPDATE b SET ref_count = b.ref_count - r.refs
+        OUTPUT inserted.path, inserted.ref_count
+        FROM blobs b
+        JOIN (SELECT value AS path, COUNT(*) AS refs FROM OPENJSON(?) GROUP BY value) r ON b.path = r.path
+    """, json.dumps(list(paths)))
+    counts = dict(cursor.fetchall())
+    cursor.execute("DELETE FROM blobs WHERE ref_count <= 0")
+    # Files stored before deduplication existed have no blob row and are always deletable
+    return {path for path in paths if counts.get(path, 0) <= 0}
+
+
+def create_session(conn, filename, path, length):
+    session_id = uuid.uuid4()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO upload_sessions (id, filename, path, length)
+        VALUES (?, ?, ?, ?)
+    """, (session_id, filename, path, length))
+    conn.commit()
+    # Create the file so the first PATCH can open it for update
+    open(path, 'wb').close()
+    _hashers[str(session_id)] = (0, hashlib.sha256())
+    return session_id
+
+
+def get_session(conn, session_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT filename, path, length, received FROM upload_sessions WHERE id = ?", session_id)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {'id': str(session_id), 'filename': row[0], 'path': row[1], 'length': row[2], 'received': row[3]}
+
+
+def append_to_session(conn, session, stream):
+    """Write the next chunk at the session's offset and return the new offset"""
+    from db import get_applock
+
+    key = session['id']
+    cursor = conn.cursor()
+    # Only one request writes the file at a time; the lock goes with the commit below
+    if not get_applock(cursor, f"upload:{key}"):
+        raise ValueError("Another request is writing this upload")
+    # Touching the row also locks it, so session expiry in cleanup passes over it meanwhile
+    cursor.execute("UPDATE upload_sessions SET updated_at = GETDATE() OUTPUT inserted.received WHERE id = ?", key)
+    row = cursor.fetchone()
+    if row is None or row[0] != session['received']:
+        raise ValueError("Upload offset changed concurrently")
+
+    offset, hasher = _hashers.get(key, (None, None))
+    if offset != session['received']:
+        hasher = hash_prefix(session['path'], session['received'])
+
+    with open(session['path'], 'r+b') as f:
+        f.seek(session['received'])
+        f.truncate()
+        written = write_stream(stream, f, hasher, limit=session['length'] - session['received'])
+
+    received = session['received'] + written
+    cursor.execute("""
+        UPDATE upload_sessions SET received = ? WHERE id = ? AND received = ?
+    """, (received, session['id'], session['received']))
+    if cursor.rowcount != 1:
+        conn.rollback()
+        _hashers.pop(key, None)
+        raise ValueError("Upload offset changed concurrently")
+    conn.commit()
+    _hashers[key] = (received, hasher)
+    return received, hasher
+
+
+def finish_session(conn, session, hasher):
+    """Register the completed upload and forget the session"""
+    registered = register_original(conn, session['filename'], session['path'], hasher.hexdigest(), session['length'])
+    _hashers.pop(session['id'], None)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM upload_sessions WHERE id = ?", session['id'])
+    conn.commit()
+    return registered
@@ -0,0 +1,387 @@
+import os
+import time
+import socket
+import logging
+import signal
+import cProfile
+import resource
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime, timedelta, UTC
+from urllib.parse import urlencode
+from db import get_db_connection
+from jobs import (claim_job, claim_batch, enqueue_job, update_progress, finish_job, fail_job, requeue_running,
+                  save_timings, PRIORITY_ASSETS)
+from metrics import JobTrace, record_job, serve as serve_metrics
+from uploads import register_original, get_crop, save_crop
+from WhisperModels import warm_up, available_memory_mb, stats as model_stats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('RenderWorker')
+
+# Get environment variables
+FILE_LIFETIME = int(os.getenv('FILE_LIFETIME', 30))  # minutes
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))  # seconds
+PROGRESS_INTERVAL = float(os.getenv('JOB_PROGRESS_INTERVAL', 1))  # seconds
+# Every job runs in its own child process with these limits; 0 disables a limit
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', 3600))  # wall seconds before the job is killed
+JOB_CPU_SECONDS = int(os.getenv('JOB_CPU_SECONDS', 0))  # RLIMIT_CPU of the job process
+JOB_MEMORY_MB = int(os.getenv('JOB_MEMORY_MB', 8192))  # address space per job process above the worker's own
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))  # claims before a job that kills its worker fails
+# Admission: leave jobs queued for other hosts while this one is short of memory or CPU
+JOB_MIN_AVAILABLE_MB = int(os.getenv('JOB_MIN_AVAILABLE_MB', 2048))
+JOB_MAX_LOAD = float(os.getenv('JOB_MAX_LOAD', 1.5))  # 1-minute load average per core
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 9101))  # Prometheus /metrics, 0 disables
+# Jobs submitted with cprofile set write <job id>.prof here; unset ignores the flag
+JOB_PROFILE_DIR = os.getenv('JOB_PROFILE_DIR')
+
+# Timing records of finished jobs, from job processes to the supervisor that serves /metrics
+_records = None
+
+
+def worker_name(pid=None):
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+def progress_reporter(conn, job_id):
+    """Return a progress(stage, fraction) callback that writes to the jobs row at most once a second"""
+    last_update = [0.0, None]
+
+    def progress(stage, fraction):
+        # Throttle writes so per-frame callbacks don't flood the database
+        now = time.monotonic()
+        if stage == last_update[1] and now - last_update[0] < PROGRESS_INTERVAL:
+            return
+        last_update[0], last_update[1] = now, stage
+        update_progress(conn, job_id, stage, round(fraction, 4))
+
+    return progress
+
+
+def run_ingest(conn, job_id, payload, trace):
+    """Download a URL into the upload folder and register it as an original"""
+    from ingest import ingest_url
+
+    report = progress_reporter(conn, job_id)
+    with trace.stage('download') as stage:
+        size, hasher = ingest_url(payload['url'], payload['path'], payload['max_size'],
+                                  progress=lambda fraction: report('downloading', fraction))
+        stage['bytes'] = size
+    report('hashing', 1)
+    file_id, filename, path = register_original(conn, payload['filename'], payload['path'], hasher.hexdigest(), size)
+    proxy_task_id = enqueue_job(conn, {'kind': 'proxy', 'filename': filename, 'path': path},
+                                priority=PRIORITY_ASSETS)
+    finish_job(conn, job_id, {
+        'fileId': str(file_id),
+        'videoName': filename,
+        'videoUrl': f"/api/uploads/{filename}",
+        'proxyTaskId': str(proxy_task_id)
+    })
+
+
+def source_crop(conn, path):
+    """Black bar crop of an original, detected on first use and stored with its file record"""
+    from EditVideo import detect_crop, format_crop, parse_crop
+
+    filename = os.path.basename(path)
+    crop = get_crop(conn, filename)
+    if crop is None:
+        crop = format_crop(detect_crop(path))
+        save_crop(conn, filename, crop)
+        logger.info(f"Detected crop {crop or 'none'} for {filename}")
+    return parse_crop(crop)
+
+
+def run_proxy(conn, job_id, payload, trace):
+    """Analyse a new original: black bar crop, then the preview proxy, sprite sheet and waveform"""
+    from Proxy import generate_assets
+
+    report = progress_reporter(conn, job_id)
+    report('crop', 0)
+    with trace.stage('crop'):
+        crop = source_crop(conn, payload['path'])
+    with trace.stage('assets'):
+        manifest = generate_assets(payload['path'], progress=lambda fraction: report('proxy', fraction))
+    base = f"/api/uploads/{payload['filename']}"
+    finish_job(conn, job_id, {
+        'proxyUrl': f"{base}/proxy",
+        'spriteUrl': f"{base}/sprite",
+        'waveformUrl': f"{base}/waveform",
+        'sprite': manifest['sprite'],
+        'crop': list(crop) if crop else None
+    })
+
+
+def run_job(conn, job_id, payload, trace):
+    """Run a claimed job: URL ingests are downloaded, proxies built, everything else is rendered"""
+    if payload.get('kind') == 'ingest':
+        return run_ingest(conn, job_id, payload, trace)
+    if payload.get('kind') == 'proxy':
+        return run_proxy(conn, job_id, payload, trace)
+
+    from makeVid import make_vid
+
+    progress = progress_reporter(conn, job_id)
+    make_vid(payload['segments'], payload['input_path'], payload['output_path'], progress=progress,
+             model_size=payload.get('model'), preview=payload.get('preview', False),
+             profile=payload.get('profile'), crop=source_crop(conn, payload['input_path']), trace=trace)
+    record_render(conn, job_id, payload)
+
+
+def run_batch(conn, jobs, trace):
+    """Render the shorts of a batch together: one transcript read and one decode of each source second"""
+    from BatchRender import render_batch
+
+    first = jobs[0][1]
+    reporters = [progress_reporter(conn, job_id) for job_id, _ in jobs]
+
+    def progress(stage, fraction):
+        for report in reporters:
+            report(stage, fraction)
+
+    shorts = [{'segments': payload['segments'], 'output_path': payload['output_path'],
+               'profile': payload.get('profile')} for _, payload in jobs]
+    render_batch(shorts, first['input_path'], progress=progress, model_size=first.get('model'),
+                 crop=source_crop(conn, first['input_path']), trace=trace)
+    for job_id, payload in jobs:
+        record_render(conn, job_id, payload)
+
+
+def record_render(conn, job_id, payload):
+    """Register a finished render as a processed file and complete its job"""
+    expires_at = datetime.now(UTC) + timedelta(minutes=FILE_LIFETIME)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO processed_files
+        (id, filename, title, path, original_id, expires_at, cache_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (job_id, payload['output_filename'], payload['title'], payload['output_path'],
+          payload.get('original_id'), expires_at, payload.get('cache_key')))
+    conn.commit()
+
+    video_url = f"/api/download/{payload['output_filename']}"
+    if payload.get('download_name'):
+        video_url += f"?{urlencode({'name': payload['download_name']})}"
+    finish_job(conn, job_id, {
+        'videoUrl': video_url,
+        'filename': payload['output_filename'],
+        'expires_at': expires_at.isoformat()
+    })
+
+
+def address_space_mb():
+    """VmSize of this process from /proc/self/status in MB, or None where it isn't exposed"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def apply_limits():
+    """Limit the current (job) process; ffmpeg subprocesses inherit the same limits"""
+    # Own process group, so a timeout kills the job's ffmpeg children along with it
+    os.setpgrp()
+    current = address_space_mb()
+    if JOB_MEMORY_MB and current is not None:
+        # Relative to the forked image, which already maps the warm whisper models
+        limit = (current + JOB_MEMORY_MB) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if JOB_CPU_SECONDS:
+        # SIGXCPU at the soft limit, SIGKILL shortly after if it is ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (JOB_CPU_SECONDS, JOB_CPU_SECONDS + 5))
+
+
+def admit():
+    """Whether this host has room for another job right now"""
+    available = available_memory_mb()
+    if available is not None and available < JOB_MIN_AVAILABLE_MB:
+        return False
+    return os.getloadavg()[0] < (os.cpu_count() or 1) * JOB_MAX_LOAD
+
+
+def fail_running(jobs, error):
+    """Fail the jobs still running on a fresh connection; the one the job used may be what broke,
+    or may have sat idle long enough to be dropped"""
+    with get_db_connection() as conn:
+        return [fail_job(conn, member_id, error, only_running=True) for member_id, _ in jobs]
+
+
+def job_process(job_id, payload, members=()):
+    """Child process body: run one job (or a batch of renders) under limits and record its outcome"""
+    apply_limits()
+    jobs = [(job_id, payload), *members]
+    trace = JobTrace(job_id, 'batch' if payload.get('batch_id') else payload.get('kind', 'render'))
+    # Counters inherited from the worker; the difference is this job's use of the warm models
+    models_before = model_stats()
+    status = 'failed'
+    profiler = cProfile.Profile() if JOB_PROFILE_DIR and payload.get('cprofile') else None
+    with get_db_connection() as conn:
+        # The pid is visible on the job while it runs, e.g. for py-spy dump/record --pid
+        for member_id, _ in jobs:
+            save_timings(conn, member_id, {'pid': os.getpid(), 'status': 'running'})
+        logger.info(f"Job {job_id} running in pid {os.getpid()}")
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                if payload.get('batch_id'):
+                    run_batch(conn, jobs, trace)
+                else:
+                    run_job(conn, job_id, payload, trace)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            status = 'done'
+        except MemoryError:
+            conn.rollback()
+            fail_running(jobs, f"Out of memory (limit {JOB_MEMORY_MB} MB)")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}\n{traceback.format_exc()}")
+            conn.rollback()
+            fail_running(jobs, str(e))
+        summary = trace.summary(status)
+        models_after = model_stats()
+        summary['whisper'] = {key: round(models_after[key] - models_before[key], 3)
+                              for key in ('hits', 'misses', 'load_seconds')}
+        if profiler is not None:
+            os.makedirs(JOB_PROFILE_DIR, exist_ok=True)
+            summary['profile'] = os.path.join(JOB_PROFILE_DIR, f"{job_id}.prof")
+            profiler.dump_stats(summary['profile'])
+        for member_id, _ in jobs:
+            save_timings(conn, member_id, summary)
+    if _records is not None:
+        _records.put(summary)
+
+
+def exit_reason(exitcode):
+    """Failure message for a job process that died without recording an outcome"""
+    if exitcode == -signal.SIGXCPU:
+        return f"CPU time limit of {JOB_CPU_SECONDS}s exceeded"
+    if exitcode == -signal.SIGKILL:
+        return "Killed, most likely out of memory"
+    if exitcode < 0:
+        return f"Killed by {signal.Signals(-exitcode).name}"
+    return f"Exited with code {exitcode}"
+
+
+def run_isolated(job_id, payload, members=()):
+    """Run a job in a forked child so a crash, runaway memory or hang fails only that job (and
+    the other members of its batch)"""
+    # fork keeps the warm whisper models; the connection pool reopens connections in the child
+    process = multiprocessing.get_context('fork').Process(target=job_process, args=(job_id, payload, members))
+    started = time.monotonic()
+    process.start()
+    process.join(JOB_TIMEOUT or None)
+    if process.is_alive():
+        error = f"Timed out after {JOB_TIMEOUT:.0f}s"
+    elif process.exitcode != 0:
+        error = exit_reason(process.exitcode)
+    else:
+        error = None
+    # Take down anything left in the job's process group, e.g. ffmpeg after the job was killed
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.join()
+    if error is None:
+        return True
+    if fail_running([(job_id, payload), *members], error)[0]:
+        logger.error(f"Job {job_id} failed: {error}")
+        if _records is not None:
+            _records.put({'job_id': str(job_id), 'kind': payload.get('kind', 'render'), 'pid': process.pid,
+                          'status': 'killed', 'seconds': round(time.monotonic() - started, 3),
+                          'cpu_seconds': 0, 'peak_rss_mb': 0, 'stages': [], 'error': error})
+    return False
+
+
+def worker_loop(records=None):
+    """Pull queued jobs until the process is stopped"""
+    global _records
+    _records = records
+    name = worker_name()
+    logger.info(f"Render worker {name} started")
+    try:
+        started = time.monotonic()
+        warm_up()
+        logger.info(f"Worker {name} warmed up in {time.monotonic() - started:.1f}s, "
+                    f"whisper models: {model_stats()['loaded']}")
+    except Exception as e:
+        logger.error(f"Whisper warm-up failed: {str(e)}")
+    while True:
+        try:
+            if not admit():
+                time.sleep(POLL_INTERVAL)
+                continue
+            # The connection goes back to the pool before the job runs; holding it idle through an
+            # hour-long join risks Azure SQL dropping it before the outcome is written
+            with get_db_connection() as conn:
+                claimed = claim_job(conn, name)
+                if claimed is not None:
+                    job_id, payload = claimed
+                    # The rest of a batch comes along, so its shorts share one decode
+                    members = claim_batch(conn, payload['batch_id'], name) if payload.get('batch_id') else []
+            if claimed is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            logger.info(f"Worker {name} running {payload.get('kind', 'render')} job {job_id}"
+                        f"{f' with {len(members)} more of its batch' if members else ''}")
+            started = time.monotonic()
+            if run_isolated(job_id, payload, members):
+                logger.info(f"Job {job_id} finished in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Worker {name} error: {str(e)}")
+            time.sleep(POLL_INTERVAL)
+
+
+def collect_records(records):
+    """Fold job timing records from every pool process into this process's metrics"""
+    while True:
+        summary = records.get()
+        try:
+            record_job(summary)
+        except Exception as e:
+            logger.error(f"Bad timing record: {str(e)}")
+
+
+def main():
+    """Keep RENDER_WORKERS render processes alive, requeueing jobs of any that die"""
+    logger.info(f"Starting render pool with {RENDER_WORKERS} workers")
+    records = multiprocessing.Queue()
+    threading.Thread(target=collect_records, args=(records,), daemon=True).start()
+    if WORKER_METRICS_PORT:
+        serve_metrics(WORKER_METRICS_PORT)
+    processes = []
+    for _ in range(RENDER_WORKERS):
+        process = multiprocessing.Process(target=worker_loop, args=(records,))
+        process.start()
+        processes.append(process)
+
+    while True:
+        time.sleep(POLL_INTERVAL)
+        for i, process in enumerate(processes):
+            if process.is_alive():
+                continue
+            logger.error(f"Render worker {process.pid} exited with code {process.exitcode}, restarting")
+            try:
+                with get_db_connection() as conn:
+                    requeued = requeue_running(conn, worker_name(process.pid), JOB_MAX_ATTEMPTS)
+                    if requeued:
+                        logger.info(f"Requeued {requeued} job(s) from worker {process.pid}")
+            except Exception as e:
+                logger.error(f"Failed to requeue jobs: {str(e)}")
+            replacement = multiprocessing.Process(target=worker_loop, args=(records,))
+            replacement.start()
+            processes[i] = replacement
+
+
+if __name__ == '__main__':
+    main()